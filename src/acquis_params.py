@@ -22,6 +22,7 @@ import itertools as it
 import time
 import time_stamp as t_s
 import pv_control as p_c 
+import checkpoint as ckp
 
 def detOS():
     """ Determine if the operating system is Windows or Linux.
@@ -47,6 +48,10 @@ def mkOutDirs(outDirStr, detIOCList, timeStamp):
     if not os.path.exists(outDirStr):
         os.mkdir(outDirStr)
 
+    # The detector IOC share dirs are only reachable from Windows.
+    if detOS():
+        return
+
     for detIOC in detIOCList:
         outBase = "\\\%s\\share\\" %(detIOC)
         detDirStr = os.path.join(outBase, timeStamp)
@@ -54,6 +59,61 @@ def mkOutDirs(outDirStr, detIOCList, timeStamp):
         if not os.path.exists(detDirStr):
             os.mkdir(detDirStr)
 
+class PVLogBuffer(object):
+    """ Hold the PV log lines written by one IOC worker so that they
+        can be merged into the PV log file in a fixed order.
+    """
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+def runPerIOC(func, detIOCList, pvLogFile, parallel):
+    """ Call func(detIOC, pvLogFile) for each detector IOC.
+        If parallel, there is one worker thread per IOC and the PV log
+        lines are merged afterwards in the order of detIOCList.
+    """
+    if not parallel:
+        for detIOC in detIOCList:
+            func(detIOC, pvLogFile)
+        return
+
+    logBuffers = [PVLogBuffer() for detIOC in detIOCList]
+    iocTimes = [None] * len(detIOCList)
+    errors = []
+
+    def worker(index, detIOC):
+        startTime = time.time()
+        try:
+            func(detIOC, logBuffers[index])
+        except Exception as e:
+            errors.append((detIOC, e))
+        iocTimes[index] = time.time() - startTime
+
+    startTime = time.time()
+    threads = [p_c.newThread(worker, (index, detIOC)) for index, detIOC in enumerate(detIOCList)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Merge the PV log lines in a deterministic order.
+    if pvLogFile is not None:
+        for logBuffer in logBuffers:
+            for line in logBuffer.lines:
+                pvLogFile.write(line)
+
+    for detIOC, iocTime in zip(detIOCList, iocTimes):
+        print 'Configured %s in %f s ...' %(detIOC, iocTime)
+    print 'Configured all IOCs in %f s ...' %(time.time() - startTime)
+
+    # Raise the first error so it is not lost in the worker thread.
+    if errors:
+        detIOC, e = errors[0]
+        print 'Configuring %s failed ...' %(detIOC)
+        raise e
+
 def setReadBack(detIOC, dxpVer, pvLogFile, logPVs, verbose):
     """ These are the usual values for the read-back parameter PVs.
     """
@@ -117,19 +177,23 @@ def setWaitForMCAs(mcaList, scanIOC, mcaIOC, detIOCList, detector, pvLogFile, lo
     """ The MCAs must be written
     """
     # First, clear them all.
+    pvs2Clear = []
     for index in np.arange(70):
         listIndex = '%02i' %(index + 1)
         pv2Set = '%s%s%s%s%s' %(scanIOC, ':', 'scanH.D', str(listIndex), 'PV')
         val2Write = ''
-        p_c.caputPV(pv2Set, val2Write, pvLogFile, False, verbose)
+        pvs2Clear.append((pv2Set, val2Write))
+    p_c.caputMany(pvs2Clear, pvLogFile, False, verbose)
             
     # Add the MCAs to the detectors list.
+    pvs2Set = []
     for mcaIndex, mca in enumerate(mcaList):
         # Have to add 1 as m it starts from 0.
         listIndex = '%02i' %(mcaIndex + 1)
         pv2Set = '%s%s%s%s%s' %(scanIOC, ':', 'scanH.D', str(listIndex), 'PV')
         val2Write = '%s%s%s%s' %(mcaIOC, ':', 'mca', str(mca))
-        p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, val2Write))
+    p_c.caputMany(pvs2Set, pvLogFile, logPVs, verbose)
 
     """ The triggering of the detector readout depends on the detector.
     """
@@ -149,16 +213,18 @@ def setWaitForMCAs(mcaList, scanIOC, mcaIOC, detIOCList, detector, pvLogFile, lo
             val2Write = int(1)
             p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
             
+        pvs2Set = []
         for mcaIndex, mca in enumerate(mcaList):
             # Set the lower MCA limit in the spectrum for the current mca.
             pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'mca', str(mcaIndex + 1), '.R0LO')
             val2Write = int(1)
-            p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+            pvs2Set.append((pv2Set, val2Write))
 
             # Set the upper MCA limit in the spectrum for the current mca.
             pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'mca', str(mcaIndex + 1), '.R0HI')
             val2Write = int(2048)
-            p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+            pvs2Set.append((pv2Set, val2Write))
+        p_c.caputMany(pvs2Set, pvLogFile, logPVs, verbose)
 
         
 def getIOCs(detector, verbose):
@@ -361,6 +427,13 @@ def wait(waitTime):
     # The time should be in seconds.
     time.sleep(waitTime)
 
+def getMonitorTimeout(countTime):
+    # Return the time to wait for a monitor update before falling back to polling.
+    # Allow the count time plus some slack for the readout.
+    if countTime:
+        return countTime + 10.0
+    return 10.0
+
 def pollPV(pv2Get, pollTime):
     # The second while statement checks to see if the scan has stopped.
     while True:
@@ -370,14 +443,24 @@ def pollPV(pv2Get, pollTime):
         else:
             # Wait fixed time prior to polling again.
             wait(pollTime)
+
+def monitorPV(pv2Get, pollTime, timeout):
+    # Wait on a channel monitor for the PV to reset to 0.
+    if p_c.waitForValue(pv2Get, 0, timeout):
+        return
+    # No update arrived in time, so fall back to polling.
+    print 'No monitor update from %s after %f s, polling instead ...' %(pv2Get, timeout)
+    pollPV(pv2Get, pollTime)
             
 def checkScanStatus(scanType,
                     countTime,
                     scanIOC,
-                    detIOCList):
+                    detIOCList,
+                    useMonitor = True):
     assert (scanType == 'wait-for-mcas') ^ (scanType == 'mca-map') ^ (scanType == 'mca-spec')
 
     pollTime = getPollTime(countTime)
+    timeout = getMonitorTimeout(countTime)
     pv2Get = None
 
     if (scanType == 'wait-for-mcas') ^ (scanType == 'mca-spec'):
@@ -385,14 +468,20 @@ def checkScanStatus(scanType,
         pv2Get = '%s%s%s' %(scanIOC, ':', 'scan1.EXSC')
         assert pv2Get != None
         
-        pollPV(pv2Get, pollTime)
+        if useMonitor:
+            monitorPV(pv2Get, pollTime, timeout)
+        else:
+            pollPV(pv2Get, pollTime)
     
     elif scanType == 'mca-map':
         for detIOC in detIOCList:
             # Assume that the Acquiring PV has to reset to 0 for the scan to finish.
             pv2Get = '%s%s%s' %(detIOC, ':', 'Acquiring')
             assert pv2Get != None
-            pollPV(pv2Get, pollTime)  
+            if useMonitor:
+                monitorPV(pv2Get, pollTime, timeout)
+            else:
+                pollPV(pv2Get, pollTime)
             
 def configPreamps(detIOC, dxpVer, detector, pvLogFile, logPVs, verbose):
     """ Configure the preamplifier parameters.
@@ -424,25 +513,27 @@ def configPreamps(detIOC, dxpVer, detector, pvLogFile, logPVs, verbose):
     adcPerc = float(6.0)
 
     # Now set the values.
+    pvs2Set = []
     for chan in np.arange(chans) + 1:
         # Pre-amp gain in mV as a listfor the number of chans.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'PreampGain')
-        p_c.caputPV(pv2Set, gainList_mVperkeV[chan-1], pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, gainList_mVperkeV[chan-1]))
         # Pre-amp polarity.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'DetectorPolarity')
-        p_c.caputPV(pv2Set, pol, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, pol))
         # Pre-amp delay in micro sec.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'ResetDelay')
-        p_c.caputPV(pv2Set, delay_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, delay_us))
         # Decay time in micro sec.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'DecayTime')
-        p_c.caputPV(pv2Set, decay_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, decay_us))
         # Maximum energy of scale in keV. 
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'MaxEnergy')
-        p_c.caputPV(pv2Set, maxEn_keV, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, maxEn_keV))
         # ADC percent - recommended val is 6% 
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'ADCPercentRule')
-        p_c.caputPV(pv2Set, adcPerc, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, adcPerc))
+    p_c.caputMany(pvs2Set, pvLogFile, logPVs, verbose)
 
 def configDXPFilters(detIOC, dxpVer, detector, pvLogFile, logPVs, verbose):
     """ Configure the fast trigger, energy and baseline parameters.
@@ -478,43 +569,45 @@ def configDXPFilters(detIOC, dxpVer, detector, pvLogFile, logPVs, verbose):
     baseCutPerc = float(0.0)
     
     # Now set the values.
+    pvs2Set = []
     for chan in np.arange(chans) + 1:
         # Fast (trigger) filter peaking time in micro sec.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'TriggerPeakingTime')
-        p_c.caputPV(pv2Set, fastPkTime_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, fastPkTime_us))
         # Fast (trigger) filter gap time in micro sec.
         # Generally set to 0.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'TriggerGapTime')
-        p_c.caputPV(pv2Set, fastGapTime_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, fastGapTime_us))
         # Fast (trigger) filter level.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'TriggerThreshold')
-        p_c.caputPV(pv2Set, fastTrigLevel_keV, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, fastTrigLevel_keV))
         # Energy filter peaking time in micro sec.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'PeakingTime')
-        p_c.caputPV(pv2Set, energyPkTime_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, energyPkTime_us))
         # Energy filter gap time in micro sec.
         # Should reflect the rise of the preamp.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'GapTime')
-        p_c.caputPV(pv2Set, energyGapTime_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, energyGapTime_us))
         # Energy threshold level.
         # Should be set to 0.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'EnergyThreshold')
-        p_c.caputPV(pv2Set, energyThresh_keV, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, energyThresh_keV))
         # Maximum peak width for pile-up inspection in micro sec.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'MaxWidth')
-        p_c.caputPV(pv2Set, energyMaxWidth_us, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, energyMaxWidth_us))
         # Length of the baseline filter in samples (powers of 2).
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'BaselineFilterLength')
-        p_c.caputPV(pv2Set, baseFiltLen, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, baseFiltLen))
         # Threshold in keV of baseline filter.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'BaselineThreshold')
-        p_c.caputPV(pv2Set, baseThresh_keV, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, baseThresh_keV))
         # Baseline cut enable, always NO for XMAP.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'BaselineCutEnable')
-        p_c.caputPV(pv2Set, baseCutEn, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, baseCutEn))
         # Baseline cut percent, always 0.0 for XMAP as is not enabled.
         pv2Set = '%s%s%s%s%s%s' %(detIOC, ':', 'dxp', str(chan), ':', 'BaselineCutPercent')
-        p_c.caputPV(pv2Set, baseCutPerc, pvLogFile, logPVs, verbose)
+        pvs2Set.append((pv2Set, baseCutPerc))
+    p_c.caputMany(pvs2Set, pvLogFile, logPVs, verbose)
 
 
 def setPixPerBuffer(detIOC, pixPerBuff, pixBufUpdat, pixPerRun,  pvLogFile, logPVs, verbose):
@@ -542,25 +635,10 @@ def setPixPerBuffer(detIOC, pixPerBuff, pixBufUpdat, pixPerRun,  pvLogFile, logP
 
 
     
-def configDXPMapCont(detIOCList,
-                     dxpVer,
-                     detector,
-                     countTime,
-                     scanType,
-                     scanIOC,
-                     saveData,
-                     timeStamp,
-                     pvLogFile,
-                     logPVs,
-                     verbose):
-    """ Configure the mapping mode controls.
+def configDXPMapContIOC(detIOC, saveData, timeStamp, pvLogFile, logPVs, verbose):
+    """ Configure the mapping mode controls for one IOC.
     """
 
-    print "Configuring the XMAP controls ..."
-    
-    # Mapping mode is only available in version greater > '2_11', so assert this.
-    assert (dxpVer == '3_0') ^ (dxpVer == '3_1')
-    
     #######################
     # Specify the values. #
     #######################
@@ -590,100 +668,125 @@ def configDXPMapCont(detIOCList,
     # Now write the values. #
     #########################
 
-    for detIOC in detIOCList:
-        # Assume that 'MCA mapping' is the default.
-        pv2Set = '%s%s%s' %(detIOC, ':', 'CollectMode')
-        p_c.caputPV(pv2Set, collMode, pvLogFile, logPVs, verbose)
-        """ List mode variant is only set if collMode == 'List mapping', so leave as
-            default 'E & Gate'.
-        """
-        pv2Set = '%s%s%s' %(detIOC, ':', 'ListMode')
-        p_c.caputPV(pv2Set, listMode, pvLogFile, logPVs, verbose)
-        # Set the pixel advance mode.
-        pv2Set = '%s%s%s' %(detIOC, ':', 'PixelAdvanceMode')
-        p_c.caputPV(pv2Set, pixAdv, pvLogFile, logPVs, verbose)
-        # Value that divides the sync clock, just set to 1.
-        pv2Set = '%s%s%s' %(detIOC, ':', 'SyncCount')
-        p_c.caputPV(pv2Set, syncCnt, pvLogFile, logPVs, verbose)
-        # We want to respond to the gate pulse so set ignore gate low.
-        pv2Set = '%s%s%s' %(detIOC, ':', 'IgnoreGate')
-        p_c.caputPV(pv2Set, ignGate, pvLogFile, logPVs, verbose)
-        # Set input logic polarity to inverted due to our strange gate pulse.
-        pv2Set = '%s%s%s' %(detIOC, ':', 'InputLogicPolarity')
-        p_c.caputPV(pv2Set, inpLogPol, pvLogFile, logPVs, verbose)
-        # Set the number of pixels per run.  If == 1, the system will just continue forever.
-        pv2Set = '%s%s%s' %(detIOC, ':', 'PixelsPerRun')
-        p_c.caputPV(pv2Set, pixPerRun, pvLogFile, logPVs, verbose)
+    # Assume that 'MCA mapping' is the default.
+    pv2Set = '%s%s%s' %(detIOC, ':', 'CollectMode')
+    p_c.caputPV(pv2Set, collMode, pvLogFile, logPVs, verbose)
+    """ List mode variant is only set if collMode == 'List mapping', so leave as
+        default 'E & Gate'.
+    """
+    pv2Set = '%s%s%s' %(detIOC, ':', 'ListMode')
+    p_c.caputPV(pv2Set, listMode, pvLogFile, logPVs, verbose)
+    # Set the pixel advance mode.
+    pv2Set = '%s%s%s' %(detIOC, ':', 'PixelAdvanceMode')
+    p_c.caputPV(pv2Set, pixAdv, pvLogFile, logPVs, verbose)
+    # Value that divides the sync clock, just set to 1.
+    pv2Set = '%s%s%s' %(detIOC, ':', 'SyncCount')
+    p_c.caputPV(pv2Set, syncCnt, pvLogFile, logPVs, verbose)
+    # We want to respond to the gate pulse so set ignore gate low.
+    pv2Set = '%s%s%s' %(detIOC, ':', 'IgnoreGate')
+    p_c.caputPV(pv2Set, ignGate, pvLogFile, logPVs, verbose)
+    # Set input logic polarity to inverted due to our strange gate pulse.
+    pv2Set = '%s%s%s' %(detIOC, ':', 'InputLogicPolarity')
+    p_c.caputPV(pv2Set, inpLogPol, pvLogFile, logPVs, verbose)
+    # Set the number of pixels per run.  If == 1, the system will just continue forever.
+    pv2Set = '%s%s%s' %(detIOC, ':', 'PixelsPerRun')
+    p_c.caputPV(pv2Set, pixPerRun, pvLogFile, logPVs, verbose)
 
-        # This is a separate function as there is a strange bug to do with ordering in the XMAP software.
-        setPixPerBuffer(detIOC, pixPerBuff, pixBufUpdat, pixPerRun, pvLogFile, logPVs, verbose)
+    # This is a separate function as there is a strange bug to do with ordering in the XMAP software.
+    setPixPerBuffer(detIOC, pixPerBuff, pixBufUpdat, pixPerRun, pvLogFile, logPVs, verbose)
  
-        #####################################
-        # Now configure the saving options. #
-        #####################################
+    #####################################
+    # Now configure the saving options. #
+    #####################################
+
+    # Check that the user wants to save the data.
+    if saveData:
+
+        #######################
+        # Specify the values. #
+        #######################
 
-        # Check that the user wants to save the data.
-        if saveData:
+        # Make sure the array port is configured correctly.
+        aryPort = str('DXP1')
+        # Enable callbacks.
+        enCallBac = int(1)
+        # Now set up the save data params.
+        dirPath = '%s%s' %('C:\\share\\', timeStamp)
+        # Set up the file name.
+        fileName = '%s' %(detIOC)
+        # Reset the scan number.
+        scanNum = int(1)
+        # Set auto increment to yes.
+        autoInc = str('Yes')
+        # Set the file name format.
+        fileFormat = str('%s%s_%d.nc')
+        # Set the auto save to yes.
+        autoSave = str('Yes')
+        # Set the file write mode to single.
+        writeMode = str('Stream')
+        # The number of captures is automatically updated in the function 'setPixPerBuffer', so don't need to do it here.
 
-            #######################
-            # Specify the values. #
-            #######################
     
-            # Make sure the array port is configured correctly.
-            aryPort = str('DXP1')
-            # Enable callbacks.
-            enCallBac = int(1)
-            # Now set up the save data params.
-            dirPath = '%s%s' %('C:\\share\\', timeStamp)
-            # Set up the file name.
-            fileName = '%s' %(detIOC)
-            # Reset the scan number.
-            scanNum = int(1)
-            # Set auto increment to yes.
-            autoInc = str('Yes')
-            # Set the file name format.
-            fileFormat = str('%s%s_%d.nc')
-            # Set the auto save to yes.
-            autoSave = str('Yes')
-            # Set the file write mode to single.
-            writeMode = str('Stream')
-            # The number of captures is automatically updated in the function 'setPixPerBuffer', so don't need to do it here.
+        #########################
+        # Now write the values. #
+        #########################
+
+        # Make sure the array port is configured correctly.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'NDArrayPort')
+        p_c.caputPV(pv2Set, aryPort, pvLogFile, logPVs, verbose)
+        # Enable callbacks.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'EnableCallbacks')
+        p_c.caputPV(pv2Set, enCallBac, pvLogFile, logPVs, verbose)
+        # Now set up the save data params.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FilePath')
+        """ Assumes that the local folder 'C:\\share' corresponds to the
+            global '\\\SR12ID02IOC53\\share\\' folder.
+        """
+        p_c.caputPV(pv2Set, dirPath, pvLogFile, logPVs, verbose)
+        # Set up the file name.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileName')
+        p_c.caputPV(pv2Set, fileName, pvLogFile, logPVs, verbose)
+        # Reset the scan number.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileNumber')
+        p_c.caputPV(pv2Set, scanNum, pvLogFile, logPVs, verbose)
+        # Set auto increment to yes.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'AutoIncrement')
+        p_c.caputPV(pv2Set, autoInc, pvLogFile, logPVs, verbose)
+        # Set the file name format.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileTemplate')
+        p_c.caputPV(pv2Set, fileFormat, pvLogFile, logPVs, verbose)
+        # Set the auto save to yes.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'AutoSave')
+        p_c.caputPV(pv2Set, autoSave, pvLogFile, logPVs, verbose)
+        # Set the file write mode to single.
+        pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileWriteMode')
+        p_c.caputPV(pv2Set, writeMode, pvLogFile, logPVs, verbose)
 
-        
-            #########################
-            # Now write the values. #
-            #########################
+def configDXPMapCont(detIOCList,
+                     dxpVer,
+                     detector,
+                     countTime,
+                     scanType,
+                     scanIOC,
+                     saveData,
+                     timeStamp,
+                     pvLogFile,
+                     logPVs,
+                     verbose,
+                     parallel = False):
+    """ Configure the mapping mode controls.
+    """
+
+    print "Configuring the XMAP controls ..."
     
-            # Make sure the array port is configured correctly.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'NDArrayPort')
-            p_c.caputPV(pv2Set, aryPort, pvLogFile, logPVs, verbose)
-            # Enable callbacks.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'EnableCallbacks')
-            p_c.caputPV(pv2Set, enCallBac, pvLogFile, logPVs, verbose)
-            # Now set up the save data params.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FilePath')
-            """ Assumes that the local folder 'C:\\share' corresponds to the
-                global '\\\SR12ID02IOC53\\share\\' folder.
-            """
-            p_c.caputPV(pv2Set, dirPath, pvLogFile, logPVs, verbose)
-            # Set up the file name.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileName')
-            p_c.caputPV(pv2Set, fileName, pvLogFile, logPVs, verbose)
-            # Reset the scan number.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileNumber')
-            p_c.caputPV(pv2Set, scanNum, pvLogFile, logPVs, verbose)
-            # Set auto increment to yes.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'AutoIncrement')
-            p_c.caputPV(pv2Set, autoInc, pvLogFile, logPVs, verbose)
-            # Set the file name format.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileTemplate')
-            p_c.caputPV(pv2Set, fileFormat, pvLogFile, logPVs, verbose)
-            # Set the auto save to yes.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'AutoSave')
-            p_c.caputPV(pv2Set, autoSave, pvLogFile, logPVs, verbose)
-            # Set the file write mode to single.
-            pv2Set = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileWriteMode')
-            p_c.caputPV(pv2Set, writeMode, pvLogFile, logPVs, verbose)
+    # Mapping mode is only available in version greater > '2_11', so assert this.
+    assert (dxpVer == '3_0') ^ (dxpVer == '3_1')
+    
+    # Configure each IOC, in parallel if asked to.
+    runPerIOC(lambda detIOC, iocLogFile: configDXPMapContIOC(detIOC, saveData, timeStamp, iocLogFile, logPVs, verbose),
+              detIOCList,
+              pvLogFile,
+              parallel)
 
     # Do dummy run to train the software about the number of buffers to write.
     dummyMapRun(detIOCList, countTime, scanType, scanIOC, pvLogFile, logPVs, verbose)
@@ -839,9 +942,18 @@ def checkConfigs(params):
     # For Windows, you must specify double slash i.e. 'C:\\epics\\test'
     print 'Timestamped data dir will be written to %s ...' %(params.outBase)
 
+    # Assume this is a new run unless the time stamp of a run to resume is given.
+    if not hasattr(params, 'resumeTimeStamp'):
+        params.resumeTimeStamp = None
+
     # Specify timestamp for file that stores list of of PVs. 
     # Also, add the time stamp to the parameters object.
-    params.timeStamp = t_s.TimeStamp().getTimeStamp()
+    if params.resumeTimeStamp is not None:
+        # Carry on writing to the dir of the run being resumed.
+        params.timeStamp = params.resumeTimeStamp
+        print 'Resuming the run %s ...' %(params.timeStamp)
+    else:
+        params.timeStamp = t_s.TimeStamp().getTimeStamp()
                     
     # Join the base and timestamp to form the dir path.
     # Also, add the output directory string to the parameters object.
@@ -852,10 +964,14 @@ def checkConfigs(params):
 
     # Generate the string for the file that logs the PVs written.
     # Also, add the string to the parameters object.
-    params.pvLogStr = os.path.join(params.outDirStr, 'pvList.txt')
+    if params.resumeTimeStamp is not None:
+        # A resume logs to its own file, see param_sweep.getWrittenPVChunks.
+        params.pvLogStr = ckp.getResumePVLogPath(params.outDirStr)
+    else:
+        params.pvLogStr = os.path.join(params.outDirStr, 'pvList.txt')
 
     if params.logPVs:
-        # Open the output file to log the PVs to
+        # Open the output file to log the PVs to.
         pvLogFile = p_c.setFile(params.pvLogStr)
 
     return params, pvLogFile
@@ -865,6 +981,15 @@ def initialize(params):
     """
 
     params, pvLogFile = checkConfigs(params)
+
+    # Assume the IOCs are configured one after the other unless asked otherwise.
+    if not hasattr(params, 'parallelIOCs'):
+        params.parallelIOCs = False
+
+    # Assume every PV is written even if it already holds the value, unless asked otherwise.
+    if not hasattr(params, 'skipRedundantWrites'):
+        params.skipRedundantWrites = False
+    p_c.setWriteSuppression(params.skipRedundantWrites)
     
     #################################
     # Set up the basic parameters.. #
@@ -876,8 +1001,10 @@ def initialize(params):
 
     # Set the read back PVs to their usual values.
     # These are the same for all scans.
-    for detIOC in params.detIOCList:
-        setReadBack(detIOC, params.dxpVer, pvLogFile, params.logPVs, params.verbose)
+    runPerIOC(lambda detIOC, iocLogFile: setReadBack(detIOC, params.dxpVer, iocLogFile, params.logPVs, params.verbose),
+              params.detIOCList,
+              pvLogFile,
+              params.parallelIOCs)
     
 
     if params.initDXPs:
@@ -890,12 +1017,16 @@ def initialize(params):
                          params.verbose)
 
         # Config preamplifier parameters.
-        for detIOC in params.detIOCList:
-            configPreamps(detIOC, params.dxpVer, params.detector, pvLogFile, params.logPVs, params.verbose)
+        runPerIOC(lambda detIOC, iocLogFile: configPreamps(detIOC, params.dxpVer, params.detector, iocLogFile, params.logPVs, params.verbose),
+                  params.detIOCList,
+                  pvLogFile,
+                  params.parallelIOCs)
 
         # Configure energy, trigger and baseline parameters.
-        for detIOC in params.detIOCList:
-            configDXPFilters(detIOC, params.dxpVer, params.detector, pvLogFile, params.logPVs, params.verbose)
+        runPerIOC(lambda detIOC, iocLogFile: configDXPFilters(detIOC, params.dxpVer, params.detector, iocLogFile, params.logPVs, params.verbose),
+                  params.detIOCList,
+                  pvLogFile,
+                  params.parallelIOCs)
                 
     # Check assertions that need to be checked.
     checkAssertions(params.dxpVer)
@@ -938,6 +1069,86 @@ def initialize(params):
     return params, pvLogFile
 
 
+def getAllChanPVs(mcaIOC, mcaList):
+    """ Get the PVs of the spectrum, real time and live time of each MCA.
+    """
+    specPVs = ['%s%s%s%s' %(mcaIOC, ':', 'mca', str(mca)) for mca in mcaList]
+    realTimePVs = ['%s%s' %(specPV, '.ERTM') for specPV in specPVs]
+    liveTimePVs = ['%s%s' %(specPV, '.ELTM') for specPV in specPVs]
+    return specPVs, realTimePVs, liveTimePVs
+
+def readAllChans(mcaIOC, mcaList, nBins = 2048):
+    """ Read the spectra of all of the MCAs into one (numChans, nBins) array and
+        their real and live times into one (numChans, 2) array.
+        The gets for every channel are issued together, so there is one round
+        trip for the whole detector.
+    """
+    numChans = len(mcaList)
+    specPVs, realTimePVs, liveTimePVs = getAllChanPVs(mcaIOC, mcaList)
+    pvVals = p_c.cagetMany(specPVs + realTimePVs + liveTimePVs, verbose = False)
+    spectra = np.zeros((numChans, nBins), dtype = np.int32)
+    for row, spec in enumerate(pvVals[:numChans]):
+        if spec is not None:
+            numVals = min(np.size(spec), nBins)
+            spectra[row, :numVals] = np.ravel(spec)[:numVals]
+    # Anything not read is NaN so it can't be mistaken for a time.
+    times = np.array([np.nan if pvVal is None else pvVal for pvVal in pvVals[numChans:]], dtype = np.float64)
+    return spectra, times.reshape(2, numChans).T
+
+class AllChanReadout(object):
+    """ Read the spectra and real and live times of every channel after each
+        point, in a background thread so the readout overlaps with setting the
+        PVs of the next point.  acquire waits for the readout of the previous
+        point before starting the next, so the MCAs are not erased under it.
+        If spec_store.SpecStores are given, the spectra and times are added to
+        them, otherwise they are saved to an allChans_N.npz file for each point.
+    """
+    def __init__(self, mcaIOC, numChans, outDirStr, specStore = None, timeStore = None, mcaList = None, nBins = 2048):
+        self.mcaIOC = mcaIOC
+        # Assume every channel is read unless the MCAs are given.
+        if mcaList is None:
+            mcaList = np.arange(numChans) + 1
+        self.mcaList = list(mcaList)
+        self.outDirStr = outDirStr
+        self.specStore = specStore
+        self.timeStore = timeStore
+        self.nBins = nBins
+        self.thread = None
+        self.errors = []
+
+    def read(self, count, pvValPairs):
+        try:
+            startTime = time.time()
+            spectra, times = readAllChans(self.mcaIOC, self.mcaList, self.nBins)
+            if self.specStore is not None:
+                self.specStore.append(count, spectra, pvValPairs)
+                self.timeStore.append(count, times, pvValPairs)
+            else:
+                np.savez(os.path.join(self.outDirStr, 'allChans_%d.npz' %(count)),
+                         spectra = spectra, realTimes = times[:, 0], liveTimes = times[:, 1])
+            print 'Read %i channels of point %i in %f s ...' %(len(self.mcaList), count, time.time() - startTime)
+        except Exception as e:
+            self.errors.append((count, e))
+
+    def start(self, count, pvValPairs = None):
+        """ Start reading the point that has just been acquired.
+        """
+        self.wait()
+        self.thread = p_c.newThread(self.read, (count, pvValPairs))
+        self.thread.start()
+
+    def wait(self):
+        """ Wait for the readout of the last point to finish.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        # Raise the first error so it is not lost in the readout thread.
+        if self.errors:
+            count, e = self.errors[0]
+            print 'Reading all channels of point %i failed ...' %(count)
+            raise e
+
 def acquire(scanType,
             scanIOC,
             countTime,
@@ -948,10 +1159,20 @@ def acquire(scanType,
             verbose,
             count,
             outBase,
-            timeStamp):
+            timeStamp,
+            specStore = None,
+            pvValPairs = None,
+            allChans = None):
     """ Start the acquisition.
+        If a spec_store.SpecStore is given, the spectrum is added to it with the
+        PVs of the point, otherwise it is saved to its own .npy file.
+        If an AllChanReadout is given, every channel is also read in the background.
+        Returns the path of the file the spectrum is saved to.
     """
 
+    if allChans is not None:
+        # The last point must be read out before the MCAs are erased.
+        allChans.wait()
     
     if (scanType == 'wait-for-mcas') ^ (scanType == 'mca-spec'):
         # Trigger the scan1 record.
@@ -981,10 +1202,17 @@ def acquire(scanType,
     # Save the spectrum
     pv2Get = '%s%s%s' %(scanIOC, ':', 'mca1')
     spec = p_c.cagetPV(pv2Get, verbose)
+    if allChans is not None:
+        allChans.start(count, pvValPairs)
+    if specStore is not None:
+        specStore.append(count, spec, pvValPairs)
+        print 'Added spectrum %i to %s ...' %(count, specStore.binPath)
+        return specStore.binPath
     fileName = 'spec_%d.npy' %(count)
     filePath = os.path.join(outBase, timeStamp, fileName)
     np.save(filePath, spec)
     print 'Saving spectrum %s ...' %(filePath)
+    return filePath
 
 def finalize(logPVs, pvLogFile):
     """ Close the PV log file.
@@ -1027,19 +1255,21 @@ def setMode(trigOnScaler,
             p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
 
             # Clear out the existing configuration of Scan1.DNNPV.
+            pvs2Clear = []
             for i in np.arange(12) + 1:
                 # Need to set the scaler time.
                 if i <= 4:
                     val2Write = ''
                     pv2Set = '%s%01d%s' %('SR12ID01HU02IOC01:scan1.R', i, 'PV')
-                    p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+                    pvs2Clear.append((pv2Set, val2Write))
                     pv2Set = '%s%01d%s' %('SR12ID01HU02IOC01:scan1.P', i, 'PV')
-                    p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+                    pvs2Clear.append((pv2Set, val2Write))
                     pv2Set = '%s%01d%s' %('SR12ID01HU02IOC01:scan1.T', i, 'PV')
-                    p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+                    pvs2Clear.append((pv2Set, val2Write))
                     
                 pv2Set = '%s%02d%s' %('SR12ID01HU02IOC01:scan1.D', i, 'PV')
-                p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+                pvs2Clear.append((pv2Set, val2Write))
+            p_c.caputMany(pvs2Clear, pvLogFile, logPVs, verbose)
 
             # Need to set the PV trigger.
             pv2Set = '%s' %('SR12ID01HU02IOC01:scan1.T1PV')
@@ -1231,7 +1461,8 @@ def mcaMapAcquis(params, pvLogFile):
                      params.timeStamp,
                      pvLogFile,
                      params.logPVs,
-                     params.verbose)
+                     params.verbose,
+                     params.parallelIOCs)
 
     # Get the MCA list for the detector.
     
@@ -0,0 +1,190 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import numpy as np
+import acquis_params as a_p
+import scan_config as s_c
+import peak_fit as pkf
+
+def getCoarseIndices(numVals, numCoarse):
+    """ Get numCoarse positions spread evenly over a list of numVals, always including both ends.
+    """
+    return sorted(set([int(round(idx)) for idx in np.linspace(0, numVals - 1, min(numVals, numCoarse))]))
+
+class AdaptiveSweep(object):
+    """ Find the point of a sweep with the smallest value of measure(point),
+        i.e. the FWHM, without measuring every point.
+        A coarse grid is measured first, then a local search steps to the best
+        neighbouring point until no step improves by more than minImprovement.
+        The points are those of scan_config.product(listOfLists) and every point
+        is only measured once.
+    """
+    def __init__(self, listOfLists, measure, numCoarse = 3, minImprovement = 0.0, maxPoints = None):
+        self.listOfLists = listOfLists
+        self.measure = measure
+        self.numCoarse = numCoarse
+        self.minImprovement = minImprovement
+        self.maxPoints = maxPoints
+        self.sizes = [len(scanList) for scanList in listOfLists]
+        # The measured value for each point, keyed by the position in each list.
+        self.results = {}
+        self.order = []
+
+    def getPoint(self, digits):
+        return tuple([scanList[digit] for scanList, digit in zip(self.listOfLists, digits)])
+
+    def isFull(self):
+        return self.maxPoints is not None and len(self.results) >= self.maxPoints
+
+    def measureDigits(self, digits):
+        """ Measure a point if it has not been measured already.
+            Returns the value, None if the measurement failed or the point limit was reached.
+        """
+        digits = tuple(digits)
+        if digits not in self.results:
+            if self.isFull():
+                return None
+            self.results[digits] = self.measure(self.getPoint(digits))
+            self.order.append(digits)
+        return self.results[digits]
+
+    def getBest(self):
+        """ Get the positions and value of the best point measured so far.
+        """
+        measured = [(val, digits) for digits, val in self.results.items() if val is not None]
+        if not measured:
+            return None, None
+        val, digits = min(measured)
+        return digits, val
+
+    def doCoarse(self):
+        """ Measure the coarse grid, snake ordered so one PV changes between points.
+        """
+        coarseLists = [getCoarseIndices(size, self.numCoarse) for size in self.sizes]
+        coarsePlan = s_c.product([[[scanList[0][0], digit] for digit in coarseList] for scanList, coarseList in zip(self.listOfLists, coarseLists)],
+                                 snake = True)
+        for coarsePoint in coarsePlan:
+            self.measureDigits([digit for pvName, digit in coarsePoint])
+
+    def doLocal(self):
+        """ Step to the best neighbour of the best point, one list position at a
+            time, until no neighbour is better by more than minImprovement.
+        """
+        bestDigits, bestVal = self.getBest()
+        while bestDigits is not None and not self.isFull():
+            stepDigits, stepVal = None, None
+            for listIdx, size in enumerate(self.sizes):
+                for step in (-1, 1):
+                    digits = list(bestDigits)
+                    digits[listIdx] += step
+                    if digits[listIdx] < 0 or digits[listIdx] >= size:
+                        continue
+                    val = self.measureDigits(digits)
+                    if val is not None and (stepVal is None or val < stepVal):
+                        stepDigits, stepVal = tuple(digits), val
+            if stepVal is None or (bestVal - stepVal) <= self.minImprovement:
+                break
+            print 'Improved from %f to %f at %s ...' %(bestVal, stepVal, self.getPoint(stepDigits))
+            bestDigits, bestVal = stepDigits, stepVal
+        return bestDigits, bestVal
+
+    def run(self):
+        """ Do the sweep and return the best point and its value.
+        """
+        self.doCoarse()
+        print 'Best of %i coarse points is %s ...' %(len(self.results), self.getBest()[1])
+        bestDigits, bestVal = self.doLocal()
+        print 'Best of %i points out of %i is %s at %s ...' %(len(self.results), s_c.getNumPoints(self.sizes), bestVal,
+                                                            None if bestDigits is None else self.getPoint(bestDigits))
+        if bestDigits is None:
+            return None, None
+        return self.getPoint(bestDigits), bestVal
+
+def doAdaptiveScan(params, pvLogFile, scanVarList, energy_keV, fitDataFilePath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs,
+                   numCoarse = 3, minImprovement_keV = 0.0, maxPoints = None):
+    """ Find the sweep point with the smallest FWHM by acquiring and fitting each point as it is needed.
+        Only the PVs that differ from the point before are written, in scan_config.xmapWriteOrder.
+        The fits are written to the fit data file as param_sweep.fitAllData would.
+    """
+    fitDataFile = open(fitDataFilePath, 'w')
+    # Nothing is known to be set before the first point.
+    prevPoint = [None]
+
+    def measure(point):
+        count = len(sweep.order)
+        # Only write the PVs that differ from the last point measured.
+        s_c.writeChangedPVs(point, prevPoint[0], pvLogFile, params.logPVs, params.verbose)
+        prevPoint[0] = point
+        # Do the desired scan.
+        filePath = a_p.acquire(params.scanType, params.scanIOC, params.countTime, params.detIOCList, params.detector,
+                               pvLogFile, params.logPVs, params.verbose, count, params.outBase, params.timeStamp)
+        # Fit the peak straight away so it can steer the sweep.
+        calPoints, fits, fwhms = pkf.fit(np.load(filePath), params.outDirStr, count, numPksInRange, pkRangeMin_chan, pkRangeMax_chan,
+                                         bgRange, numStDevs, False, False, params.verbose)
+        if len(fits) == 0:
+            return None
+        fitDataFile.write('# %i \n' %(count))
+        fitDataFile.write('acquisIdx=%i, fitPeakIndex=%i, fwhmNorm=%f \n' %(count, calPoints[0], fwhms[0]))
+        fitDataFile.flush()
+        # The FWHM as param_sweep.processFitData gives it.
+        return fwhms[0] * energy_keV
+
+    sweep = AdaptiveSweep(scanVarList, measure, numCoarse, minImprovement_keV, maxPoints)
+    try:
+        return sweep.run()
+    finally:
+        fitDataFile.close()
+
+if __name__ == '__main__':
+
+    """ Running the code below shows how to find the DXP filter
+        settings with the best FWHM with an adaptive sweep.
+    """
+    params = a_p.Params()
+    params.doInit = False
+    params.logPVs = True
+    params.saveData = False
+    params.verbose = False
+    params.detector = 'ele36'
+    params.dxpVer = '2_11'
+    params.detIOCList, params.scanIOC, params.mcaIOC, params.numChans = a_p.getIOCs(params.detector, params.verbose)
+    params.outBase = '\\\SR12ID01IOC56\\share\\'
+    params.countTime = float(10.0)
+    params.trigOnScaler = False
+    params.scanType = 'wait-for-mcas'
+    params.initDXPs = False
+    params.skipRedundantWrites = True
+    params, pvLogFile = a_p.initialize(params)
+
+    # The same parameter space as the wait-for-mcas batch scan.
+    scanVarList = []
+    scanVarList = s_c.add2List('%s%s%s' %(params.detIOCList[0], ':', 'dxp1.PKTIM'), [1, 2, 4, 8, 12], scanVarList)
+    scanVarList = s_c.add2List('%s%s%s' %(params.detIOCList[0], ':', 'dxp1.GAPTIM'), [0.1, 0.2, 0.3, 0.5, 1.0], scanVarList)
+    scanVarList = s_c.add2List('%s%s%s' %(params.detIOCList[0], ':', 'dxp1.MAXWIDTH'), [0.1, 0.2, 0.5, 1.0, 2.0, 3.0], scanVarList)
+    scanVarList = s_c.add2List('%s%s%s' %(params.detIOCList[0], ':', 'dxp1.BASE_LEN'), [64, 128, 256, 512], scanVarList)
+    scanVarList = s_c.add2List('%s%s%s' %(params.detIOCList[0], ':', 'dxp1.BASE_THRESH'), [0.2, 0.4, 0.8, 1.6], scanVarList)
+
+    # Stop when a step improves the FWHM by less than 1 eV.
+    bestPoint, bestFWHM_keV = doAdaptiveScan(params, pvLogFile, scanVarList, 5.889, os.path.join(params.outDirStr, 'FitData.txt'),
+                                             range(250, 300), 1, 601, 2040, 5, minImprovement_keV = 0.001)
+    print 'Best FWHM is %s keV at %s ...' %(bestFWHM_keV, bestPoint)
+
+    # Close the PV log file, if used.
+    a_p.finalize(params.logPVs, pvLogFile)
+
+    print "Done ..."
@@ -22,15 +22,33 @@ import acquis_params as a_p
 import single_acquis as s_a
 import pv_control as p_c
 import scan_config as s_c
+import map_builder as m_b
 
-def doBatchScan(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, pix2Run):
+def doBatchScan(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, pix2Run, outBase, timeStamp, mapBuilder = None):
+    """ Do a mapping mode run of pix2Run pixels.
+        If a map_builder.MapBuilder is given, the maps are built from the netCDF
+        files of the IOCs while they are being written.
+    """
     # Set the number of pixels for the run.
     for detIOC in detIOCList:
         pv2Set = '%s%s%s' %(detIOC, ':', 'PixelsPerRun')
         # Set the PV to the val.
         p_c.caputPV(pv2Set, pix2Run, pvLogFile, params.logPVs, params.verbose)
+    if mapBuilder is not None:
+        # The run is written to the files with the numbers the IOCs will use next.
+        filePaths = []
+        for detIOC in detIOCList:
+            pv2Get = '%s%s%s%s%s' %(detIOC, ':', 'netCDF1', ':', 'FileNumber')
+            filePaths.append(m_b.getMapFilePath(detIOC, timeStamp, int(p_c.cagetPV(pv2Get, verbose))))
+        pv2Get = '%s%s%s%s%s' %(detIOCList[0], ':', 'netCDF1', ':', 'NumCapture')
+        numBuffers = int(p_c.cagetPV(pv2Get, verbose))
+        threads = mapBuilder.followFiles(filePaths, m_b.getIOCChanOffsets(detIOCList, params.numChans), numBuffers = numBuffers)
     # Do the desired scan.
-    a_p.acquire(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose)
+    a_p.acquire(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, 0, outBase, timeStamp)
+    if mapBuilder is not None:
+        # Wait for the last buffers to be written.
+        mapBuilder.wait(threads)
+        print 'Built the maps of %i pixels ...' %(mapBuilder.getNumDone())
         
 if __name__ == '__main__':
 
@@ -90,6 +108,9 @@ if __name__ == '__main__':
     # Flag whether to initialize the DXP values.
     params.initDXPs = False
 
+    # Configure the IOCs of a dual IOC detector in parallel.
+    params.parallelIOCs = True
+
     # Set the number of pixels to run.
     params.pix2Run = int(256)
 
@@ -103,6 +124,10 @@ if __name__ == '__main__':
     # Initialize an empty list to hold the dictionaries of scan vars.
     scanVarList = []
 
+    # Build the maps of some ROIs while the run is written.
+    rois = [('Fe Ka', 6.2, 6.6, 'keV'), ('total', 10, 2047, 'chan')]
+    mapBuilder = m_b.MapBuilder(params.pix2Run, rois, len(params.detIOCList))
+
     # Now run the batch scan.
     doBatchScan(params.scanType,
                 params.scanIOC,
@@ -112,7 +137,10 @@ if __name__ == '__main__':
                 pvLogFile,
                 params.logPVs,
                 params.verbose,
-                params.pix2Run)
+                params.pix2Run,
+                params.outBase,
+                params.timeStamp,
+                mapBuilder)
 
     # Close the PV log file, if used.
     a_p.finalize(params.logPVs, pvLogFile)
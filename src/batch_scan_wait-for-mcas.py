@@ -16,22 +16,53 @@
 """
 
 import sys
+import time
 import numpy as np
 sys.path.append("C:\Users\XAS\Desktop\element\src")
 import acquis_params as a_p
 import single_acquis as s_a
 import pv_control as p_c
 import scan_config as s_c
-
-def doBatchScan(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, scanPVList, outBase, timeStamp):
+import checkpoint as ckp
+import spec_store as s_s
+
+def doBatchScan(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, scanPVList, outBase, timeStamp, journal = None, writeOrder = s_c.xmapWriteOrder, specStore = None, allChans = None):
+    """ Acquire at each point of the sweep.
+        Only the PVs that differ from the previous point are written, in
+        writeOrder, and the others are logged as skipped.
+        If a journal is given, each completed point is recorded in it and the
+        points it already holds are skipped, so a sweep can be resumed.
+        If a spec_store.SpecStore is given, the spectra are added to it rather
+        than saved one file per point.
+        If an acquis_params.AllChanReadout is given, every channel is read
+        while the PVs of the next point are set.
+    """
+    # Connect all of the PVs in the sweep up front so each point reuses the channels.
+    if len(scanPVList) > 0:
+        p_c.connectPVs([pv2Set for pv2Set, val2Write in scanPVList[0]])
+    # Nothing is known to be set before the first point, or the first point after resuming.
+    prevLine = None
+    numWritten = 0
+    numSkipped = 0
     for count, line in enumerate(scanPVList):
-        # Loop over the variables (PVs) to scan.
-        for pv2Set, val2Write in line:
-            # Set the PV to the val.
-            p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, params.verbose)
-            print 'Changed %s ...' %(pv2Set)
+        if journal is not None and journal.isDone(count, line):
+            continue
+        startTime = time.time()
+        pointWritten, pointSkipped = s_c.writeChangedPVs(line, prevLine, pvLogFile, logPVs, params.verbose, writeOrder)
+        numWritten += pointWritten
+        numSkipped += pointSkipped
+        prevLine = line
         # Do the desired scan.
-        a_p.acquire(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, count, outBase, timeStamp)
+        filePath = a_p.acquire(scanType, scanIOC, countTime, detIOCList, detector, pvLogFile, logPVs, verbose, count, outBase, timeStamp, specStore, line, allChans)
+        if journal is not None:
+            journal.record(count, line, filePath, startTime, time.time())
+    if allChans is not None:
+        # Wait for the readout of the last point.
+        allChans.wait()
+    print 'Wrote %i sweep PVs and skipped %i that had not changed ...' %(numWritten, numSkipped)
+    # Print how well the channels were reused.
+    p_c.pvRegistry.printStats()
+    print 'Skipped %i writes of values the IOC already held ...' %(p_c.shadowCache.skipped)
         
 if __name__ == '__main__':
 
@@ -96,6 +127,12 @@ if __name__ == '__main__':
     # Flag whether to initialize the DXP values.
     params.initDXPs = False
 
+    # Skip writing PVs that already hold the value being written.
+    params.skipRedundantWrites = True
+
+    # To resume a sweep that stopped part way, give the time stamp of its output dir, i.e. '2014-03-05_10.22.31.123456'.
+    params.resumeTimeStamp = None
+
     # Initialize the appropriate parameters.
     params, pvLogFile = a_p.initialize(params)
     
@@ -183,7 +220,22 @@ if __name__ == '__main__':
     scanVarList = s_c.add2List(pv2Set, pvVals, scanVarList)
 
     # Get all combinations of the parameters.
-    scanVarList = s_c.product(scanVarList)
+    # Snake order them so only one PV changes between points and the baseline filter length changes least.
+    scanVarList = s_c.product(scanVarList, snake = True)
+    print 'Sweep of %i points needs %i PV changes ...' %(len(scanVarList), s_c.getNumChanges(scanVarList))
+
+    # Journal the completed points in the output dir so the sweep can be resumed.
+    journal = ckp.SweepJournal(ckp.getJournalPath(params.outDirStr))
+
+    # Keep all of the spectra in one file in the output dir.
+    specStore = s_s.SpecStore(params.outDirStr, mode = 'a')
+
+    # Also keep every channel of the detector, with the real and live times.
+    allChans = a_p.AllChanReadout(params.mcaIOC,
+                                  params.numChans,
+                                  params.outDirStr,
+                                  s_s.SpecStore(params.outDirStr, 'allChans', 'a'),
+                                  s_s.SpecStore(params.outDirStr, 'allChanTimes', 'a'))
 
     # Now run the batch scan.
     doBatchScan(params.scanType,
@@ -196,7 +248,11 @@ if __name__ == '__main__':
                 params.verbose,
                 scanVarList,
                 params.outBase,
-                params.timeStamp)
+                params.timeStamp,
+                journal,
+                specStore = specStore,
+                allChans = allChans)
+    journal.close()
 
     # Close the PV log file, if used.
     a_p.finalize(params.logPVs, pvLogFile)
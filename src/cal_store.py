@@ -0,0 +1,93 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import tempfile
+
+def getCalKey(detector, dxpVer, detIOCList, pkTime_us):
+    """ Get the key that the calibrations of a detector configuration are stored under.
+        The gains only carry over between runs with the same detector, DXP version,
+        IOCs and energy filter peaking time.
+    """
+    return '%s/%s/%s/%.3f' %(detector, dxpVer, ','.join(detIOCList), float(pkTime_us))
+
+class CalStore(object):
+    """ Hold the calibration results for each detector configuration in a JSON file.
+        Each configuration has a list of records, newest last, and each record holds
+        the gain, centroids and FWHMs of each channel with the time stamp of the run.
+    """
+    def __init__(self, storePath, maxRecords = 20):
+        self.storePath = storePath
+        self.maxRecords = maxRecords
+        self.cals = {}
+        if os.path.exists(storePath):
+            with open(storePath, 'r') as storeFile:
+                self.cals = json.load(storeFile)
+
+    def addRecord(self, calKey, timeStamp, converged, chanCals):
+        """ Add the results of a run.
+            chanCals is a dict of {chan : (gain, centroids, fwhms)} with zero based channel indices.
+        """
+        record = {'timeStamp' : timeStamp,
+                  'converged' : bool(converged),
+                  'chans' : {}}
+        for chan, (gain, centroids, fwhms) in chanCals.items():
+            record['chans'][str(chan)] = {'gain' : float(gain),
+                                          'centroids' : [float(cent) for cent in centroids],
+                                          'fwhms' : [float(fwhm) for fwhm in fwhms]}
+        records = self.cals.setdefault(calKey, [])
+        records.append(record)
+        # Only keep the most recent records.
+        del records[:-self.maxRecords]
+
+    def getLastConverged(self, calKey):
+        """ Get the most recent record where every channel converged, or None if there isn't one.
+        """
+        for record in reversed(self.cals.get(calKey, [])):
+            if record['converged']:
+                return record
+        return None
+
+    def getGains(self, record):
+        """ Get a dict of {chan : gain} from a record.
+        """
+        return dict([(int(chan), chanCal['gain']) for chan, chanCal in record['chans'].items()])
+
+    def save(self):
+        """ Write the store, via a temporary file so an interrupted write can't corrupt it.
+        """
+        storeDir = os.path.dirname(os.path.abspath(self.storePath))
+        tmpFd, tmpPath = tempfile.mkstemp(dir = storeDir, suffix = '.tmp')
+        with os.fdopen(tmpFd, 'w') as tmpFile:
+            json.dump(self.cals, tmpFile, indent = 1, sort_keys = True)
+        # Windows will not rename over an existing file.
+        if os.name == 'nt' and os.path.exists(self.storePath):
+            os.remove(self.storePath)
+        os.rename(tmpPath, self.storePath)
+
+if __name__ == '__main__':
+
+    """ Running the code below will test the storing
+        and reading back of a calibration.
+    """
+    storePath = os.path.join(tempfile.mkdtemp(), 'cal_store.json')
+    calKey = getCalKey('ele100', '3_1', ['SR12ID01IOC53', 'SR12ID01IOC54'], 1.0)
+    calStore = CalStore(storePath)
+    calStore.addRecord(calKey, 'now', True, {0 : (1.02, [402.1], [14.2]), 1 : (0.98, [401.8], [14.5])})
+    calStore.save()
+    print "Gains read back are %s." %(CalStore(storePath).getGains(CalStore(storePath).getLastConverged(calKey)))
@@ -19,11 +19,14 @@ import sys
 import os
 from time import clock, time
 from copy import deepcopy
+import threading as th
+import Queue
 import numpy as np
 import pylab as plt
 import acquis_params as a_p
 import pv_control as p_c
 import peak_fit as p_f
+import cal_store as c_s
 # Get pylib as relative path to cur work dir.  Should be up two dirs from cur work dir.
 pylibPath = os.path.join(os.getcwd().split(os.path.basename(os.path.abspath('..')))[0], 'pylib', 'src')
 sys.path.append(pylibPath)
@@ -52,7 +55,8 @@ def doSingleAcquis(params, pvLogFile):
                 params.dxpVer,
                 pvLogFile,
                 params.logPVs,
-                params.verbose)
+                params.verbose,
+                params.numChans)
 
     # Acquire the data. 
     a_p.acquire(params.scanType,
@@ -62,7 +66,10 @@ def doSingleAcquis(params, pvLogFile):
                 params.detector,
                 pvLogFile,
                 params.logPVs,
-                params.verbose)
+                params.verbose,
+                0,
+                params.outBase,
+                params.timeStamp)
 
 
 def getSingleSpec(mcaIOC, numChans, xMin, xMax, chan):
@@ -76,22 +83,40 @@ def getSingleSpec(mcaIOC, numChans, xMin, xMax, chan):
                 
     return mcaSpec
 
-def getSpectra(mcaIOC, numChans, xMin, xMax):
-    # Initialize a list to store the spectra in.
-    specStore = []
-
-    # Loop over the detector channels.
-    for chan in np.arange(numChans) + 1:
-        # Define the PV string for the spectrum.
-        mcaSpecPV = '%s%s%s%d' %(mcaIOC, ':', 'mca', chan)
+def getSpectra(mcaIOC, numChans, xMin, xMax, nBins = 2048, chans = None):
+    """ Read bins xMin up to xMax of the spectra of the channels with the zero
+        based indices in chans, or of all numChans channels if chans is None,
+        into one array with a row for each.  All nBins bins are read if xMin
+        and xMax are None, otherwise column i of the array is bin xMin + i.
+        The gets for every channel are issued together, so there is one round
+        trip for the whole detector rather than one per channel, and only the
+        bins up to xMax are read.  The array keeps the dtype of the waveforms.
+    """
+    if chans is None:
+        chans = np.arange(numChans)
+    numChans = len(chans)
+    if xMin is None:
+        xMin = 0
+    if xMax is None:
+        xMax = nBins
+
+    # Define the PV string for the spectrum of each channel.
+    mcaSpecPVs = ['%s%s%s%d' %(mcaIOC, ':', 'mca', chan + 1) for chan in chans]
+
+    # Get the spectra.
+    startTime = time()
+    mcaSpecs = p_c.cagetMany(mcaSpecPVs, verbose = False, count = xMax)
+    print 'Read %i spectra in %.3f sec ...' %(numChans, time() - startTime)
 
-        # Get the spectrum
-        mcaSpec = np.asarray(p_c.cagetPV(mcaSpecPV, verbose = False))
-        
-        # Append the spectrum to the list.
-        specStore.append(mcaSpec)
+    # Copy the bins into one array, any channel not read stays at zero.
+    dtype = [np.asarray(mcaSpec).dtype for mcaSpec in mcaSpecs if mcaSpec is not None][:1] or [np.int32]
+    specStore = np.zeros((numChans, xMax - xMin), dtype = dtype[0])
+    for row, mcaSpec in enumerate(mcaSpecs):
+        if mcaSpec is not None:
+            mcaSpec = np.ravel(mcaSpec)[xMin:xMax]
+            specStore[row, :len(mcaSpec)] = mcaSpec
 
-    return np.asarray(specStore)
+    return specStore
 
 def matchVars2Energies(pkEnergies_keV, varList):
     """ Match the variables (centroids or FWHMs) of peaks found to the energies in the list supplied.
@@ -133,16 +158,20 @@ def pad(vars2Pad):
         sigVars.append([vars2Pad[0][0], vars2Pad[0][1]])
     return sigVars
 
-def setGainParams(dxpVer, cents, detIOC, chan, verbose, logPVs, pvLogFile):
-    """ Apply the new gain.
+def getGainPVs(dxpVer, detIOC, chan):
+    """ Get the read back and set PVs of the gain for a channel.
     """
-    # Get the old gain.
     if (dxpVer == '3_0') or (dxpVer == '3_1'):
         pv2Get = '%s%s%s%d%s%s' %(detIOC, ':', 'dxp', chan, ':', 'PreampGain_RBV')
+        pv2Set = '%s%s%s%d%s%s' %(detIOC, ':', 'dxp', chan, ':', 'PreampGain')
     else:
         pv2Get = '%s%s%s%d%s%s' %(detIOC, ':', 'dxp', chan, '.', 'PGAIN_RBV') 
-    oldGain = p_c.cagetPV(pv2Get, verbose) 
+        pv2Set = '%s%s%s%d%s%s' %(detIOC, ':', 'dxp', chan, '.', 'PGAIN')
+    return pv2Get, pv2Set
 
+def getNewGain(cents, oldGain):
+    """ Calc the gain that moves the matched centroids onto their energies.
+    """
     # The peak energy to calc gain from should be the middle one iff there are 3 and the last one iff there are 2.
     pkEnergy_keV = cents[1][1]
 
@@ -153,14 +182,85 @@ def setGainParams(dxpVer, cents, detIOC, chan, verbose, logPVs, pvLogFile):
     chanDiff = cents[0][1] -  cents[0][0]
 
     # Calc the new gain to be written.
-    newGain = (chanDiff / (pkEnergy_keV * 100.)) * oldGain * 1.0
+    return (chanDiff / (pkEnergy_keV * 100.)) * oldGain * 1.0
+
+def setGainParams(dxpVer, cents, detIOC, chan, verbose, logPVs, pvLogFile):
+    """ Apply the new gain.
+    """
+    pv2Get, pv2Set = getGainPVs(dxpVer, detIOC, chan)
+
+    # Get the old gain.
+    oldGain = p_c.cagetPV(pv2Get, verbose) 
 
     # Write the new gain.
+    newGain = getNewGain(cents, oldGain)
+    p_c.caputPV(pv2Set, newGain, pvLogFile, logPVs, verbose) 
+
+def getPeakingTime(dxpVer, detIOCList, verbose):
+    """ Get the energy filter peaking time of the first channel.
+    """
     if (dxpVer == '3_0') or (dxpVer == '3_1'):
-        pv2Set = '%s%s%s%d%s%s' %(detIOC, ':', 'dxp', chan, ':', 'PreampGain')
+        pv2Get = '%s%s%s' %(detIOCList[0], ':', 'dxp1:PeakingTime')
     else:
-        pv2Set = '%s%s%s%d%s%s' %(detIOC, ':', 'dxp', chan, '.', 'PGAIN')
-    p_c.caputPV(pv2Set, newGain, pvLogFile, logPVs, verbose) 
+        pv2Get = '%s%s%s' %(detIOCList[0], ':', 'dxp1.PKTIM')
+    return p_c.cagetPV(pv2Get, verbose)
+
+def loadStoredGains(params, pvLogFile, calStore, calKey):
+    """ Write the gains from the last converged calibration of this configuration, if there is one.
+    """
+    record = calStore.getLastConverged(calKey)
+    if record is None:
+        print 'No converged calibration stored for %s ...' %(calKey)
+        return
+    gainPairs = [(getGainPVs(params.dxpVer, *getDetIOCChanPair(params.detIOCList, chan))[1], gain)
+                 for chan, gain in sorted(calStore.getGains(record).items())]
+    setGainsMany(params.dxpVer, gainPairs, params.detIOCList, pvLogFile, params.logPVs, params.verbose)
+    print 'Loaded %i gains from the calibration at %s ...' %(len(gainPairs), record['timeStamp'])
+
+def storeCalResults(params, calStore, calKey, converged, chanResults):
+    """ Store the gains now on the IOCs with the last centroids and FWHMs measured for each channel.
+    """
+    chans = sorted(chanResults.keys())
+    gains = p_c.cagetMany([getGainPVs(params.dxpVer, *getDetIOCChanPair(params.detIOCList, chan))[1] for chan in chans], params.verbose)
+    calStore.addRecord(calKey,
+                       params.timeStamp,
+                       converged,
+                       dict([(chan, (gain, chanResults[chan][0], chanResults[chan][1])) for chan, gain in zip(chans, gains)]))
+    calStore.save()
+    print 'Stored the calibration of %i channels under %s ...' %(len(chans), calKey)
+
+def getMatchedCentroids(pkEnergies_keV, centroidList):
+    """ Match the centroids to the energies and pad them ready for getNewGain.
+        Returns None if they can't be matched.
+    """
+    matchedCentroids, toCal = matchVars2Energies(pkEnergies_keV, centroidList)
+    if not toCal:
+        return None
+    return (np.asarray(pad(matchedCentroids))).T
+
+def getGainUpdates(dxpVer, pkEnergies_keV, chans, calPointsList, detIOCList, verbose):
+    """ Get the (PV, new gain) pairs for the channels with the zero based
+        indices in chans, whose centroids are in calPointsList.
+        The old gains are all read in one go.
+    """
+    cals = []
+    for chan, centroidList in zip(chans, calPointsList):
+        if len(centroidList) > 0:
+            matchedCentroids = getMatchedCentroids(pkEnergies_keV, centroidList)
+            if matchedCentroids is not None:
+                cals.append((getGainPVs(dxpVer, *getDetIOCChanPair(detIOCList, chan)), matchedCentroids))
+    if not cals:
+        return []
+    oldGains = p_c.cagetMany([pv2Get for (pv2Get, pv2Set), matchedCentroids in cals], verbose)
+    return [(pv2Set, getNewGain(matchedCentroids, oldGain)) for ((pv2Get, pv2Set), matchedCentroids), oldGain in zip(cals, oldGains)]
+
+def setGainsMany(dxpVer, gainPairs, detIOCList, pvLogFile, logPVs, verbose):
+    """ Write all of the new gains in one batch.
+        For 3_x, auto apply is turned off first so there is a single apply per IOC.
+    """
+    a_p.disableAutoApply(detIOCList, dxpVer, pvLogFile, logPVs, verbose)
+    p_c.caputMany(gainPairs, pvLogFile, logPVs, verbose)
+    a_p.enableAutoApply(detIOCList, dxpVer, pvLogFile, logPVs, verbose)
   
 def getDetIOCChanPair(detIOCList, index):
     # Test if dual IOC
@@ -188,10 +288,8 @@ def doCalibration(dxpVer,
     assert type(pkEnergies_keV) == list
     
     # Match the centroids of the peaks to the energies
-    matchedCentroids, toCal = matchVars2Energies(pkEnergies_keV, centroidList)
-    matchedCentroids = pad(matchedCentroids)
-    matchedCentroids = (np.asarray(matchedCentroids)).T
-    if toCal:
+    matchedCentroids = getMatchedCentroids(pkEnergies_keV, centroidList)
+    if matchedCentroids is not None:
         # Get the appropriate
         detIOC, chan = getDetIOCChanPair(detIOCList, index)
         print "DETIOC", detIOC
@@ -224,7 +322,168 @@ def getScaledFWHMs(pkEnergies_keV, chanList, listOfFWHMLists):
         scaledFWHMLists.append(scaleFWHMs(matchedEnergies))
     return scaledFWHMLists
 
-def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVer, trigOnScaler, pkRangeMin, pkRangeMax, minBg, maxBg):
+def getCalOffset(pkEnergies_keV, centroidList):
+    """ Get the largest distance, in channels, of the centroids found from the
+        channels of the peak energies at 10 eV per channel.
+        Returns None if the peaks can't be matched to the energies.
+    """
+    if len(centroidList) == 0:
+        return None
+    matchedCentroids, toCal = matchVars2Energies(pkEnergies_keV, centroidList)
+    if not toCal:
+        return None
+    return max([abs(cent - (energy_keV * 100.)) for cent, energy_keV in matchedCentroids])
+
+def getNextCountTime(countTime, fwhms, pkCounts, tolChans, minCountTime, maxCountTime, maxStep = 2.0):
+    """ Scale the count time so that the statistical error on the centroid,
+        sigma / sqrt(counts), is a third of the tolerance for every channel.
+        A channel with no peak found, its FWHM None, needs more counts, so the
+        count time goes up by maxStep, as it does if no channels are given.
+        The count time changes by at most a factor of maxStep each iteration,
+        so one noisy fit can't swing it from one limit to the other.
+    """
+    scale = 1.0 / maxStep
+    for fwhm, counts in zip(fwhms, pkCounts):
+        if fwhm is None or counts <= 0:
+            scale = max(scale, maxStep)
+        else:
+            scale = max(scale, ((3.0 * fwhm / (p_f.fwhmPerSigma * tolChans)) ** 2) / counts)
+    if not fwhms:
+        scale = maxStep
+    countTime *= min(max(scale, 1.0 / maxStep), maxStep)
+    return min(max(countTime, minCountTime), maxCountTime)
+
+def runCalPipeline(params, pvLogFile, bgRange, numStDevs, refineFit, nBins = 2048, blockSize = 10, chans = None, tolChans = None):
+    """ Read the spectra, fit them and write the new gains as three
+        overlapping stages.  The channels are passed between the stages in
+        blocks of blockSize over bounded queues, so fitting one block overlaps
+        reading the next and writing the gains of the one before.  Auto apply
+        is off while the gains of each block are written in one batch, and is
+        turned back on at the end so there is a single apply per IOC.
+        Only the channels with the zero based indices in chans are done, all
+        of them if chans is None.  If tolChans is given, the gain is not
+        written for channels whose peaks are already within tolChans.
+        Returns the lists of centroids and FWHMs found for each channel, and
+        the counts in the window of the first peak of each channel.
+    """
+    if chans is None:
+        chans = np.arange(params.numChans)
+    readQueue = Queue.Queue(maxsize = 2)
+    writeQueue = Queue.Queue(maxsize = 2)
+    stop = th.Event()
+    errors = []
+    stageTimes = {'read' : 0.0, 'fit' : 0.0, 'write' : 0.0}
+    calPoints = [[] for chan in np.arange(params.numChans)]
+    fwhms = [[] for chan in np.arange(params.numChans)]
+    pkCounts = [0 for chan in np.arange(params.numChans)]
+    numWritten = [0]
+
+    def reader():
+        try:
+            for firstIdx in np.arange(0, len(chans), blockSize):
+                if stop.is_set():
+                    break
+                blockChans = chans[firstIdx:firstIdx + blockSize]
+                startTime = time()
+                spectra = getSpectra(params.mcaIOC, params.numChans, None, None, nBins, blockChans)
+                stageTimes['read'] += time() - startTime
+                readQueue.put((blockChans, spectra))
+        except Exception as e:
+            errors.append(('read', e))
+        # Always tell the fit stage that there is nothing more to come.
+        readQueue.put(None)
+
+    def writer():
+        try:
+            while True:
+                block = writeQueue.get()
+                if block is None:
+                    break
+                startTime = time()
+                blockChans, blockCalPoints = block
+                calChans = []
+                for chan, centroidList in zip(blockChans, blockCalPoints):
+                    if tolChans is not None:
+                        # Leave the gain alone if the peaks are already where they should be.
+                        calOffset = getCalOffset(params.pkEnergies_keV, centroidList)
+                        if calOffset is not None and calOffset <= tolChans:
+                            continue
+                    calChans.append(chan)
+                # Write the new gains of the block, they are applied once all the blocks are done.
+                gainPairs = getGainUpdates(params.dxpVer,
+                                           params.pkEnergies_keV,
+                                           calChans,
+                                           [calPoints[chan] for chan in calChans],
+                                           params.detIOCList,
+                                           params.verbose)
+                if gainPairs:
+                    p_c.caputMany(gainPairs, pvLogFile, params.logPVs, params.verbose)
+                    numWritten[0] += len(gainPairs)
+                stageTimes['write'] += time() - startTime
+        except Exception as e:
+            errors.append(('write', e))
+            stop.set()
+            # Keep taking blocks so the fit stage is not left waiting.
+            while writeQueue.get() is not None:
+                pass
+
+    startTime = time()
+    a_p.disableAutoApply(params.detIOCList, params.dxpVer, pvLogFile, params.logPVs, params.verbose)
+    readThread = p_c.newThread(reader, ())
+    writeThread = p_c.newThread(writer, ())
+    readThread.start()
+    writeThread.start()
+    try:
+        # Fit each block of spectra as it is read.
+        while True:
+            block = readQueue.get()
+            if block is None:
+                break
+            fitStartTime = time()
+            blockChans, spectra = block
+            blockCalPoints, fits, blockFWHMs = p_f.fitMany(spectra,
+                                                           params.numPksInRange,
+                                                           params.pkRangeMin,
+                                                           params.pkRangeMax,
+                                                           bgRange,
+                                                           numStDevs,
+                                                           params.verbose,
+                                                           refineFit)
+            for row, chan in enumerate(blockChans):
+                calPoints[chan] = blockCalPoints[row]
+                fwhms[chan] = blockFWHMs[row]
+                if fits[row]:
+                    # The counts over the window of the first peak.
+                    pkCounts[chan] = spectra[row, fits[row][0][0]].sum()
+            stageTimes['fit'] += time() - fitStartTime
+            writeQueue.put((blockChans, blockCalPoints))
+    except Exception as e:
+        errors.append(('fit', e))
+        stop.set()
+        # Let the read stage finish so it is not left waiting.
+        while readQueue.get() is not None:
+            pass
+    writeQueue.put(None)
+    readThread.join()
+    writeThread.join()
+
+    # Apply all of the new gains together, even after an error so auto apply is not left off.
+    writeStartTime = time()
+    a_p.enableAutoApply(params.detIOCList, params.dxpVer, pvLogFile, params.logPVs, params.verbose)
+    stageTimes['write'] += time() - writeStartTime
+    print 'Wrote %i gains ...' %(numWritten[0])
+
+    print 'Read %f s, fit %f s, write %f s, total %f s ...' %(stageTimes['read'], stageTimes['fit'], stageTimes['write'], time() - startTime)
+
+    # Raise the first error so it is not lost in the stage threads.
+    if errors:
+        stage, e = errors[0]
+        print 'Calibration %s stage failed ...' %(stage)
+        raise e
+
+    return calPoints, fwhms, pkCounts
+
+def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVer, trigOnScaler, pkRangeMin, pkRangeMax, minBg, maxBg, outBase = '\\\SR12ID01IOC53\\share\\', refineFit = True, maxIters = 1, tolChans = 1.0, minCountTime = 1.0, maxCountTime = 60.0, calStoreName = None, warmStart = False):
 
     # Create an instance of the Params object.
     # The attributes of this will have to become buttons.
@@ -255,7 +514,7 @@ def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVe
     
     # Specify base name of dir (WITH the trailing slash) to store list of of PVs.
     # For Windows, you must specify double slash i.e. 'C:\\epics\\test'
-    params.outBase = '\\\SR12ID01IOC53\\share\\'
+    params.outBase = outBase
 
     # Specify the scan type.
     params.scanType = 'mca-spec'
@@ -284,12 +543,6 @@ def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVe
     # Cumulative exe time is 0.328 sec.
     params, pvLogFile = a_p.checkConfigs(params)
 
-    #####################################
-    # Now perform a single acquisition. #
-    #####################################
-    # Cumulative exe time is 3.143 sec + acquis time.
-    doSingleAcquis(params, pvLogFile)
-  
     ##########################################
     # There are 2 ways to do the peak fit.   #
     #      - Auto detect                     #
@@ -302,8 +555,8 @@ def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVe
     yMin = None
     yMax = None
 
-    # Acquire the spectra for the first time so they can be calibrated.
-    spectra = getSpectra(params.mcaIOC, params.numChans, xMin, xMax)
+    # Specify the number of bins in each spectrum.
+    nBins = 2048
 
     # Specify hard threshold.
     thresh = 300
@@ -337,7 +590,7 @@ def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVe
     # Set the lower bound of the peak search to be channels > the max background chan.
     apdLowBound = bgRange[1]
     # Set the upper bound of the peak search to length of the array (length of the array - 1 for visual effect).
-    apdUpBound = len(spectra[0]) - 1
+    apdUpBound = nBins - 1
     
     # Check whether to auto detect the numbe of peaks in the spectrum.
     if params.numPksInRange > 0:
@@ -354,35 +607,66 @@ def runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVe
         # 3) The pkRangeMax must be > pkRangeMin.
         assert params.pkRangeMax > params.pkRangeMin
         # 4) The pkRangeMax must be <= length of the spectrum.
-        assert params.pkRangeMax <= len(spectra[0])
+        assert params.pkRangeMax <= nBins
        
 
-    # Loop over the spectra that have been collected so they can be fitted.
-    for specIdx, spec in enumerate(spectra):
-       
-        # Fit the peak
-        fitData = p_f.fit(spec, 
-                          params.outDirStr,
-                          specIdx,
-                          params.numPksInRange, 
-                          params.pkRangeMin, 
-                          params.pkRangeMax, 
-                          bgRange, 
-                          numStDevs,
-                          savePlot,
-                          showPlot,
-                          params.verbose)
-
-        if fitData:
-            # Perform the energy calibration.
-            doCalibration(params.dxpVer,
-                          params.pkEnergies_keV,
-                          specIdx,
-                          [i[0] for i in fitData],
-                          params.detIOCList,
-                          params.verbose,
-                          params.logPVs,
-                          pvLogFile)
+    # The calibrations are stored next to the time stamped output dirs.
+    calStore = None
+    if calStoreName is not None:
+        calStore = c_s.CalStore(os.path.join(params.outBase, calStoreName))
+        calKey = c_s.getCalKey(params.detector, params.dxpVer, params.detIOCList, getPeakingTime(params.dxpVer, params.detIOCList, params.verbose))
+        if warmStart:
+            # Start from the last good gains rather than whatever is on the IOCs.
+            loadStoredGains(params, pvLogFile, calStore, calKey)
+
+    # Start with every channel, the ones whose peaks are matched are dropped after each iteration.
+    chans = range(params.numChans)
+
+    # The last centroids and FWHMs measured for each channel.
+    chanResults = {}
+
+    for iteration in np.arange(maxIters):
+
+        ###############################
+        # Now perform an acquisition. #
+        ###############################
+        # Cumulative exe time is 3.143 sec + acquis time.
+        doSingleAcquis(params, pvLogFile)
+
+        # Read, fit and calibrate the spectra with the stages overlapped.
+        calPoints, fwhms, pkCounts = runCalPipeline(params, pvLogFile, bgRange, numStDevs, refineFit, nBins, chans = chans, tolChans = tolChans)
+
+        for chan in chans:
+            if calPoints[chan]:
+                chanResults[chan] = (calPoints[chan], fwhms[chan])
+
+        # Find the channels that are still outside the tolerance, these have had their gain changed.
+        calOffsets = [getCalOffset(params.pkEnergies_keV, calPoints[chan]) for chan in chans]
+        unmatched = [chan for chan, calOffset in zip(chans, calOffsets) if calOffset is None or calOffset > tolChans]
+        print 'Iteration %i: %i of %i channels within %f channels with count time %f sec ...' %(iteration + 1, len(chans) - len(unmatched), len(chans), tolChans, params.countTime)
+        chans = unmatched
+
+        if not chans:
+            print 'All channels are matched ...'
+            break
+
+        noPeakChans = [chan for chan in chans if not fwhms[chan]]
+        if noPeakChans:
+            print 'No peak found in channels %s, counting for longer ...' %(noPeakChans)
+
+        # Count for long enough to get a reliable centroid for the channels that are left.
+        params.countTime = getNextCountTime(params.countTime,
+                                            [fwhms[chan][0] if fwhms[chan] else None for chan in chans],
+                                            [pkCounts[chan] for chan in chans],
+                                            tolChans,
+                                            minCountTime,
+                                            maxCountTime)
+
+    if chans:
+        print 'Channels not matched after %i iterations are %s ...' %(maxIters, chans)
+
+    if calStore is not None:
+        storeCalResults(params, calStore, calKey, not chans, chanResults)
 
             
           
@@ -497,8 +781,16 @@ if __name__ == '__main__':
     # Specify that the scaler will not be used for the trigger.
     trigOnScaler = True
     
+    # Specify the maximum number of acquire and gain adjust iterations, and how close in channels the peaks must be.
+    maxIters = 5
+    tolChans = 1.0
+
+    # Specify the file, in the output base dir, that the calibrations are stored in and whether to start from the last good gains.
+    calStoreName = 'cal_store.json'
+    warmStart = True
+
     # Do the calibration
-    runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVer, trigOnScaler, pkRangeMin_chan, pkRangeMax_chan, minBg_chan, maxBg_chan)
+    runCal(countTime, energyList_keV, logPVs, saveData, verbose, detector, dxpVer, trigOnScaler, pkRangeMin_chan, pkRangeMax_chan, minBg_chan, maxBg_chan, maxIters = maxIters, tolChans = tolChans, calStoreName = calStoreName, warmStart = warmStart)
     
     # Stop the timer that calculates how long the code takes to run.
     stopTime = time()
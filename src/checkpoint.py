@@ -0,0 +1,117 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+import numpy as np
+
+def getJournalPath(outDirStr):
+    """ Get the path of the journal in a time stamped output dir.
+    """
+    return os.path.join(outDirStr, 'sweepJournal.txt')
+
+def getPVLogPaths(outDirStr):
+    """ Get the paths of the PV logs in a time stamped output dir in the
+        order they were written, i.e. pvList.txt then the log of each resume.
+    """
+    resumeNums = []
+    for fileName in os.listdir(outDirStr):
+        match = re.match(r'^pvList_resume(\d+)\.txt$', fileName)
+        if match:
+            resumeNums.append(int(match.group(1)))
+    return [os.path.join(outDirStr, 'pvList.txt')] + [getResumePVLogPath(outDirStr, resumeNum) for resumeNum in sorted(resumeNums)]
+
+def getResumePVLogPath(outDirStr, resumeNum = None):
+    """ Get the path of the PV log of a resume of the sweep, the next
+        unused one if resumeNum is not given.  Each resume has its own log
+        so the set up it writes does not land in the middle of the sweep.
+    """
+    if resumeNum is None:
+        resumeNum = len(getPVLogPaths(outDirStr))
+    return os.path.join(outDirStr, 'pvList_resume%d.txt' %(resumeNum))
+
+def getPlainVal(val):
+    """ Convert numpy scalars to python ones so they can be written as JSON.
+    """
+    if isinstance(val, np.generic):
+        return val.item()
+    return val
+
+def readJournal(journalPath):
+    """ Read the completed points of a journal into a dict by point index,
+        ignoring a last line that was cut short by a crash.
+        Returns the points and the last line, which is '' for no journal.
+    """
+    points = {}
+    lastLine = ''
+    if os.path.exists(journalPath):
+        with open(journalPath, 'r') as journalFile:
+            for line in journalFile:
+                lastLine = line
+                try:
+                    point = json.loads(line)
+                except ValueError:
+                    # The last line may have been cut short by a crash.
+                    print 'Ignoring incomplete journal line %s ...' %(line.strip())
+                    continue
+                points[point['index']] = point
+        print 'Journal %s has %i completed points ...' %(journalPath, len(points))
+    return points, lastLine
+
+class SweepJournal(object):
+    """ A record of the points of a sweep that have been completed.
+        Each completed point is appended as one JSON line and synced to disk
+        before the next point starts, so a crash can lose at most the line
+        being written, which is ignored when the journal is read back.
+    """
+    def __init__(self, journalPath):
+        self.journalPath = journalPath
+        self.points, lastLine = readJournal(journalPath)
+        self.journalFile = open(journalPath, 'a')
+        if lastLine and not lastLine.endswith('\n'):
+            # Start the next point on a new line after a cut short one.
+            self.journalFile.write('\n')
+
+    def isDone(self, index, pvValPairs = None):
+        """ Test if the point has been completed.
+            If the PVs and values are given, they must match those of the completed
+            point, otherwise the sweep being resumed is not the one in the journal.
+        """
+        if index not in self.points:
+            return False
+        if pvValPairs is not None:
+            assert self.points[index]['pvs'] == [[pv2Set, getPlainVal(val2Write)] for pv2Set, val2Write in pvValPairs], \
+                'Point %i of the sweep does not match the journal %s ...' %(index, self.journalPath)
+        return True
+
+    def record(self, index, pvValPairs, filePath, startTime, stopTime):
+        """ Add a completed point to the journal.
+        """
+        point = {'index' : int(index),
+                 'pvs' : [[pv2Set, getPlainVal(val2Write)] for pv2Set, val2Write in pvValPairs],
+                 'filePath' : filePath,
+                 'startTime' : startTime,
+                 'stopTime' : stopTime}
+        # One write per line so the line is either all there or cut short.
+        self.journalFile.write(json.dumps(point) + '\n')
+        self.journalFile.flush()
+        os.fsync(self.journalFile.fileno())
+        self.points[point['index']] = point
+
+    def close(self):
+        self.journalFile.close()
@@ -0,0 +1,191 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import threading as th
+import numpy as np
+import map_reader as m_r
+
+# The gains are calibrated so that there are 100 bins per keV.
+binsPerkeV = 100.0
+
+def getIOCChanCounts(numChans, numIOCs):
+    """ Split the channels of a detector between its IOCs in whole XMAP
+        modules, the first IOCs taking any extra module, i.e. 52 and 48 for
+        the 100 element detector.
+    """
+    numModules = -(-numChans // m_r.chansPerModule)
+    modCounts = [numModules // numIOCs + int(iocIdx < numModules % numIOCs) for iocIdx in range(numIOCs)]
+    chanCounts = [modCount * m_r.chansPerModule for modCount in modCounts]
+    # The last IOC may not fill its last module.
+    chanCounts[-1] -= sum(chanCounts) - numChans
+    return chanCounts
+
+def getIOCChanOffsets(detIOCList, numChans, allDetIOCs = None):
+    """ Get the first channel of each IOC in detIOCList over the whole
+        detector of numChans channels, i.e. params.numChans.  If only some of
+        the IOCs of the detector are used, allDetIOCs lists all of them in
+        order, so the channels of SR12ID01IOC54 still start at 52.
+    """
+    if allDetIOCs is None:
+        allDetIOCs = detIOCList
+    chanCounts = getIOCChanCounts(numChans, len(allDetIOCs))
+    return [sum(chanCounts[:allDetIOCs.index(detIOC)]) for detIOC in detIOCList]
+
+def getMapFilePath(detIOC, timeStamp, fileNum):
+    """ Get the path of a netCDF file that a detector IOC writes in mapping mode.
+        The IOC writes to C:\\share\\timeStamp, which is shared as \\\\detIOC\\share.
+    """
+    return os.path.join("\\\%s\\share\\" %(detIOC), timeStamp, '%s_%d.nc' %(detIOC, fileNum))
+
+def getROIBins(low, high, units, nBins):
+    """ Get the first bin and one past the last bin of an ROI given in bins
+        ('chan') or keV, limited to the spectrum.
+    """
+    assert (units == 'chan') ^ (units == 'keV')
+    if units == 'keV':
+        low, high = low * binsPerkeV, high * binsPerkeV
+    lowBin = min(max(int(np.floor(low)), 0), nBins)
+    highBin = min(max(int(np.floor(high)) + 1, lowBin), nBins)
+    return lowBin, highBin
+
+class MapBuilder(object):
+    """ Build ROI maps from the pixels of a mapping mode run as the buffers arrive.
+        Each ROI is (name, low, high, units) with units 'chan' for bins or 'keV'.
+        The counts in each ROI are summed over all of the channels of every IOC
+        for each pixel, so the IOCs of the 100 element detector can be added in
+        any order.  Channels in excludeChans (zero based, over the whole
+        detector) are left out.
+    """
+    def __init__(self, numPixels, rois, numIOCs = 1, mapShape = None, excludeChans = [], nBins = 2048):
+        self.numPixels = numPixels
+        self.rois = rois
+        self.mapShape = mapShape
+        self.excludeChans = set(excludeChans)
+        self.nBins = nBins
+        self.roiBins = [getROIBins(low, high, units, nBins) for name, low, high, units in rois]
+        self.roiSums = np.zeros((len(rois), numPixels))
+        # The IOCs that each pixel has been added from.
+        self.pixDone = np.zeros((numIOCs, numPixels), dtype = bool)
+        self.numDuplicates = 0
+        self.numOutside = 0
+        self.lock = th.Lock()
+        self.errors = []
+
+    def getROISums(self, mapBuffer, chanOffset = 0):
+        """ Get the (numPixels, numROIs) ROI sums of the pixels of a buffer.
+        """
+        spectra = mapBuffer.getSpectra()
+        # Sum the spectra of the channels first, so each ROI is a difference of two cumulative sums.
+        summed = np.zeros((mapBuffer.numPixels, mapBuffer.nBins + 1), dtype = np.int64)
+        for mod in range(mapBuffer.numModules):
+            for chan in range(m_r.chansPerModule):
+                if chanOffset + mod * m_r.chansPerModule + chan not in self.excludeChans:
+                    summed[:, 1:] += spectra[:, mod, chan]
+        cumSums = np.cumsum(summed, axis = 1)
+        return np.array([cumSums[:, highBin] - cumSums[:, lowBin] for lowBin, highBin in self.roiBins]).T
+
+    def addBuffer(self, mapBuffer, iocIdx = 0, chanOffset = 0):
+        """ Add the pixels of a buffer from one IOC to the maps.
+            Pixels outside the map, or already added from the IOC, are skipped.
+        """
+        assert mapBuffer.nBins <= self.nBins
+        pixNums = mapBuffer.getPixNums()
+        roiSums = self.getROISums(mapBuffer, chanOffset)
+        inMap = (pixNums >= 0) & (pixNums < self.numPixels)
+        with self.lock:
+            isNew = inMap.copy()
+            isNew[inMap] = ~self.pixDone[iocIdx, pixNums[inMap]]
+            self.numOutside += int(np.sum(~inMap))
+            self.numDuplicates += int(np.sum(inMap & ~isNew))
+            self.roiSums[:, pixNums[isNew]] += roiSums[isNew].T
+            self.pixDone[iocIdx, pixNums[isNew]] = True
+        return int(np.sum(isNew))
+
+    def addFile(self, filePath, iocIdx = 0, chanOffset = 0, **kws):
+        """ Add every buffer of a netCDF file, taking the keywords of
+            map_reader.iterBuffers, i.e. follow = True while it is written.
+        """
+        for mapBuffer in m_r.iterBuffers(filePath, **kws):
+            numAdded = self.addBuffer(mapBuffer, iocIdx, chanOffset)
+            print 'Added %i pixels of buffer %i from %s to the maps ...' %(numAdded, mapBuffer.bufNum, filePath)
+
+    def followFiles(self, filePaths, chanOffsets, **kws):
+        """ Add the files of each IOC as they are written, with a thread for each.
+            Returns the threads, which finish as map_reader.iterBuffers does.
+        """
+        def worker(iocIdx, filePath, chanOffset):
+            try:
+                self.addFile(filePath, iocIdx, chanOffset, follow = True, **kws)
+            except Exception as e:
+                self.errors.append((filePath, e))
+
+        threads = [th.Thread(target = worker, args = (iocIdx, filePath, chanOffset))
+                   for iocIdx, (filePath, chanOffset) in enumerate(zip(filePaths, chanOffsets))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return threads
+
+    def wait(self, threads):
+        """ Wait for the threads from followFiles to finish.
+        """
+        for thread in threads:
+            thread.join()
+        # Raise the first error so it is not lost in the worker thread.
+        if self.errors:
+            filePath, e = self.errors[0]
+            print 'Reading %s failed ...' %(filePath)
+            raise e
+
+    def getNumDone(self):
+        """ Get the number of pixels that have been added from every IOC.
+        """
+        with self.lock:
+            return int(np.sum(np.all(self.pixDone, axis = 0)))
+
+    def getMap(self, roiName):
+        """ Get a copy of the map of an ROI so far, in the map shape if there is one.
+        """
+        roiIdx = [name for name, low, high, units in self.rois].index(roiName)
+        with self.lock:
+            roiMap = self.roiSums[roiIdx].copy()
+        if self.mapShape is not None:
+            return roiMap.reshape(self.mapShape)
+        return roiMap
+
+if __name__ == '__main__':
+
+    """ Running the code below will build Fe and total maps from
+        the netCDF files of a dual IOC 100 element run, given the
+        time stamp and file number, printing how far it has got
+        while the files are written.
+    """
+    timeStamp, fileNum = sys.argv[1], int(sys.argv[2])
+    detIOCList = ['SR12ID01IOC53', 'SR12ID01IOC54']
+    rois = [('Fe Ka', 6.2, 6.6, 'keV'), ('total', 10, 2047, 'chan')]
+    numChans = 100
+    mapBuilder = MapBuilder(256, rois, len(detIOCList), mapShape = (16, 16))
+    threads = mapBuilder.followFiles([getMapFilePath(detIOC, timeStamp, fileNum) for detIOC in detIOCList],
+                                     getIOCChanOffsets(detIOCList, numChans))
+    while any([thread.is_alive() for thread in threads]):
+        print '%i pixels done, Fe Ka max %f ...' %(mapBuilder.getNumDone(), mapBuilder.getMap('Fe Ka').max())
+        time.sleep(1.0)
+    mapBuilder.wait(threads)
+    print mapBuilder.getMap('Fe Ka')
@@ -0,0 +1,361 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import struct
+import numpy as np
+
+##########################
+# netCDF classic format. #
+##########################
+
+# The tags of the lists in the header.
+ncDimension = 10
+ncVariable = 11
+ncAttribute = 12
+# The numpy dtypes of the netCDF types, which are all big endian.
+ncDtypes = {1 : '>i1', 2 : 'S1', 3 : '>i2', 4 : '>i4', 5 : '>f4', 6 : '>f8'}
+ncChar = 2
+
+class NCFile(object):
+    """ Read a netCDF classic file, as written by the areaDetector netCDF plugin,
+        by memory mapping it.  Only the header is parsed and the variables are
+        numpy views of the map, so nothing is copied.
+        The number of records is worked out from the file size, so a file that
+        is still being written can be read as it grows.
+    """
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.data = None
+        self.fileSize = 0
+        self.remap()
+        self.pos = 0
+        self.parseHeader()
+
+    def remap(self):
+        """ Map the file again if it has grown.  Returns True if it has.
+            Views of the old map stay valid as they hold a reference to it.
+        """
+        if os.path.getsize(self.filePath) <= self.fileSize:
+            return False
+        self.data = np.memmap(self.filePath, dtype = np.uint8, mode = 'r')
+        self.fileSize = len(self.data)
+        return True
+
+    ##########################
+    # Parsing of the header. #
+    ##########################
+
+    def read(self, numBytes):
+        if self.pos + numBytes > self.fileSize:
+            # The file may not have been written yet.
+            raise ValueError('The header of %s is incomplete ...' %(self.filePath))
+        buf = self.data[self.pos:self.pos + numBytes].tobytes()
+        self.pos += numBytes
+        return buf
+
+    def readInt(self):
+        return struct.unpack('>i', self.read(4))[0]
+
+    def readOffset(self):
+        if self.version == 2:
+            return struct.unpack('>q', self.read(8))[0]
+        return struct.unpack('>I', self.read(4))[0]
+
+    def readName(self):
+        numChars = self.readInt()
+        name = self.read(numChars)
+        # Everything is padded to 4 bytes.
+        self.read(-numChars % 4)
+        return name
+
+    def readList(self, tag, readItem):
+        listTag = self.readInt()
+        numItems = self.readInt()
+        # An empty list is two zeros.
+        if listTag == 0:
+            return []
+        assert listTag == tag, 'Unexpected list %i in the header of %s ...' %(listTag, self.filePath)
+        return [readItem() for i in range(numItems)]
+
+    def readDim(self):
+        return self.readName(), self.readInt()
+
+    def readAtt(self):
+        name = self.readName()
+        ncType = self.readInt()
+        numVals = self.readInt()
+        dtype = np.dtype(ncDtypes[ncType])
+        buf = self.read(numVals * dtype.itemsize)
+        self.read(-len(buf) % 4)
+        if ncType == ncChar:
+            return name, buf.rstrip('\x00')
+        return name, np.frombuffer(buf, dtype)
+
+    def readVar(self):
+        name = self.readName()
+        numDims = self.readInt()
+        dimIds = [self.readInt() for i in range(numDims)]
+        atts = dict(self.readList(ncAttribute, self.readAtt))
+        ncType = self.readInt()
+        # The size is not used as it can't hold that of a big variable.
+        self.readInt()
+        begin = self.readOffset()
+        dims = [self.dims[dimId] for dimId in dimIds]
+        isRec = numDims > 0 and dims[0][1] == 0
+        shape = tuple([dimLen for dimName, dimLen in dims[int(isRec):]])
+        dtype = np.dtype(ncDtypes[ncType])
+        return name, {'dtype' : dtype,
+                      'shape' : shape,
+                      'isRec' : isRec,
+                      'begin' : begin,
+                      'numBytes' : int(np.prod(shape)) * dtype.itemsize,
+                      'atts' : atts}
+
+    def parseHeader(self):
+        magic = self.read(4)
+        assert magic[:3] == 'CDF' and magic[3] in '\x01\x02', '%s is not a netCDF classic file ...' %(self.filePath)
+        self.version = ord(magic[3])
+        # Not used as it is only updated when the writer syncs the file.
+        self.read(4)
+        self.dims = self.readList(ncDimension, self.readDim)
+        self.atts = dict(self.readList(ncAttribute, self.readAtt))
+        self.vars = dict(self.readList(ncVariable, self.readVar))
+        # The records hold one of each record variable, each padded to 4 bytes.
+        recVars = [var for var in self.vars.values() if var['isRec']]
+        self.recSize = sum([var['numBytes'] + (-var['numBytes'] % 4) for var in recVars])
+        if len(recVars) == 1:
+            # Unless there is only one, when there is no padding.
+            self.recSize = recVars[0]['numBytes']
+
+    ##############################
+    # Reading of the variables. #
+    ##############################
+
+    def getNumRecs(self):
+        """ Get the number of records that are all in the file.
+        """
+        recVars = [var for var in self.vars.values() if var['isRec']]
+        if len(recVars) == 0 or self.recSize == 0:
+            return 0
+        return max(0, min([(self.fileSize - var['begin'] - var['numBytes']) // self.recSize + 1 for var in recVars]))
+
+    def getVar(self, varName, recIdx = None):
+        """ Get a view of a variable, or of one record of a record variable.
+        """
+        var = self.vars[varName]
+        begin = var['begin']
+        if var['isRec']:
+            begin += recIdx * self.recSize
+        assert begin + var['numBytes'] <= self.fileSize, 'Record %s of %s is not in %s yet ...' %(recIdx, varName, self.filePath)
+        return self.data[begin:begin + var['numBytes']].view(var['dtype']).reshape(var['shape'])
+
+##############################
+# XMAP mapping mode buffers. #
+##############################
+
+# The number of 16 bit words in each buffer and pixel header.
+bufHeaderWords = 256
+pixHeaderWords = 256
+# The tags at the start of each header.
+bufTags = (0x55AA, 0xAA55)
+pixTags = (0x33CC, 0xCC33)
+# The mapping mode that has a full spectrum per pixel.
+mcaMappingMode = 1
+# Each XMAP module has 4 channels.
+chansPerModule = 4
+# The real time, live time, triggers and output events of each channel
+# in the pixel header, each of 2 words, low word first.
+pixStatsStart = 32
+pixStatsWords = 8
+# The real and live times are in clock ticks.
+tickTime_s = 320e-9
+
+def getLong(words, index):
+    """ Get the 32 bit value held in two words, low word first.
+        Works on the last axis so it can be used for every pixel at once.
+    """
+    return words[..., index].astype(np.int64) + (words[..., index + 1].astype(np.int64) << 16)
+
+def parseBufHeader(words):
+    """ Parse the header at the start of the buffer of one XMAP module.
+    """
+    assert tuple(words[:2]) == bufTags, 'Not an XMAP buffer header ...'
+    return {'headerSize' : int(words[2]),
+            'mappingMode' : int(words[3]),
+            'runNum' : int(words[4]),
+            'bufNum' : int(getLong(words, 5)),
+            'bufId' : int(words[7]),
+            'numPixels' : int(words[8]),
+            'startPixel' : int(getLong(words, 9)),
+            'moduleNum' : int(words[11]),
+            'detChans' : [int(words[12 + 2 * chan]) for chan in range(chansPerModule)],
+            'chanSizes' : [int(chanSize) for chanSize in words[20:24]],
+            'errors' : int(words[24])}
+
+def isBufComplete(words):
+    """ Test if the buffers of all of the modules of a record have been written,
+        i.e. their header tags are there, the pixel blocks they declare fit in
+        the record and the header tags of their last pixel are there.
+    """
+    for modWords in words:
+        if tuple(modWords[:2]) != bufTags:
+            return False
+        numPixels = int(modWords[8])
+        if numPixels == 0:
+            continue
+        nBins = int(modWords[20])
+        blockWords = int(getLong(modWords, bufHeaderWords + 6))
+        if blockWords < pixHeaderWords + chansPerModule * nBins:
+            # The block size of the first pixel is not there yet.
+            return False
+        lastPix = bufHeaderWords + (numPixels - 1) * blockWords
+        if lastPix + blockWords > len(modWords) or tuple(modWords[lastPix:lastPix + 2]) != pixTags:
+            return False
+    return True
+
+class MapBuffer(object):
+    """ The XMAP buffers of all of the modules of one IOC from one netCDF record,
+        in MCA mapping mode.  The spectra, times and pixel numbers are views of
+        the record, which can be a view of the memory mapped file.
+        Detector channel chan of module mod is channel mod * 4 + chan of the IOC.
+    """
+    def __init__(self, words):
+        # Make sure there is a module axis, even if there is only one module.
+        words = words.view('>u2').reshape((-1, words.shape[-1]))
+        self.numModules = words.shape[0]
+        self.headers = [parseBufHeader(modWords) for modWords in words]
+        header = self.headers[0]
+        assert header['mappingMode'] == mcaMappingMode, 'Only MCA mapping buffers can be read, not mode %i ...' %(header['mappingMode'])
+        self.numPixels = header['numPixels']
+        self.bufNum = header['bufNum']
+        for modHeader in self.headers:
+            assert modHeader['numPixels'] == self.numPixels, 'The modules have different numbers of pixels ...'
+        self.nBins = header['chanSizes'][0]
+        assert header['chanSizes'] == [self.nBins] * chansPerModule, 'The channels have different spectrum sizes ...'
+
+        # Each pixel is a header then the spectra of the 4 channels.
+        self.blockWords = int(getLong(words[0], bufHeaderWords + 6)) if self.numPixels > 0 else pixHeaderWords
+        assert self.blockWords >= pixHeaderWords + chansPerModule * self.nBins
+        pixels = words[:, bufHeaderWords:bufHeaderWords + self.numPixels * self.blockWords]
+        self.pixels = pixels.reshape((self.numModules, self.numPixels, self.blockWords))
+        assert np.all(self.pixels[:, :, 0] == pixTags[0]) and np.all(self.pixels[:, :, 1] == pixTags[1]), 'Missing XMAP pixel header ...'
+
+    def getPixNums(self):
+        """ Get the number of each pixel, from the pixel headers of the first module.
+        """
+        return getLong(self.pixels[0], 4)
+
+    def getSpectra(self):
+        """ Get a (numPixels, numModules, 4, nBins) view of the spectra.
+        """
+        spectra = self.pixels[:, :, pixHeaderWords:pixHeaderWords + chansPerModule * self.nBins]
+        return spectra.reshape((self.numModules, self.numPixels, chansPerModule, self.nBins)).transpose(1, 0, 2, 3)
+
+    def getStats(self):
+        """ Get the real time and live time in s and the triggers and output events
+            of each channel, as (numPixels, numModules * 4) arrays.
+        """
+        stats = self.pixels[:, :, pixStatsStart:pixStatsStart + chansPerModule * pixStatsWords]
+        stats = stats.reshape((self.numModules, self.numPixels, chansPerModule, pixStatsWords)).transpose(1, 0, 2, 3)
+        stats = stats.reshape((self.numPixels, self.numModules * chansPerModule, pixStatsWords))
+        return getLong(stats, 0) * tickTime_s, getLong(stats, 2) * tickTime_s, getLong(stats, 4), getLong(stats, 6)
+
+def iterBuffers(filePath, follow = False, pollTime = 1.0, timeout = 30.0, numBuffers = None, varName = 'array_data'):
+    """ Yield a MapBuffer for each record of a netCDF file written by the XMAP.
+        If follow, the file is still being written, so wait pollTime between
+        looking for new records, until numBuffers have been read or there has
+        been no progress for timeout s (or forever if timeout is None).  The
+        file appearing or growing is progress, as well as a new record, so the
+        timeout only has to cover the longest wait for the file or for the next
+        part of a buffer, not the whole run.
+    """
+    ncFile = None
+    recIdx = 0
+    lastSize = None
+    lastNewTime = time.time()
+    while numBuffers is None or recIdx < numBuffers:
+        try:
+            if ncFile is None:
+                ncFile = NCFile(filePath)
+            else:
+                ncFile.remap()
+        except (OSError, ValueError):
+            # The file, or its header, has not been written yet.
+            if not follow:
+                raise
+            ncFile = None
+        numNew = 0
+        while ncFile is not None and recIdx < ncFile.getNumRecs() and (numBuffers is None or recIdx < numBuffers):
+            words = ncFile.getVar(varName, recIdx).view('>u2')
+            if follow and not isBufComplete(words.reshape((-1, words.shape[-1]))):
+                # The rest of the record is still being written.
+                break
+            yield MapBuffer(words)
+            recIdx += 1
+            numNew += 1
+        if not follow:
+            break
+        fileSize = os.path.getsize(filePath) if os.path.exists(filePath) else None
+        if numNew > 0 or fileSize != lastSize:
+            lastSize = fileSize
+            lastNewTime = time.time()
+        elif timeout is not None and time.time() - lastNewTime > timeout:
+            print 'Nothing new in %s for %f s, stopping after %i buffers ...' %(filePath, timeout, recIdx)
+            break
+        else:
+            time.sleep(pollTime)
+
+def iterPixels(filePath, **kws):
+    """ Yield (pixNum, spectra, realTimes_s, liveTimes_s) for every pixel in a file,
+        where the spectra are a (numModules, 4, nBins) view of the file.
+        Takes the keywords of iterBuffers.
+    """
+    for mapBuffer in iterBuffers(filePath, **kws):
+        realTimes_s, liveTimes_s, triggers, outEvents = mapBuffer.getStats()
+        for pixNum, pixSpectra, pixRealTimes_s, pixLiveTimes_s in zip(mapBuffer.getPixNums(), mapBuffer.getSpectra(), realTimes_s, liveTimes_s):
+            yield int(pixNum), pixSpectra, pixRealTimes_s, pixLiveTimes_s
+
+def iterSpectra(filePath, **kws):
+    """ Yield (pixNum, detChan, spectrum) for every pixel and channel in a file,
+        where the spectrum is a view of the file.  Takes the keywords of iterBuffers.
+    """
+    for mapBuffer in iterBuffers(filePath, **kws):
+        spectra = mapBuffer.getSpectra()
+        for pixNum, pixSpectra in zip(mapBuffer.getPixNums(), spectra):
+            for mod in range(mapBuffer.numModules):
+                for chan in range(chansPerModule):
+                    yield int(pixNum), mod * chansPerModule + chan, pixSpectra[mod, chan]
+
+if __name__ == '__main__':
+
+    """ Running the code below will print the pixels in a
+        mapping mode file, e.g. SR12ID01IOC53_1.nc, following
+        it while it is written.
+    """
+    for mapBuffer in iterBuffers(sys.argv[1], follow = True):
+        if mapBuffer.numPixels == 0:
+            continue
+        pixNums = mapBuffer.getPixNums()
+        realTimes_s, liveTimes_s, triggers, outEvents = mapBuffer.getStats()
+        print 'Buffer %i has pixels %i to %i, total counts %i, mean live time %f s ...' %(mapBuffer.bufNum,
+                                                                                         pixNums[0],
+                                                                                         pixNums[-1],
+                                                                                         mapBuffer.getSpectra().sum(),
+                                                                                         liveTimes_s.mean())
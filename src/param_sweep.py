@@ -19,11 +19,50 @@ import numpy as np
 import pylab as plt
 import os
 import sys
+import itertools
+import multiprocessing as mp
 import read_dir_funcs as rdf
 import peak_fit as pkf
+import spec_store as s_s
+import checkpoint as ckp
 
-def getWrittenPVChunks(pvBeforeStart, pvFilePath, startAcquisPV, detIOC):
-    """ Get a list of the PVs that were written.
+def getJournalPVChunks(journalPath):
+    """ Get a list of the PVs of each completed point of a journalled sweep,
+        in the order of the points.  Only points that finished are in the
+        journal, so a point that crashed after its PVs and EXSC were logged,
+        and was done again on resuming, is only counted once.
+    """
+    points, lastLine = ckp.readJournal(journalPath)
+    # The points are done in order and a resume redoes the one that crashed, so none are missing.
+    assert sorted(points) == range(len(points)), 'Journal %s is missing points ...' %(journalPath)
+    pvListOfLists = []
+    for index in range(len(points)):
+        pvList = []
+        for pvName, val in points[index]['pvs']:
+            try:
+                pvList.append((pvName, float(val)))
+            except (TypeError, ValueError):
+                # Only numeric PVs are swept.
+                pass
+        pvListOfLists.append(pvList)
+    return pvListOfLists
+
+def getWrittenPVChunks(pvBeforeStart, pvFilePaths, startAcquisPV, detIOC):
+    """ Get a list of the PVs that were written at each point of the sweep
+        from the PV log, or from each of a list of PV logs in the order they
+        were written, i.e. from checkpoint.getPVLogPaths for a resumed sweep.
+        A point that crashed after its EXSC was logged is in the log but was
+        done again on resuming, so use getJournalPVChunks for a journalled sweep.
+    """
+    if isinstance(pvFilePaths, basestring):
+        pvFilePaths = [pvFilePaths]
+    pvListOfLists = []
+    for pvFilePath in pvFilePaths:
+        pvListOfLists.extend(getFilePVChunks(pvBeforeStart, pvFilePath, startAcquisPV, detIOC))
+    return pvListOfLists
+
+def getFilePVChunks(pvBeforeStart, pvFilePath, startAcquisPV, detIOC):
+    """ Get a list of the PVs that were written in one PV log.
     """
     """ The last thing that is done prior to starting the scan is to
         set the scan number to 0 with the command
@@ -54,21 +93,29 @@ def getWrittenPVChunks(pvBeforeStart, pvFilePath, startAcquisPV, detIOC):
         if pvName == pvBeforeStart:
         
             # The 'lineBeforeStart' string has been found in the file.
+            # Anything written before it, i.e. by a set up in a log from before
+            # resumes had their own file, is not part of a point.
             startLineReached = True
+            pvList = []
     
         # Test to make sure that this is a PV in the sweep.        
-        if startLineReached:
+        elif startLineReached:
             
             # Test to make sure that this is not the PV that starts the acquisition.
-            if ((pvName != startAcquisPV) and (pvName != pvBeforeStart)):
+            if pvName != startAcquisPV:
             
-                if len (parts) == 2:
+                # PVs that already held the value are logged with a trailing 'skipped'.
+                if len (parts) == 2 or (len(parts) == 3 and parts[2] == 'skipped'):
                 
                     # Strip off the detector IOC name and the colon from the PV name.
                     pvName.strip(detIOC).strip(':')
                 
-                    # Add the tuple of the PV name and the PV value 
-                    pvList.append((pvName, float(parts[1])))
+                    try:
+                        # Add the tuple of the PV name and the PV value 
+                        pvList.append((pvName, float(parts[1].strip(','))))
+                    except ValueError:
+                        # Set up PVs, i.e. 'Passive', are not swept.
+                        pass
             else:
                 pvListOfLists.append(pvList)
                 
@@ -78,8 +125,6 @@ def getWrittenPVChunks(pvBeforeStart, pvFilePath, startAcquisPV, detIOC):
     # The 'lineBeforeStart' string must be found otherwise something is wrong, so assert this.
     assert startLineReached == True
     
-    # Strip off the top line as this is the line before the scan params start to be written.
-    pvListOfLists = pvListOfLists[1:]
     return pvListOfLists
  
 def getIdxFromString(filePath, splitChar, fileExt):
@@ -95,49 +140,106 @@ class Params():
     # An empty parameter container object.
     pass
 
-def fitAllData(params, dirPath, fileList, fitDataFilePath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, savePlot, showPlot, verbose):
+def fitFile(fitArgs):
+    """ Load and fit one spectrum file, returning only what is written to the fit data file.
+    """
+    npyFilePath, dirPath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, savePlot, showPlot, verbose = fitArgs
+
+    # Get the acquisition index as the number attached to the filename.
+    acquisIdx = getIdxFromString(npyFilePath, splitChar = '_', fileExt = '.npy')
+
+    # Load the spectral data.  
+    spec = np.load(npyFilePath)
+
+    # Fit the peak
+    calPoints, fits, fwhms = pkf.fit(spec,
+                                     dirPath,
+                                     acquisIdx,
+                                     numPksInRange, 
+                                     pkRangeMin_chan, 
+                                     pkRangeMax_chan, 
+                                     bgRange, 
+                                     numStDevs,
+                                     savePlot,
+                                     showPlot,
+                                     verbose)
+
+    # Only the first peak is written, so don't send the fitted curves back.
+    return acquisIdx, calPoints[:1], fwhms[:1]
+
+def fitAllData(params, dirPath, fileList, fitDataFilePath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, savePlot, showPlot, verbose, numProcs = 1):
+    """ Fit the spectrum in each file and write the first peak of each to the fit data file.
+        If numProcs > 1, the files are fitted by a pool of that many processes, 
+        but the results are still written in the order of fileList.
+    """
+    # Make the arguments for the fit of each file.
+    fitArgsList = [(npyFilePath, dirPath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, savePlot, showPlot, verbose)
+                   for npyFilePath in fileList[:-1]]
+
+    pool = None
+    if numProcs > 1:
+        # Hand each worker several files at a time to keep the overhead down.
+        pool = mp.Pool(numProcs)
+        chunkSize = max(1, len(fitArgsList) // (numProcs * 4))
+        results = pool.imap(fitFile, fitArgsList, chunkSize)
+    else:
+        results = itertools.imap(fitFile, fitArgsList)
+
     # Open the output data file to write to.
     fitDataFile = open(fitDataFilePath, 'w')
     
-    # Loop over the filenames that will be processed.
-    for npyFilePath in fileList[:-1]:
-        
-        # Get the acquisition index as the number attached to the filename.
-        acquisIdx = getIdxFromString(npyFilePath, splitChar = '_', fileExt = '.npy')
- 
-        # Initialize an empty list to dump the data into.
-        dataList = []
-        
-        # Load the spectral data.  
-        spec = np.load(npyFilePath)
-                
-        # Fit the peak
-        calPoints, fits, fwhms = pkf.fit(spec,
-                                         dirPath,
-                                         acquisIdx,
-                                         numPksInRange, 
-                                         pkRangeMin_chan, 
-                                         pkRangeMax_chan, 
-                                         bgRange, 
-                                         numStDevs,
-                                         savePlot,
-                                         showPlot,
-                                         verbose)
+    try:
+        # Loop over the fits in the order of the files.
+        for acquisIdx, calPoints, fwhms in results:
+
+            if len(calPoints) > 0:
+                # Save the figure that has been plotted.
+                headStr = '# %i \n' %(acquisIdx)
+                fitDataFile.write(headStr)
+           
+                # For each peak the fit data has the form, [fitPeakIndex, fitPeakVal, fwhm, fwhm / fitPeakIndex, totCounts]
+                print acquisIdx, calPoints[0], fwhms[0]
+                fitStr = 'acquisIdx=%i, fitPeakIndex=%i, fwhmNorm=%f \n' %(acquisIdx, calPoints[0], fwhms[0])
+                fitDataFile.write(fitStr)
+    finally:
+        # Close the file.
+        fitDataFile.close()
+        if pool is not None:
+            # All the results have been read back unless there was an error, so don't wait on the rest.
+            pool.terminate()
+            pool.join()
+  
+def fitStoreData(storeDir, fitDataFilePath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, verbose, blockSize = 500):
+    """ Fit the spectra in a spec_store.SpecStore and write the first peak of each
+        to the fit data file, as fitAllData does for the .npy files.
+        The spectra are read straight from the memory mapped store and fitted
+        blockSize at a time.
+    """
+    specStore = s_s.SpecStore(storeDir)
+    spectra, index = specStore.read()
+    latestRows = specStore.getLatestRows()
+
+    # Open the output data file to write to.
+    fitDataFile = open(fitDataFilePath, 'w')
+
+    for firstRow in np.arange(0, len(latestRows), blockSize):
+        blockRows = latestRows[firstRow:firstRow + blockSize]
+        calPoints, fits, fwhms = pkf.fitMany(spectra[[row for acquisIdx, row in blockRows]],
+                                             numPksInRange,
+                                             pkRangeMin_chan,
+                                             pkRangeMax_chan,
+                                             bgRange,
+                                             numStDevs,
+                                             verbose)
+        for (acquisIdx, row), specCalPoints, specFWHMs in zip(blockRows, calPoints, fwhms):
+            if len(specCalPoints) > 0:
+                fitDataFile.write('# %i \n' %(acquisIdx))
+                fitStr = 'acquisIdx=%i, fitPeakIndex=%i, fwhmNorm=%f \n' %(acquisIdx, specCalPoints[0], specFWHMs[0])
+                fitDataFile.write(fitStr)
 
-        
-        if len(fits) > 0:
-            # Save the figure that has been plotted.
-            headStr = '# %i \n' %(acquisIdx)
-            fitDataFile.write(headStr)
-       
-            # For each peak the fit data has the form, [fitPeakIndex, fitPeakVal, fwhm, fwhm / fitPeakIndex, totCounts]
-            print acquisIdx, calPoints[0], fwhms[0]
-            fitStr = 'acquisIdx=%i, fitPeakIndex=%i, fwhmNorm=%f \n' %(acquisIdx, calPoints[0], fwhms[0])
-            fitDataFile.write(fitStr)
-            
     # Close the file.
     fitDataFile.close()
-  
+
 def unfoldData(data):
     # Loop over the data.
     labels = []
@@ -243,6 +345,9 @@ if __name__ == '__main__':
      
     # There should be one and only one PV list file, so assert this.
     assert len(pvFileList) == 1
+
+    # Any resumes of the sweep have their own PV logs, which follow it.
+    pvFileList = ckp.getPVLogPaths(dirPath)
     
     """ The last thing that is done prior to starting the scan is
         'SR12ID01IOC56:ClientWait' 
@@ -259,14 +364,15 @@ if __name__ == '__main__':
     startAcquisPV =   '%s:scan1.EXSC' %(detIOC)
     
     # Get the list of PVs that were set during the parameter sweep.
-    pvListOfLists = getWrittenPVChunks(pvBeforeStart, pvFileList[0], startAcquisPV, detIOC)
-    
-    # Specify the string on which to filter the files in the directory.
-    mdaFiltStr = '.npy'
+    # The journal only holds the points that finished, so use it if the sweep has one.
+    journalPath = ckp.getJournalPath(dirPath)
+    if os.path.exists(journalPath):
+        pvListOfLists = getJournalPVChunks(journalPath)
+    else:
+        pvListOfLists = getWrittenPVChunks(pvBeforeStart, pvFileList, startAcquisPV, detIOC)
     
-    # Filter the contents of dirPath based on the required file extension.
-    fileList = rdf.listDirCont(dirPath, keepPath = True)
-    fileList = rdf.filterDirCont(fileList, mdaFiltStr, sort = True)
+    # The spectra of the sweep are in a spec_store.SpecStore in the output dir.
+    specStore = s_s.SpecStore(dirPath)
     
     # Declare the path of file to write the output data to.
     fitDataFileName = 'FitData.txt'
@@ -305,8 +411,10 @@ if __name__ == '__main__':
     pkRangeMin_chan = 601
     pkRangeMax_chan = 2040
     
-    # Now fit all the data. 
-    #fitAllData(params, dirPath, fileList, fitDataFilePath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, savePlot, showPlot, verbose)
+    # Now fit all the data, unless it has already been fitted.
+    # Only the latest spectrum of a point that was done again on resuming is fitted.
+    if not os.path.exists(fitDataFilePath):
+        fitStoreData(dirPath, fitDataFilePath, bgRange, numPksInRange, pkRangeMin_chan, pkRangeMax_chan, numStDevs, verbose)
     
     # Now plot the result.
     masterDict = readBackFitData(fitDataFilePath, True)
@@ -326,10 +434,12 @@ if __name__ == '__main__':
     plt.savefig(saveStr)
     
     plt.figure()
-    s1 = np.load(os.path.join(dirPath, 'spec_1150.npy'))
-    s2 = np.load(os.path.join(dirPath, 'spec_200.npy'))
-    s3 = np.load(os.path.join(dirPath, 'spec_240.npy'))
-    s4 = np.load(os.path.join(dirPath, 'spec_987.npy'))
+    spectra, index = specStore.read()
+    latestRows = dict(specStore.getLatestRows())
+    s1 = spectra[latestRows[1150]]
+    s2 = spectra[latestRows[200]]
+    s3 = spectra[latestRows[240]]
+    s4 = spectra[latestRows[987]]
     
     plt.plot(s1, label = '1150')
     plt.plot(s2, label = '200')
@@ -22,15 +22,17 @@ import sys
 from copy import deepcopy
 import read_dir_funcs as rdf
 
+# The ratio of the FWHM to the sigma of a Gaussian.
+fwhmPerSigma = 2.0 * np.sqrt(2.0 * np.log(2.0))
+
 def getFWHM(histo, maxIndex):
     """
     Function: Returns the FWHM of a histogram.  
     """
-    nHisto = deepcopy(histo)
-    maxVal = nHisto[maxIndex]
+    maxVal = histo[maxIndex]
     # Get bins of histogram that are >= half the maximum height.
-    bools = nHisto >= (maxVal * 0.5)
-    return list(bools).count(True)
+    bools = np.asarray(histo) >= (maxVal * 0.5)
+    return np.count_nonzero(bools)
 
 def printList(toPrintList):
     for statement in toPrintList:
@@ -40,8 +42,10 @@ def getPeak(histo):
     """
     Function: Returns peak index and value.  
     """
-    maxVal = np.max(histo)
-    return np.float64(list(histo).index(maxVal)), np.float64(maxVal) 
+    # argmax returns the first bin with the maximum value.
+    # The index is an int as it is used to slice the histo.
+    maxIndex = int(np.argmax(histo))
+    return maxIndex, np.float64(histo[maxIndex])
 
 def getCenters(hist, pkIndex, pkVal):
     """
@@ -140,6 +144,138 @@ def fitGaussian(spec, cent, sig):
     gaus = getGaussian(max, x, cent, sig)
     return gaus
 
+def gridFit(spec, bgLine, lowBg, highBg, cents, wids):
+    """
+    Function: Returns the best fit Gaussian plus background over the
+    window lowBg:highBg from a grid of centers and widths.
+    The whole grid is evaluated as one array over the window only.
+    """
+    # Get just the section of the spectrum to fit.
+    spec2Fit = spec[lowBg:highBg]
+
+    # Make the grid of candidate (center, width) pairs, centers varying slowest.
+    x = np.arange(lowBg, highBg)
+    cents = np.asarray(cents)[:, np.newaxis, np.newaxis]
+    wids = np.asarray(wids)[np.newaxis, :, np.newaxis]
+
+    # Get the Gaussians with the desired parameters and add the background.
+    gaus = getGaussian(np.max(spec), x, cents, wids) + bgLine
+    gaus = gaus.reshape(-1, len(x))
+
+    # Rescale each by the area.
+    gaus *= (spec2Fit.max() / gaus.max(axis = 1))[:, np.newaxis]
+
+    # Get the difference and the index of the best fit.
+    diffVal = np.sum((spec2Fit - gaus) ** 2, axis = 1)
+    return gaus[np.argmin(diffVal)]
+
+def getModelAndJacobian(x, xRef, pars):
+    """
+    Function: Returns the Gaussian plus linear background model and its
+    derivatives with respect to (amplitude, centroid, sigma, background
+    offset, background slope) for each row of x.
+    """
+    amp, cent, sig, bgOff, bgSlope = [pars[:, i][:, np.newaxis] for i in np.arange(5)]
+    dx = x - cent
+    gaus = np.exp(-dx**2 / (2.0 * sig**2))
+    model = amp * gaus + bgOff + bgSlope * (x - xRef)
+    jac = np.empty(x.shape + (5,))
+    jac[..., 0] = gaus
+    jac[..., 1] = amp * gaus * dx / sig**2
+    jac[..., 2] = amp * gaus * dx**2 / sig**3
+    jac[..., 3] = 1.0
+    jac[..., 4] = x - xRef
+    return model, jac
+
+def lmFitMany(x, y, inWin, pars, maxIter = 20, tol = 1e-6):
+    """
+    Function: Levenberg-Marquardt least-squares fit of a Gaussian plus a
+    linear background to each row of y, using only the bins in inWin.
+    pars holds the starting (amplitude, centroid, sigma, background offset,
+    background slope) for each row, the background offset being the value
+    at the first bin of the row.  Returns the fitted pars and whether each
+    row converged.
+    """
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    weight = np.asarray(inWin, dtype = float)
+    pars = np.array(pars, dtype = float)
+    xRef = x[:, :1]
+    numRows = len(pars)
+    lam = np.ones(numRows) * 1e-3
+    converged = np.zeros(numRows, dtype = bool)
+    done = np.zeros(numRows, dtype = bool)
+
+    model, jac = getModelAndJacobian(x, xRef, pars)
+    resid = (y - model) * weight
+    chiSq = np.sum(resid**2, axis = 1)
+
+    for iteration in np.arange(maxIter):
+
+        # Solve the damped normal equations for the step in each row.
+        jacW = jac * weight[..., np.newaxis]
+        alpha = np.einsum('nmi,nmj->nij', jacW, jacW)
+        beta = np.einsum('nmi,nm->ni', jacW, resid)
+        diag = np.diagonal(alpha, axis1 = 1, axis2 = 2)
+        # Keep the matrix invertible when a parameter has no effect, e.g. zero amplitude.
+        damp = lam[:, np.newaxis] * diag + 1e-12 * (diag.sum(axis = 1)[:, np.newaxis] + 1.0)
+        alpha = alpha + damp[:, :, np.newaxis] * np.eye(5)
+        step = np.linalg.solve(alpha, beta[..., np.newaxis])[..., 0]
+
+        # Try the step and keep it only where it reduces chi squared.
+        trial = pars + step
+        trial[:, 2] = np.abs(trial[:, 2]) + 1e-6
+        trialModel, trialJac = getModelAndJacobian(x, xRef, trial)
+        trialResid = (y - trialModel) * weight
+        trialChiSq = np.sum(trialResid**2, axis = 1)
+        better = (trialChiSq < chiSq) & ~done
+
+        # Converged when the improvement is small relative to chi squared.
+        small = (chiSq - trialChiSq) <= tol * (chiSq + 1e-12)
+        converged |= better & small
+        converged |= ~better & ~done & (lam > 1e8)
+
+        pars[better] = trial[better]
+        model[better] = trialModel[better]
+        jac[better] = trialJac[better]
+        resid[better] = trialResid[better]
+        chiSq[better] = trialChiSq[better]
+        lam = np.where(better, lam * 0.1, lam * 10.0)
+
+        done |= converged
+        if done.all():
+            break
+
+    return pars, converged
+
+def lmFit(spec, lowBg, highBg, pars, maxIter = 20, tol = 1e-6):
+    """
+    Function: Least-squares fit of a Gaussian plus linear background over
+    the window lowBg:highBg of spec, starting from pars.  Returns the fitted
+    (amplitude, centroid, sigma, background offset, background slope) and
+    whether the fit converged.
+    """
+    x = np.arange(lowBg, highBg)[np.newaxis, :]
+    y = np.asarray(spec[lowBg:highBg], dtype = float)[np.newaxis, :]
+    fitPars, converged = lmFitMany(x, y, np.ones(y.shape, dtype = bool), [pars], maxIter, tol)
+    return fitPars[0], converged[0]
+
+def getRefineSeeds(bestMax, bestIndex, lowBg, bgStart, bgStep, fwhm):
+    """
+    Function: Returns the starting (amplitude, centroid, sigma, background
+    offset, background slope) for lmFit from the best grid fit.
+    """
+    amp = bestMax - (bgStart + bgStep * bestIndex)
+    sig = np.maximum(fwhm, 1.0) / fwhmPerSigma
+    return [amp, lowBg + bestIndex, sig, bgStart, bgStep]
+
+def isGoodRefine(pars, converged, lowBg, highBg):
+    """
+    Function: Returns whether a refined fit can be used in place of the grid fit.
+    """
+    amp, cent, sig = pars[..., 0], pars[..., 1], pars[..., 2]
+    return converged & (amp > 0) & (cent >= lowBg) & (cent < highBg) & (sig < (highBg - lowBg))
+
 def movingaverage(interval, window_size):
     window= np.ones(int(window_size))/float(window_size)
     return np.convolve(interval, window, 'same')
@@ -155,7 +291,8 @@ def fit(specToFit,
         numStDevs,
         savePlot,
         showPlot,
-        verbose):
+        verbose,
+        refine = False):
         
     # The index for the spectrum must be a real positive integer, so assert this.
     assert (type(idx) == int) and (idx >= 0)
@@ -299,46 +436,27 @@ def fit(specToFit,
         # Get the line that defines the background.
         bgLine = np.linspace(yThresh[lowBg], yThresh[highBg], num = highBg - lowBg)
 
-        # Set the background as a spectrum that can be used.
-        bgSpec = np.zeros_like(yThresh)
-        bgSpec[lowBg:highBg] = bgLine 
-
-        # Get just the section of the spectrum to fit.
-        spec2Fit = deepcopy(yThresh)[lowBg:highBg]
-
-        diffFit = []
-        diffVal = []
-        
-        for cent in centers2Keep:
-            for wid in range(width - 5, width + 5):
-                
-                # Get the Gaussian with the desired parameters.
-                gaus = fitGaussian(yThresh, cent, wid)
-        
-                # Add the background to the fit.
-                gaus += bgSpec
-
-                # Get just the section of the spectrum to fit.
-                gaus2Fit = deepcopy(gaus)[lowBg:highBg]
-
-                # Rescale by the area.
-                gaus2Fit *=  (spec2Fit.max() / gaus2Fit.max())
-                
-                # Get the difference.
-                diff = np.sum((spec2Fit - gaus2Fit) ** 2)
-                # Append.
-                diffFit.append(gaus2Fit)
-                diffVal.append(diff)
-
-        # Get the index of the best fir.
-        minIndex = diffVal.index(np.min(diffVal))
-        bestGaus = diffFit[minIndex]
+        # Get the best fit from the grid of centers and widths.
+        bestGaus = gridFit(yThresh, bgLine, lowBg, highBg, centers2Keep, range(width - 5, width + 5))
         
         # Get centroid of best fit.
-        calChan = list(bestGaus).index(bestGaus.max()) + lowBg
+        bestIndex = int(np.argmax(bestGaus))
+        calChan = bestIndex + lowBg
         
         # Get the FWHM of the peak.
-        fwhms.append(np.float64(getFWHM(bestGaus, list(bestGaus).index(np.max(bestGaus)))))
+        fwhm = np.float64(getFWHM(bestGaus, bestIndex))
+
+        if refine:
+            # Refine the centroid and FWHM to sub-channel values with a least-squares fit seeded from the grid.
+            bgStep = (bgLine[-1] - bgLine[0]) / max(len(bgLine) - 1, 1)
+            pars, converged = lmFit(yThresh, lowBg, highBg, getRefineSeeds(bestGaus[bestIndex], bestIndex, lowBg, bgLine[0], bgStep, fwhm))
+            if isGoodRefine(pars, converged, lowBg, highBg):
+                calChan = pars[1]
+                fwhm = np.float64(pars[2] * fwhmPerSigma)
+                fitX = lowBg + np.arange(len(bestGaus))
+                bestGaus = getModelAndJacobian(fitX[np.newaxis, :], lowBg, pars[np.newaxis, :])[0][0]
+
+        fwhms.append(fwhm)
 
         # Remove data from the existing fit so it can't be reused.
         yThresh[lowBg:highBg] = bgLine
@@ -351,7 +469,203 @@ def fit(specToFit,
         calPoints.append(calChan)
         fits.append((lowBg + np.arange(len(bestGaus)), bestGaus))
         
-        print "Peak center is %d ..." %(calChan)
+        print "Peak center is %s ..." %(calChan)
+
+    return calPoints, fits, fwhms
+
+def movingaverageMany(spectra, window_size):
+    """
+    Function: Returns the moving average of each row of a 2D array,
+    the same as movingaverage applied to each row.
+    """
+    nPad = int(window_size) // 2
+    padded = np.zeros((spectra.shape[0], spectra.shape[1] + int(window_size) - 1))
+    padded[:, nPad:nPad + spectra.shape[1]] = spectra
+    weight = 1.0 / float(window_size)
+    smoothed = np.zeros(spectra.shape)
+    for shift in np.arange(int(window_size)):
+        smoothed += weight * padded[:, shift:shift + spectra.shape[1]]
+    return smoothed
+
+def getNthTrue(mask, positions):
+    """
+    Function: Returns the bin number of the n-th True bin in each row of
+    mask, for each n in the columns of positions.
+    """
+    # Sort so the True bins come first, keeping them in ascending order.
+    order = np.argsort(~mask, axis = 1, kind = 'mergesort')
+    rows = np.arange(mask.shape[0])[:, np.newaxis]
+    return order[rows, positions]
+
+def fitMany(spectra,
+            numPksInRange,
+            pkRangeMin,
+            pkRangeMax,
+            bgRange,
+            numStDevs,
+            verbose,
+            refine = False):
+    """
+    Function: Fits the peaks in every row of a 2D array of spectra at once.
+    The steps are the same as fit, but each is done for all channels as
+    array operations.  Returns lists of calPoints, fits and fwhms with one
+    entry per channel, each as fit would return for that channel.
+    If refine, the grid fits seed a least-squares fit of all channels together.
+    """
+    # Make a copy of the input spectra, they must be 2d.
+    spectra = np.asarray(spectra, dtype = float)
+    assert (len(spectra.shape) == 2)
+    numChans, nBins = spectra.shape
+    chans = np.arange(numChans)
+    x = np.arange(nBins)
+
+    # Take a moving average to smooth the noise.
+    y = movingaverageMany(spectra, 3)
+
+    # Make a copy and zero everthing below the threshold and outside the peak range.
+    thresh = bgRange[0]
+    yThresh = y.copy()
+    yThresh[:, :thresh] = 0
+    yThresh[:, :pkRangeMin] = 0
+    yThresh[:, pkRangeMax:] = 0
+
+    # Get mean background and its limit.
+    bg = y.copy()
+    bg[:, :thresh] = 0
+    bg[:, bgRange[-1]:] = 0
+    meanBg = (bg.sum(axis = 1) / nBins) + 1.0
+    maxLim = meanBg + (numStDevs * np.std(bg, axis = 1))
+
+    # Get the range of bins that are left to search for peaks.
+    searchMin = max(thresh, pkRangeMin, 0)
+    searchMax = min(pkRangeMax, nBins)
+    searchLen = max(searchMax - searchMin, 1)
+
+    # Get index of peak value in each spectrum.
+    pkIndex = np.argmax(y, axis = 1)
+    pkVal = y[chans, pkIndex]
+
+    calPoints = [[] for chan in chans]
+    fits = [[] for chan in chans]
+    fwhms = [[] for chan in chans]
+
+    # The channels that are still being searched for peaks.
+    active = np.ones(numChans, dtype = bool)
+
+    # The code should not be used to find more than 6 peaks.
+    for pkNum in np.arange(min(numPksInRange, 7)):
+
+        # If not enough counts in the spectrum or the peak, don't fit.
+        active &= yThresh.sum(axis = 1) >= 50
+        active &= yThresh.max(axis = 1) >= 3.0 * meanBg
+
+        # Get possible bin centers either side of the peak.
+        aboveHalf = (yThresh >= (0.5 * pkVal)[:, np.newaxis]) & (x > 0)
+        lowMask = aboveHalf & (x <= pkIndex[:, np.newaxis])
+        highMask = aboveHalf & (x >= pkIndex[:, np.newaxis])
+        numLow = lowMask.sum(axis = 1)
+        numHigh = highMask.sum(axis = 1)
+        numCents = numLow + numHigh
+
+        # Get the width - take the smallest of the two and add two to make sure.
+        width = np.minimum(numLow, numHigh) + 2
+        active &= (numCents >= 7) & (width >= 5)
+
+        # Get the points where the peak reaches the background.
+        underLim = (yThresh <= maxLim[:, np.newaxis]) & (x > 0)
+        lowBgMask = underLim & (x <= pkIndex[:, np.newaxis])
+        highBgMask = underLim & (x >= pkIndex[:, np.newaxis])
+        active &= lowBgMask.any(axis = 1) & highBgMask.any(axis = 1)
+        lowBg = np.where(lowBgMask, x, -1).max(axis = 1)
+        highBg = np.where(highBgMask, x, nBins).min(axis = 1)
+        active &= highBg > lowBg
+
+        fitChans = chans[active]
+        if len(fitChans) == 0:
+            break
+
+        #######################################################
+        # Fit the peak in every channel that is still active. #
+        #######################################################
+
+        lowBg = lowBg[fitChans]
+        highBg = highBg[fitChans]
+        numFit = len(fitChans)
+        rows = np.arange(numFit)[:, np.newaxis]
+
+        # Just keep the 6 centers closest to the middle of the low and high centers.
+        mid = ((numCents[fitChans] + 1) // 2)[:, np.newaxis]
+        positions = mid - 3 + np.arange(6)
+        nLow = numLow[fitChans][:, np.newaxis]
+        # The centers can only be in the search range, as yThresh is 0 outside it.
+        lows = getNthTrue(lowMask[fitChans, searchMin:searchMax], np.minimum(positions, searchLen - 1)) + searchMin
+        highs = getNthTrue(highMask[fitChans, searchMin:searchMax], np.clip(positions - nLow, 0, searchLen - 1)) + searchMin
+        cents = np.where(positions < nLow, lows, highs)
+        wids = width[fitChans][:, np.newaxis] - 5 + np.arange(10)
+
+        # Get the window to fit for each channel, padded to the longest.
+        winLen = highBg - lowBg
+        winBins = np.arange(winLen.max())
+        inWin = winBins < winLen[:, np.newaxis]
+        winX = lowBg[:, np.newaxis] + winBins
+        winMask = (x >= lowBg[:, np.newaxis]) & (x < highBg[:, np.newaxis])
+        fitThresh = yThresh[fitChans]
+        spec2Fit = np.zeros(inWin.shape)
+        spec2Fit[inWin] = fitThresh[winMask]
+
+        # Get the line that defines the background, as np.linspace would.
+        startBg = yThresh[fitChans, lowBg]
+        stopBg = yThresh[fitChans, highBg]
+        step = (stopBg - startBg) / np.maximum(winLen - 1, 1)
+        bgLine = winBins * step[:, np.newaxis] + startBg[:, np.newaxis]
+        isLast = (winBins == (winLen - 1)[:, np.newaxis]) & (winLen > 1)[:, np.newaxis]
+        bgLine = np.where(isLast, stopBg[:, np.newaxis], bgLine)
+        bgLine = np.where(inWin, bgLine, 0.0)
+
+        # Get the Gaussians for the grid of centers and widths, with the background added.
+        maxY = fitThresh.max(axis = 1)
+        gaus = getGaussian(maxY[:, np.newaxis, np.newaxis, np.newaxis],
+                           winX[:, np.newaxis, np.newaxis, :],
+                           cents[:, :, np.newaxis, np.newaxis],
+                           wids[:, np.newaxis, :, np.newaxis])
+        gaus = (gaus + bgLine[:, np.newaxis, np.newaxis, :]).reshape(numFit, -1, len(winBins))
+
+        # Rescale each by the area over the window only.
+        gausMax = np.where(inWin[:, np.newaxis, :], gaus, -np.inf).max(axis = 2)
+        gaus *= (spec2Fit.max(axis = 1)[:, np.newaxis] / gausMax)[:, :, np.newaxis]
+
+        # Get the difference and the best fit for each channel.
+        diffVal = np.sum(np.where(inWin[:, np.newaxis, :], (spec2Fit[:, np.newaxis, :] - gaus) ** 2, 0.0), axis = 2)
+        bestGaus = gaus[rows[:, 0], np.argmin(diffVal, axis = 1)]
+        bestGaus = np.where(inWin, bestGaus, -np.inf)
+
+        # Get centroid and FWHM of the best fit.
+        bestIndex = np.argmax(bestGaus, axis = 1)
+        calChans = bestIndex + lowBg
+        bestMax = bestGaus[rows[:, 0], bestIndex]
+        bestFWHMs = np.sum(bestGaus >= (bestMax * 0.5)[:, np.newaxis], axis = 1).astype(float)
+
+        if refine:
+            # Refine the centroids and FWHMs to sub-channel values with a least-squares fit seeded from the grid.
+            seeds = getRefineSeeds(bestMax, bestIndex, lowBg, startBg, step, bestFWHMs)
+            pars, converged = lmFitMany(winX, spec2Fit, inWin, np.column_stack(seeds))
+            good = isGoodRefine(pars, converged, lowBg, highBg)
+            model = getModelAndJacobian(winX, lowBg[:, np.newaxis], pars)[0]
+            calChans = np.where(good, pars[:, 1], calChans)
+            bestFWHMs = np.where(good, pars[:, 2] * fwhmPerSigma, bestFWHMs)
+            bestGaus = np.where(good[:, np.newaxis] & inWin, model, bestGaus)
+
+        # Remove data from the existing fit so it can't be reused.
+        fitThresh[winMask] = bgLine[inWin]
+        yThresh[fitChans] = fitThresh
+
+        for row, chan in enumerate(fitChans):
+            calPoints[chan].append(calChans[row])
+            fwhms[chan].append(np.float64(bestFWHMs[row]))
+            fits[chan].append((lowBg[row] + np.arange(winLen[row]), bestGaus[row, :winLen[row]]))
+
+        if verbose:
+            print "Found peak %i in %i of %i channels ..." %(pkNum + 1, numFit, numChans)
 
     return calPoints, fits, fwhms
 
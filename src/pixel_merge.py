@@ -0,0 +1,169 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import numpy as np
+import map_reader as m_r
+import map_builder as m_b
+import spec_store as s_s
+
+class PixelMerger(object):
+    """ Join the pixel streams of the IOCs of one detector by pixel number, i.e.
+        SR12ID01IOC53 and SR12ID01IOC54 of the 100 element detector, and yield
+        (pixNum, spectra, realTimes_s, liveTimes_s, present) for each pixel in
+        order, with the spectra of all of the channels in one (numChans, nBins)
+        array and present saying which streams had the pixel.
+        Each stream gives (pixNum, spectra, realTimes_s, liveTimes_s) as
+        map_reader.iterPixels does.  Up to maxPending pixels of each stream are
+        held while waiting for the others, so pixels can arrive out of order, and
+        a pixel that hasn't arrived by the time a stream has that many waiting is
+        counted as missing from it.  If it then arrives, within maxLate pixels of
+        the next one to be merged, it is dropped and counted as late, any other
+        pixel that arrives again is dropped and counted as a duplicate.
+        The streams are read as the pixels are needed, so memory does not grow
+        with the length of the run.
+    """
+    def __init__(self, streams, chanCounts, maxPending = 64, nBins = 2048, firstPix = 0, maxLate = 1024):
+        assert len(streams) == len(chanCounts)
+        self.streams = [iter(stream) for stream in streams]
+        self.chanCounts = list(chanCounts)
+        # The channels of each stream follow those of the one before it.
+        self.chanOffsets = list(np.cumsum([0] + self.chanCounts[:-1]))
+        self.numChans = sum(self.chanCounts)
+        self.maxPending = maxPending
+        self.nBins = nBins
+        self.nextPix = firstPix
+        self.pending = [{} for stream in streams]
+        self.done = [False for stream in streams]
+        self.maxLate = maxLate
+        # The recent pixels that each stream has been counted as missing.
+        self.missingPix = [set() for stream in streams]
+        self.numMissing = [0 for stream in streams]
+        self.numLate = [0 for stream in streams]
+        self.numDuplicates = [0 for stream in streams]
+        self.numMerged = 0
+
+    def fill(self, streamIdx):
+        """ Read a stream until it has the next pixel waiting, has maxPending
+            pixels waiting or has ended.
+        """
+        pending = self.pending[streamIdx]
+        while not self.done[streamIdx] and self.nextPix not in pending and len(pending) < self.maxPending:
+            try:
+                pixel = next(self.streams[streamIdx])
+            except StopIteration:
+                self.done[streamIdx] = True
+                break
+            pixNum = pixel[0]
+            if pixNum in self.missingPix[streamIdx]:
+                print 'Dropping pixel %i from stream %i, it arrived after it was merged as missing ...' %(pixNum, streamIdx)
+                self.missingPix[streamIdx].discard(pixNum)
+                self.numLate[streamIdx] += 1
+                continue
+            if pixNum < self.nextPix or pixNum in pending:
+                print 'Dropping duplicate pixel %i from stream %i ...' %(pixNum, streamIdx)
+                self.numDuplicates[streamIdx] += 1
+                continue
+            pending[pixNum] = pixel
+
+    def addMissing(self, streamIdx, firstPix, endPix):
+        """ Count pixels firstPix up to endPix as missing from a stream, and
+            remember the last maxLate of them so they can be told apart from
+            duplicates if they arrive late.
+        """
+        self.numMissing[streamIdx] += endPix - firstPix
+        missingPix = self.missingPix[streamIdx]
+        missingPix.update(range(max(firstPix, endPix - self.maxLate), endPix))
+        if len(missingPix) > 2 * self.maxLate:
+            for pixNum in [pixNum for pixNum in missingPix if pixNum < endPix - self.maxLate]:
+                missingPix.discard(pixNum)
+
+    def merge(self, present):
+        """ Make the record of the next pixel from the streams that have it.
+            The channels of the streams that don't are 0 and their times NaN.
+        """
+        spectra = np.zeros((self.numChans, self.nBins), dtype = np.uint16)
+        realTimes_s = np.empty(self.numChans)
+        realTimes_s.fill(np.nan)
+        liveTimes_s = realTimes_s.copy()
+        for streamIdx, isPresent in enumerate(present):
+            if not isPresent:
+                print 'Pixel %i is missing from stream %i ...' %(self.nextPix, streamIdx)
+                self.addMissing(streamIdx, self.nextPix, self.nextPix + 1)
+                continue
+            pixNum, pixSpectra, pixRealTimes_s, pixLiveTimes_s = self.pending[streamIdx].pop(self.nextPix)
+            firstChan = self.chanOffsets[streamIdx]
+            numChans = self.chanCounts[streamIdx]
+            assert np.size(pixSpectra) == numChans * self.nBins, 'Stream %i has %i values per pixel, not %i ...' %(streamIdx, np.size(pixSpectra), numChans * self.nBins)
+            spectra[firstChan:firstChan + numChans].reshape(pixSpectra.shape)[...] = pixSpectra
+            realTimes_s[firstChan:firstChan + numChans] = pixRealTimes_s
+            liveTimes_s[firstChan:firstChan + numChans] = pixLiveTimes_s
+        self.numMerged += 1
+        return self.nextPix, spectra, realTimes_s, liveTimes_s, present
+
+    def __iter__(self):
+        while True:
+            for streamIdx in range(len(self.streams)):
+                self.fill(streamIdx)
+            present = [self.nextPix in pending for pending in self.pending]
+            if any(present):
+                yield self.merge(present)
+                self.nextPix += 1
+                continue
+            # No stream has the next pixel, so each one is full or has ended.
+            waiting = [pixNum for pending in self.pending for pixNum in pending]
+            if len(waiting) == 0:
+                break
+            # Skip to the first pixel that any stream has.
+            print 'Pixels %i to %i are missing from every stream ...' %(self.nextPix, min(waiting) - 1)
+            for streamIdx in range(len(self.streams)):
+                self.addMissing(streamIdx, self.nextPix, min(waiting))
+            self.nextPix = min(waiting)
+
+    def printStats(self):
+        print 'Merged %i pixels ...' %(self.numMerged)
+        for streamIdx in range(len(self.streams)):
+            print 'Stream %i had %i missing pixels, %i of which arrived late, and %i duplicate pixels ...' %(streamIdx,
+                                                                                                         self.numMissing[streamIdx],
+                                                                                                         self.numLate[streamIdx],
+                                                                                                         self.numDuplicates[streamIdx])
+
+if __name__ == '__main__':
+
+    """ Running the code below will merge the netCDF files of a dual
+        IOC 100 element run, given the time stamp and file number,
+        into a store of 100 channel pixels in the output dir, while
+        the files are written.
+    """
+    timeStamp, fileNum, outDirStr = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+    detIOCList = ['SR12ID01IOC53', 'SR12ID01IOC54']
+    # The 100 element MCAs are split between the IOCs in whole modules.
+    numChans = 100
+    chanCounts = m_b.getIOCChanCounts(numChans, len(detIOCList))
+    streams = [m_r.iterPixels(m_b.getMapFilePath(detIOC, timeStamp, fileNum), follow = True) for detIOC in detIOCList]
+    pixelMerger = PixelMerger(streams, chanCounts)
+    specStore = s_s.SpecStore(outDirStr, 'mapPixels', 'a')
+    # Add the pixels to the store a batch at a time.
+    batchSize = 64
+    records = []
+    for pixNum, spectra, realTimes_s, liveTimes_s, present in pixelMerger:
+        records.append((pixNum, spectra, None))
+        if len(records) == batchSize:
+            specStore.appendMany(records)
+            records = []
+    specStore.appendMany(records)
+    pixelMerger.printStats()
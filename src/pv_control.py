@@ -21,7 +21,12 @@ import os
 import subprocess as sb
 import numpy as np
 import time
-import epics as ep
+import threading as th
+try:
+    import epics as ep
+except ImportError:
+    # Without pyepics only a simulated backend can be used, see sim_ioc.
+    ep = None
 
 def setFile(fName):
     pvLogFile = open(fName, "w")
@@ -36,27 +41,356 @@ def writePV2File(outFile, pv2Set, pvVal):
     # Write the PV to file.
     outFile.write("%s, %s \n" %(pv2Set, pvVal))
 
-def caputPV(pv2Set, pvVal, pvLogFile, log, verbose):
-    """ Use the pyepics lib to write the PVs.
+def writeSkippedPV2File(outFile, pv2Set, pvVal):
+    # Write a PV that already held the value, and so was not written, to file.
+    outFile.write("%s, %s, skipped \n" %(pv2Set, pvVal))
+
+class ShadowCache(object):
+    """ Remember the last value written to or read from each PV so that
+        writes of a value the PV already holds can be skipped.
+    """
+    # Fields that trigger an action, so must always be written.
+    actionFields = ('EXSC', 'EraseStart', 'Apply', 'Capture', 'StopAll', 'NextPixel', 'PROC')
+    # Fields that the IOC counts up itself on each acquisition, so a
+    # remembered value can't be trusted and they are never cached.
+    iocOwnedFields = ('FileNumber', 'saveData_scanNumber')
+
+    def __init__(self, floatTol = 1e-6):
+        self.lock = th.Lock()
+        self.vals = {}
+        self.enabled = False
+        self.floatTol = floatTol
+        self.skipped = 0
+
+    def getField(self, pvName):
+        # Get the field name after the last ':' or '.'.
+        return pvName.split(':')[-1].split('.')[-1]
+
+    def isAction(self, pvName):
+        return self.getField(pvName) in self.actionFields
+
+    def isIOCOwned(self, pvName):
+        return self.getField(pvName) in self.iocOwnedFields
+
+    def update(self, pvName, pvVal):
+        # Only keep scalars and strings, waveforms are never compared.
+        if pvVal is None or isinstance(pvVal, np.ndarray) or self.isIOCOwned(pvName):
+            return
+        with self.lock:
+            self.vals[pvName] = pvVal
+
+    def onPutComplete(self, pvname = None, data = None, **kws):
+        # Called from the CA thread once a put has completed, with the value written as data.
+        self.update(pvname, data)
+
+    def addSkipped(self, numSkipped = 1):
+        with self.lock:
+            self.skipped += numSkipped
+
+    def invalidate(self, pvName = None):
+        # Forget one PV, or all of them if no PV is given.
+        with self.lock:
+            if pvName is None:
+                self.vals.clear()
+            else:
+                self.vals.pop(pvName, None)
+
+    def isSame(self, pvName, pvVal):
+        """ Test if the PV is known to already hold the value.
+        """
+        if not self.enabled or self.isAction(pvName) or self.isIOCOwned(pvName):
+            return False
+        with self.lock:
+            if pvName not in self.vals:
+                return False
+            oldVal = self.vals[pvName]
+        if isinstance(oldVal, (int, long, float, np.number)) and isinstance(pvVal, (int, long, float, np.number)):
+            # Compare numbers to within a tolerance relative to their size.
+            return abs(oldVal - pvVal) <= self.floatTol * max(abs(oldVal), abs(pvVal), 1.0)
+        return type(oldVal) == type(pvVal) and oldVal == pvVal
+
+# The cache that is shared by all of the PV access functions.
+shadowCache = ShadowCache()
+
+def setWriteSuppression(enabled, floatTol = None):
+    """ Turn skipping of redundant writes on or off.
+    """
+    shadowCache.enabled = enabled
+    if floatTol is not None:
+        shadowCache.floatTol = floatTol
+    # Start from a clean slate so nothing stale is trusted.
+    shadowCache.invalidate()
+
+class EpicsBackend(object):
+    """ The backend that talks to the real IOCs through pyepics.
+        Any other backend, i.e. sim_ioc.SimIOC, must provide the same methods
+        and return channel objects that behave like epics.PV.
+    """
+    def createPV(self, pvName, connTimeout, connCallback):
+        # Create the channel object, this only starts the connection.
+        return ep.PV(pvName, connection_timeout = connTimeout, connection_callback = connCallback)
+
+    def getMany(self, pvs, count = None):
+        # Issue all of the gets, of only the first count elements if count is given.
+        for pv in pvs:
+            if pv.connected:
+                ep.ca.get(pv.chid, count = count, wait = False)
+        # Now collect the values as they arrive.
+        pvVals = []
+        for pv in pvs:
+            pvVal = None
+            if pv.connected:
+                pvVal = ep.ca.get_complete(pv.chid, count = count)
+            pvVals.append(pvVal)
+        return pvVals
+
+    def newThread(self, target, args):
+        # Threads must share the CA context to use the channels.
+        return ep.CAThread(target = target, args = args)
+
+    def poll(self):
+        ep.poll()
+
+class PVRegistry(object):
+    """ Keep one channel object per PV for the life of the process, so
+        the name lookup and connection are only paid for once.
+    """
+    def __init__(self, backend, connTimeout = 5.0, putTimeout = 30.0):
+        self.lock = th.Lock()
+        self.connTimeout = connTimeout
+        self.putTimeout = putTimeout
+        self.reset(backend)
+
+    def reset(self, backend):
+        """ Drop all of the channels and start again with a new backend.
+        """
+        with self.lock:
+            self.backend = backend
+            self.pvs = {}
+            self.connTimes = {}
+            self.hits = 0
+            self.misses = 0
+
+    def createPV(self, pvName):
+        if self.backend is None:
+            raise ImportError('pyepics is needed to talk to the IOCs, or use pv_control.setBackend ...')
+        return self.backend.createPV(pvName, self.connTimeout, self.onConnChange)
+
+    def onConnChange(self, pvname = None, conn = None, **kws):
+        # The IOC may have been restarted, so the shadow value can't be trusted.
+        shadowCache.invalidate(pvname)
+
+    def lookup(self, pvNames):
+        """ Return the channel objects for the PVs, creating any that
+            are not yet in the registry.  Also return the ones that are new.
+        """
+        pvs = []
+        newPVs = []
+        with self.lock:
+            for pvName in pvNames:
+                pv = self.pvs.get(pvName)
+                if pv is None:
+                    self.misses += 1
+                    pv = self.createPV(pvName)
+                    self.pvs[pvName] = pv
+                    newPVs.append(pv)
+                else:
+                    self.hits += 1
+                pvs.append(pv)
+        return pvs, newPVs
+
+    def waitForConnection(self, newPVs):
+        # All of the searches are already out, so wait for them in turn.
+        startTime = time.time()
+        for pv in newPVs:
+            pv.wait_for_connection(timeout = self.connTimeout)
+            if pv.connected:
+                with self.lock:
+                    self.connTimes[pv.pvname] = time.time() - startTime
+            else:
+                print "Could not connect to PV %s ..." %(pv.pvname)
+
+    def getPV(self, pvName):
+        """ Return the connected channel object for a single PV.
+        """
+        pvs, newPVs = self.lookup([pvName])
+        self.waitForConnection(newPVs)
+        return pvs[0]
+
+    def connect(self, pvNames):
+        """ Connect a list of PVs in parallel and return their channel objects.
+        """
+        pvs, newPVs = self.lookup(pvNames)
+        self.waitForConnection(newPVs)
+        return pvs
+
+    def getStats(self):
+        """ Return the cache hit / miss counts and the connect latencies.
+        """
+        with self.lock:
+            connTimes = self.connTimes.values()
+            stats = {'numPVs': len(self.pvs),
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'meanConnTime': np.mean(connTimes) if connTimes else 0.0,
+                     'maxConnTime': np.max(connTimes) if connTimes else 0.0}
+        return stats
+
+    def printStats(self):
+        stats = self.getStats()
+        print "PV registry holds %i PVs, %i hits, %i misses ..." %(stats['numPVs'], stats['hits'], stats['misses'])
+        print "PV connect time is %f s mean, %f s max ..." %(stats['meanConnTime'], stats['maxConnTime'])
+
+# The registry that is shared by all of the PV access functions.
+# It talks to the real IOCs if pyepics is available.
+pvRegistry = PVRegistry(EpicsBackend() if ep is not None else None)
+
+def setBackend(backend):
+    """ Switch all PV access to another backend, i.e. a simulated IOC.
     """
-    ep.caput(pv2Set, pvVal)
+    pvRegistry.reset(backend)
+    # Nothing known about the old backend holds for the new one.
+    shadowCache.invalidate()
+
+def connectPVs(pvNames):
+    """ Pre-connect a list of PVs in parallel, i.e. at startup.
+    """
+    return pvRegistry.connect(pvNames)
+
+def newThread(target, args = ()):
+    """ Return a thread that can make CA calls using the shared context.
+    """
+    return pvRegistry.backend.newThread(target, args)
+
+def logPV(pv2Set, pvVal, pvLogFile, log, verbose, skipped = False):
     # Test if val is to be logged to file.
     if log:
-        writePV2File(pvLogFile, pv2Set, pvVal)
+        if skipped:
+            writeSkippedPV2File(pvLogFile, pv2Set, pvVal)
+        else:
+            writePV2File(pvLogFile, pv2Set, pvVal)
     # Test if val is to be printed to screen.
     if verbose:
-        print "pv = %s, value = %s" %(pv2Set, pvVal)
+        if skipped:
+            print "pv = %s, value = %s (unchanged, skipped)" %(pv2Set, pvVal)
+        else:
+            print "pv = %s, value = %s" %(pv2Set, pvVal)
+
+def caputPV(pv2Set, pvVal, pvLogFile, log, verbose, force = False):
+    """ Use the pyepics lib to write the PVs.
+        If write suppression is on, the write is skipped when the PV is
+        known to hold the value already, unless force is set.
+        Returns None, without logging the PV, if it could not be written.
+    """
+    if not force and shadowCache.isSame(pv2Set, pvVal):
+        shadowCache.addSkipped()
+        logPV(pv2Set, pvVal, pvLogFile, log, verbose, skipped = True)
+        return pvVal
+    pv = pvRegistry.getPV(pv2Set)
+    if not pv.connected:
+        print "Could not write %s to PV %s, it is not connected ..." %(pvVal, pv2Set)
+        return None
+    # The PV is only known to hold the value once the put has completed.
+    pv.put(pvVal, use_complete = True, callback = shadowCache.onPutComplete, callback_data = pvVal)
+    logPV(pv2Set, pvVal, pvLogFile, log, verbose)
     return pvVal
 
 def cagetPV(pv2Get, verbose = True):
     """ Use the pyepics lib to write the PVs.
     """
-    pvVal = ep.caget(pv2Get)
+    pvVal = pvRegistry.getPV(pv2Get).get(use_monitor = False)
+    shadowCache.update(pv2Get, pvVal)
     # Test if val is to be printed to screen.
     if verbose:
         print "pv = %s, value = %s" %(pv2Get, pvVal)
     return pvVal
 
+def caputMany(pvValPairs, pvLogFile, log, verbose, force = False):
+    """ Use the pyepics lib to write a list of (pv, value) pairs.
+        The puts are all issued before waiting, so there is only one
+        round trip to wait for rather than one per PV.
+        Only the puts that completed are logged, the value is returned as
+        None for any PV that could not be written.
+    """
+    # Find the PVs that don't already hold the value.
+    toWrite = [force or not shadowCache.isSame(pv2Set, pvVal) for pv2Set, pvVal in pvValPairs]
+    pvs = connectPVs([pv2Set for (pv2Set, pvVal), write in zip(pvValPairs, toWrite) if write])
+    vals2Write = [pvVal for (pv2Set, pvVal), write in zip(pvValPairs, toWrite) if write]
+    # Issue all of the puts.
+    for pv, pvVal in zip(pvs, vals2Write):
+        if pv.connected:
+            pv.put(pvVal, use_complete = True)
+    # Now wait once for them all to complete.
+    startTime = time.time()
+    while not all([pv.put_complete for pv in pvs if pv.connected]):
+        if time.time() - startTime > pvRegistry.putTimeout:
+            print "Timed out waiting for %i puts to complete ..." %(len([pv for pv in pvs if pv.connected and not pv.put_complete]))
+            break
+        pvRegistry.backend.poll()
+    done = iter([pv.connected and pv.put_complete for pv in pvs])
+    pvVals = []
+    for (pv2Set, pvVal), write in zip(pvValPairs, toWrite):
+        if not write:
+            shadowCache.addSkipped()
+        elif next(done):
+            shadowCache.update(pv2Set, pvVal)
+        else:
+            print "Could not write %s to PV %s ..." %(pvVal, pv2Set)
+            pvVals.append(None)
+            continue
+        logPV(pv2Set, pvVal, pvLogFile, log, verbose, skipped = not write)
+        pvVals.append(pvVal)
+    return pvVals
+
+def cagetMany(pvs2Get, verbose = True, out = None, count = None):
+    """ Use the pyepics lib to read a list of PVs.
+        The gets are all issued before waiting, so there is only one
+        round trip to wait for rather than one per PV.
+        If count is given, only the first count elements of each waveform are read.
+        If out is supplied, the value of each PV (i.e. a waveform) is written
+        into the matching row of out, which is returned instead of a list.
+    """
+    pvs = connectPVs(pvs2Get)
+    pvVals = pvRegistry.backend.getMany(pvs, count)
+    for pv2Get, pvVal in zip(pvs2Get, pvVals):
+        shadowCache.update(pv2Get, pvVal)
+    # Test if vals are to be printed to screen.
+    if verbose:
+        for pv2Get, pvVal in zip(pvs2Get, pvVals):
+            print "pv = %s, value = %s" %(pv2Get, pvVal)
+    if out is None:
+        return pvVals
+    # Copy each value into its row, anything not read stays at zero.
+    out[...] = 0
+    for row, pvVal in enumerate(pvVals):
+        if pvVal is not None:
+            numVals = min(np.size(pvVal), out.shape[1])
+            out[row, :numVals] = np.ravel(pvVal)[:numVals]
+    return out
+
+def waitForValue(pv2Get, targetVal, timeout):
+    """ Wait for a PV to reach a value using a channel monitor, so we wake
+        up as soon as it changes.  Return True if the value was reached and
+        False if the wait timed out.
+    """
+    pv = pvRegistry.getPV(pv2Get)
+    reached = th.Event()
+
+    def onChange(value = None, **kws):
+        # Called from the CA thread on every monitor update.
+        if value is not None and value == targetVal:
+            reached.set()
+
+    cbIndex = pv.add_callback(onChange)
+    try:
+        # The value may already be there, so read it after subscribing.
+        pvVal = pv.get(use_monitor = False)
+        if pvVal is not None and pvVal == targetVal:
+            return True
+        return reached.wait(timeout)
+    finally:
+        pv.remove_callback(cbIndex)
+
 if __name__ == '__main__':
     """ Running the code below will test the
         setting and getting of PVs.
@@ -84,3 +418,12 @@ if __name__ == '__main__':
     # Test getting PV function.
     pv2Get = '%s%s%s' %(detIOC, ':', 'ReadAll.SCAN')
     cagetPV(pv2Get, verbose)
+
+    # Test setting and getting several PVs at once.
+    pvs2Set = ['%s%s%s' %(detIOC, ':', 'ReadAll.SCAN'),
+               '%s%s%s' %(detIOC, ':', 'StatusAll.SCAN')]
+    caputMany([(pvs2Set[0], str('Passive')), (pvs2Set[1], float(0.1))], pvLogFile, logPVs, verbose)
+    cagetMany(pvs2Set, verbose)
+
+    # Print the connection statistics.
+    pvRegistry.printStats()
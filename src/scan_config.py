@@ -18,8 +18,9 @@
 import sys
 import numpy as np
 import itertools as it
-from copy import deepcopy
+import operator
 import acquis_params as acp
+import pv_control as p_c
 
 def getPV2ScanList(pvName, vals2Scan):
     """ Return a list of N lists, each with the PV and its value.
@@ -32,7 +33,8 @@ def getPV2ScanList(pvName, vals2Scan):
 
 def add2List(pv2Set, pvVals, scanVarList):
     # Make a copy of the list before appending to it.
-    nScanVarList = deepcopy(scanVarList)
+    # The lists in it are never changed, so only the outer list is copied.
+    nScanVarList = list(scanVarList)
     # Get a scannable object.
     pv2ScanList = getPV2ScanList(pv2Set, pvVals)
     # Add the scannable object to the list.
@@ -45,11 +47,221 @@ def unfoldList(listOfLists):
     flatList = list(it.chain(*listOfLists))
     return flatList
 
-def product(listOfLists):
-    """ Generate all permutations of the list.
+# Weights for PVs that are slow to change, i.e. a baseline filter length change
+# makes the DSP re-acquire the baseline, so snake ordered sweeps change them least.
+expensivePVWeights = {'BASE_LEN' : 10.0, 'BaselineFilterLength' : 10.0}
+
+def getPVWeight(pvName, pvWeights):
+    """ Get the weight of a PV from the dict of PV name endings and weights, 1.0 if it is not there.
+    """
+    for pvEnd, weight in pvWeights.items():
+        if pvName.endswith(pvEnd):
+            return weight
+    return 1.0
+
+def getSnakeDigits(index, sizes):
+    """ Get the position in each list of the index-th point of a snake (boustrophedon)
+        ordered product, with the first list varying slowest.  Each list reverses
+        direction every time a slower one changes, so consecutive points differ in
+        one list only, by one step.
+    """
+    digits = []
+    stride = getNumPoints(sizes)
+    for size in sizes:
+        stride //= size
+        digit = (index // stride) % size
+        # Reverse on every step of the slower lists.
+        if (index // (stride * size)) % 2 == 1:
+            digit = size - 1 - digit
+        digits.append(digit)
+    return digits
+
+def getSweepOrder(listOfLists, pvWeights):
+    """ Get the order of the lists from slowest to fastest varying that makes the
+        fewest weighted PV changes over a snake ordered sweep.
+        A list of N values changes (N - 1) times for each pass of the slower lists,
+        so the lists are sorted by weight / (N - 1), largest first.
+    """
+    def getPriority(listIdx):
+        numVals = len(listOfLists[listIdx])
+        if numVals < 2:
+            return float('inf')
+        return getPVWeight(listOfLists[listIdx][0][0], pvWeights) / float(numVals - 1)
+    return sorted(range(len(listOfLists)), key = getPriority, reverse = True)
+
+def getNumPoints(sizes):
+    """ Get the number of points in the product of lists of these sizes, as a python int so it can't overflow.
+    """
+    return reduce(operator.mul, [int(size) for size in sizes], 1)
+
+def getNumInRange(start, stop, step):
+    """ Get the number of points in range(start, stop, step) without making
+        it, as xrange overflows above a C long, i.e. 2**31 - 1 on 32 bit Windows.
+    """
+    if step > 0:
+        return max(0, (stop - start + step - 1) // step)
+    return max(0, (start - stop - step - 1) // -step)
+
+def getSliceIndices(key, numPoints):
+    """ Get the start, stop and step of a slice of numPoints points as
+        slice.indices does, which also overflows above a C long.
+    """
+    step = 1
+    if key.step is not None:
+        step = key.step
+    if step == 0:
+        raise ValueError('Scan plan slice step cannot be zero ...')
+    # The first and one past the last point that can be reached in the direction of the step.
+    lower, upper = 0, numPoints
+    if step < 0:
+        lower, upper = -1, numPoints - 1
+
+    def clip(val, default):
+        if val is None:
+            return default
+        if val < 0:
+            return max(val + numPoints, lower)
+        return min(val, upper)
+
+    if step > 0:
+        return clip(key.start, lower), clip(key.stop, upper), step
+    return clip(key.start, upper), clip(key.stop, lower), step
+
+def getLexicalDigits(index, sizes):
+    """ Get the position in each list of the index-th point of the product in
+        the order of itertools.product, with the first list varying slowest.
+    """
+    digits = []
+    for size in reversed(sizes):
+        digits.append(index % size)
+        index //= size
+    digits.reverse()
+    return digits
+
+class ScanPlan(object):
+    """ The points of a sweep over the product of lists of [pv, val] pairs.
+        The points are made when they are asked for, so the plan takes the same
+        memory however many points there are.  It supports len(), iteration,
+        indexing and slicing, where a slice is another plan over the same lists.
+    """
+    def __init__(self, listOfLists, snake = False, pvWeights = None, first = 0, step = 1, numPoints = None):
+        self.listOfLists = listOfLists
+        self.snake = snake
+        if pvWeights is None:
+            pvWeights = expensivePVWeights
+        self.pvWeights = pvWeights
+        if snake:
+            self.sweepOrder = getSweepOrder(listOfLists, pvWeights)
+        else:
+            self.sweepOrder = range(len(listOfLists))
+        self.sizes = [len(listOfLists[listIdx]) for listIdx in self.sweepOrder]
+        self.first = first
+        self.step = step
+        if numPoints is None:
+            numPoints = getNumPoints(self.sizes)
+        self.numPoints = numPoints
+
+    def __len__(self):
+        return self.numPoints
+
+    def getPoint(self, index):
+        """ Get the index-th point of the whole product, ignoring any slicing.
+        """
+        if self.snake:
+            digits = getSnakeDigits(index, self.sizes)
+        else:
+            digits = getLexicalDigits(index, self.sizes)
+        point = [None] * len(self.listOfLists)
+        for listIdx, digit in zip(self.sweepOrder, digits):
+            point[listIdx] = self.listOfLists[listIdx][digit]
+        return tuple(point)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = getSliceIndices(key, self.numPoints)
+            return ScanPlan(self.listOfLists,
+                            self.snake,
+                            self.pvWeights,
+                            self.first + start * self.step,
+                            self.step * step,
+                            getNumInRange(start, stop, step))
+        if key < 0:
+            key += self.numPoints
+        if key < 0 or key >= self.numPoints:
+            raise IndexError('Scan plan index %i out of range ...' %(key))
+        return self.getPoint(self.first + key * self.step)
+
+    def __iter__(self):
+        # A plain counter, as xrange overflows for large plans.
+        for key in it.count():
+            if key >= self.numPoints:
+                break
+            yield self.getPoint(self.first + key * self.step)
+
+def product(listOfLists, snake = False, pvWeights = None):
+    """ Generate all permutations of the list, as a ScanPlan that makes each
+        point when it is needed.
+        If snake, the points are ordered so that consecutive points differ in one PV
+        only, with the PVs that are expensive in pvWeights changing least often.
+        Each point keeps the PVs in the order of listOfLists.
+    """
+    return ScanPlan(listOfLists, snake, pvWeights)
+
+# PVs that the XMAP needs written in this order, see acquis_params.setPixPerBuffer.
+xmapWriteOrder = ['PixelsPerRun', 'PixelsPerBuffer', 'AutoPixelsPerBuffer']
+
+def getChangedPVs(point, prevPoint):
+    """ Split the [pv, val] pairs of a point into those that differ from the
+        previous point and those that don't.  All are changed if there is no previous point.
+    """
+    if prevPoint is None:
+        return list(point), []
+    prevVals = dict([(pv2Set, val2Write) for pv2Set, val2Write in prevPoint])
+    changed = [pair for pair in point if pair[0] not in prevVals or prevVals[pair[0]] != pair[1]]
+    unchanged = [pair for pair in point if pair[0] in prevVals and prevVals[pair[0]] == pair[1]]
+    return changed, unchanged
+
+def sortByWriteOrder(pvValPairs, writeOrder):
+    """ Sort [pv, val] pairs so the PVs whose field names are in writeOrder
+        come first, in that order, and the rest keep their order after them.
+        The whole field name must match, so AutoPixelsPerBuffer is not taken
+        for PixelsPerBuffer.
+    """
+    def getRank(pairIdx):
+        # Get the field name after the last ':' or '.'.
+        field = pvValPairs[pairIdx][0].split(':')[-1].split('.')[-1]
+        if field in writeOrder:
+            return (writeOrder.index(field), pairIdx)
+        return (len(writeOrder), pairIdx)
+    return [pvValPairs[pairIdx] for pairIdx in sorted(range(len(pvValPairs)), key = getRank)]
+
+def writeChangedPVs(point, prevPoint, pvLogFile, logPVs, verbose, writeOrder = xmapWriteOrder):
+    """ Write the PVs of a point that differ from the previous point, in
+        writeOrder, and log the others as skipped so every point still has all
+        of its PVs in the log.  Returns the numbers written and skipped.
+    """
+    changed, unchanged = getChangedPVs(point, prevPoint)
+    # Loop over the variables (PVs) that have changed.
+    for pv2Set, val2Write in sortByWriteOrder(changed, writeOrder):
+        # Set the PV to the val.
+        p_c.caputPV(pv2Set, val2Write, pvLogFile, logPVs, verbose)
+        print 'Changed %s ...' %(pv2Set)
+    for pv2Set, val2Write in unchanged:
+        p_c.logPV(pv2Set, val2Write, pvLogFile, logPVs, verbose, skipped = True)
+    return len(changed), len(unchanged)
+
+def getNumChanges(prodList):
+    """ Count the PV writes that differ from the previous point over a sweep, the first point counting in full.
     """
-    prodList = list(it.product(*listOfLists))
-    return prodList
+    numChanges = 0
+    prevPoint = None
+    for point in prodList:
+        if prevPoint is None:
+            numChanges += len(point)
+        else:
+            numChanges += len([pv for pv, prevPv in zip(point, prevPoint) if pv[1] != prevPv[1]])
+        prevPoint = point
+    return numChanges
 
 if __name__ == '__main__':
 
@@ -0,0 +1,386 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import time
+import threading as th
+import numpy as np
+import pv_control as p_c
+
+""" An in-process simulation of the XMAP detector IOCs and the scan record,
+    so that the code can be run and benchmarked without the beamline.
+    Install it with p_c.setBackend(SimIOC()).
+"""
+
+# The values the PVs hold before anything is written, by field name.
+defaultVals = {'EXSC': 0,
+               'Acquiring': 0,
+               'AutoApply': 1,
+               'saveData_status': 1,
+               'IOC_CONFIG_CMD': 3,
+               'PresetReal': 0.0,
+               'PresetLive': 0.0,
+               'PreampGain': 1.0,
+               'PreampGain_RBV': 1.0,
+               'PGAIN': 1.0,
+               'PGAIN_RBV': 1.0,
+               'PeakingTime': 1.0,
+               'PKTIM': 1.0,
+               'Capture': 0,
+               'Capture_RBV': 0,
+               'NumCapture': 1,
+               'NumCaptured_RBV': 0}
+
+def getField(pvName):
+    # Get the field name after the last ':' or '.'.
+    return pvName.split(':')[-1].split('.')[-1]
+
+class SimPV(object):
+    """ A simulated channel that behaves like epics.PV.
+    """
+    def __init__(self, ioc, pvName, connCallback):
+        self.ioc = ioc
+        self.pvname = pvName
+        self.connected = False
+        self.put_complete = True
+        self.putCallback = (None, None)
+        self.connCallback = connCallback
+        self.callbacks = {}
+        self.cbCount = 0
+        self.lock = th.Lock()
+        # The connection completes some time after the channel is created.
+        self.connTime = time.time() + ioc.connLatency
+
+    def wait_for_connection(self, timeout = None):
+        if self.pvname in self.ioc.deadPVs:
+            # The IOC never answers the search.
+            return False
+        if not self.connected:
+            self.ioc.delay(self.connTime - time.time())
+            self.connected = True
+            if self.connCallback is not None:
+                self.connCallback(pvname = self.pvname, conn = True)
+        return self.connected
+
+    def get(self, use_monitor = True, **kws):
+        # A monitored value is already here, otherwise there is a round trip.
+        if not use_monitor:
+            self.ioc.delay(self.ioc.getLatency)
+        return self.ioc.read(self.pvname)
+
+    def put(self, value, use_complete = False, callback = None, callback_data = None, **kws):
+        self.put_complete = False
+        self.putCallback = (callback, callback_data)
+        self.ioc.write(self, value)
+
+    def add_callback(self, callback, **kws):
+        with self.lock:
+            self.cbCount += 1
+            self.callbacks[self.cbCount] = callback
+            return self.cbCount
+
+    def remove_callback(self, index):
+        with self.lock:
+            self.callbacks.pop(index, None)
+
+    def post(self, value):
+        """ Send a monitor update to all of the callbacks.
+        """
+        with self.lock:
+            callbacks = self.callbacks.values()
+        for callback in callbacks:
+            callback(pvname = self.pvname, value = value)
+
+class SimIOC(object):
+    """ The simulated IOCs, used as a pv_control backend.
+        Latencies are in seconds.  The count time of each acquisition is
+        multiplied by timeScale so benchmarks don't take real beam time.
+        The PVs in deadPVs never connect and puts to those in stuckPVs never
+        complete, to test the handling of failed writes.
+    """
+    def __init__(self,
+                 timeScale = 1.0,
+                 connLatency = 0.02,
+                 getLatency = 0.002,
+                 putLatency = 0.002,
+                 applyLatency = 0.05,
+                 nBins = 2048,
+                 pkEnergies_keV = [4.02],
+                 pkRate = 20000.0,
+                 bgRate = 20.0,
+                 gainSpread = 0.03,
+                 seed = 0,
+                 deadPVs = [],
+                 stuckPVs = []):
+        self.lock = th.RLock()
+        self.timeScale = timeScale
+        self.connLatency = connLatency
+        self.getLatency = getLatency
+        self.putLatency = putLatency
+        self.applyLatency = applyLatency
+        self.nBins = nBins
+        self.pkEnergies_keV = pkEnergies_keV
+        self.pkRate = pkRate
+        self.bgRate = bgRate
+        self.gainSpread = gainSpread
+        self.seed = seed
+        self.deadPVs = set(deadPVs)
+        self.stuckPVs = set(stuckPVs)
+        self.vals = {}
+        self.pvs = {}
+        self.spectra = {}
+        self.acqCount = 0
+        self.realTime = 0.0
+
+    ###########################
+    # The backend interface. #
+    ###########################
+
+    def createPV(self, pvName, connTimeout, connCallback):
+        with self.lock:
+            pv = SimPV(self, pvName, connCallback)
+            self.pvs.setdefault(pvName, []).append(pv)
+        return pv
+
+    def getMany(self, pvs, count = None):
+        # All of the gets share one round trip.
+        self.delay(self.getLatency)
+        pvVals = [self.read(pv.pvname) if pv.connected else None for pv in pvs]
+        if count is not None:
+            pvVals = [pvVal[:count] if isinstance(pvVal, np.ndarray) else pvVal for pvVal in pvVals]
+        return pvVals
+
+    def newThread(self, target, args):
+        return th.Thread(target = target, args = args)
+
+    def poll(self):
+        time.sleep(0.001)
+
+    ##############################
+    # The simulated PV database. #
+    ##############################
+
+    def delay(self, delayTime):
+        if delayTime > 0:
+            time.sleep(delayTime)
+
+    def read(self, pvName):
+        # The spectra are made when they are first read after an acquisition.
+        match = re.match(r'^(.*):mca(\d+)$', pvName)
+        if match:
+            return self.getSpectrum(match.group(1), int(match.group(2)))
+        match = re.match(r'^(.*):mca(\d+)\.(ERTM|ELTM)$', pvName)
+        if match:
+            return self.realTime
+        with self.lock:
+            return self.vals.get(pvName, defaultVals.get(getField(pvName), 0))
+
+    def setVal(self, pvName, pvVal):
+        # Set the value and send it to any monitors.
+        with self.lock:
+            self.vals[pvName] = pvVal
+            pvs = list(self.pvs.get(pvName, []))
+        for pv in pvs:
+            pv.post(pvVal)
+
+    def write(self, pv, pvVal):
+        # The value is held straight away and the record processes afterwards.
+        self.setVal(pv.pvname, pvVal)
+        timer = th.Timer(self.putLatency, self.process, [pv, pvVal])
+        timer.daemon = True
+        timer.start()
+
+    def process(self, pv, pvVal):
+        """ Do what the record would do when it is written to.
+        """
+        pvName = pv.pvname
+        if pvName in self.stuckPVs:
+            return
+        prefix = pvName.split(':')[0]
+        field = getField(pvName)
+
+        if field == 'EXSC' and pvVal == 1:
+            # Start the scan record, it resets when the acquisition is done.
+            self.startTimer(self.getAcqTime(), self.endAcquisition, [pvName])
+        elif field == 'EraseStart' and pvVal == 1:
+            self.setVal('%s:Acquiring' %(prefix), 1)
+            self.setVal(pvName, 0)
+            self.startTimer(self.getAcqTime(), self.endAcquisition, ['%s:Acquiring' %(prefix)])
+        elif field == 'StopAll':
+            self.setVal('%s:Acquiring' %(prefix), 0)
+            self.stopCapture(prefix)
+        elif field == 'Capture':
+            if pvVal == 1:
+                self.setVal('%s:netCDF1:Capture_RBV' %(prefix), 1)
+            else:
+                self.stopCapture(prefix)
+        elif field == 'Apply':
+            self.delay(self.applyLatency)
+        elif field in ('PreampGain', 'PGAIN'):
+            self.setVal('%s_RBV' %(pvName), pvVal)
+
+        # In 3_1 each DXP parameter write is applied unless AutoApply is off.
+        if re.match(r'^.*:dxp\d+:\w+$', pvName) and self.read('%s:AutoApply' %(prefix)) == 1:
+            self.delay(self.applyLatency)
+
+        pv.put_complete = True
+        callback, callbackData = pv.putCallback
+        if callback is not None:
+            callback(pvname = pvName, data = callbackData)
+
+    def startTimer(self, waitTime, func, args):
+        timer = th.Timer(waitTime, func, args)
+        timer.daemon = True
+        timer.start()
+
+    def stopCapture(self, prefix):
+        with self.lock:
+            numCapture = self.vals.get('%s:netCDF1:NumCapture' %(prefix), defaultVals['NumCapture'])
+        self.setVal('%s:netCDF1:NumCaptured_RBV' %(prefix), numCapture)
+        self.setVal('%s:netCDF1:Capture' %(prefix), 0)
+        self.setVal('%s:netCDF1:Capture_RBV' %(prefix), 0)
+
+    def getAcqTime(self):
+        """ Get the acquisition time from the preset real times, or the
+            scaler time if these are 0.
+        """
+        with self.lock:
+            presets = [val for name, val in self.vals.items() if getField(name) == 'PresetReal']
+            scalerTime = self.vals.get('SR12ID01HU02IOC01:scaler1.TP', 1.0)
+        realTime = max(presets) if presets else 0.0
+        if realTime <= 0.0:
+            realTime = scalerTime
+        with self.lock:
+            self.realTime = float(realTime)
+        return float(realTime) * self.timeScale
+
+    def endAcquisition(self, pvName):
+        # Throw away the old spectra so the next read makes new ones.
+        with self.lock:
+            self.acqCount += 1
+            self.spectra = {}
+        self.setVal(pvName, 0)
+
+    ##########################
+    # The simulated spectra. #
+    ##########################
+
+    def getDetChan(self, prefix, mcaNum):
+        """ Get the detector IOC and DXP channel that feeds an MCA.
+            The 100 element MCAs are remapped to SR12ID01DET01 across both IOCs.
+        """
+        if prefix == 'SR12ID01DET01':
+            index = mcaNum - 1
+            if index > 51:
+                return 'SR12ID01IOC54', index - 51
+            return 'SR12ID01IOC53', index + 1
+        return prefix, mcaNum
+
+    def getGains(self, detIOC, chan):
+        # The true gain is fixed for each channel and the set gain is the PV.
+        rng = np.random.RandomState(abs(hash((self.seed, detIOC, chan))) % (2 ** 32))
+        trueGain = 1.0 + self.gainSpread * rng.randn()
+        with self.lock:
+            setGain = self.vals.get('%s:dxp%d:PreampGain' %(detIOC, chan),
+                                    self.vals.get('%s:dxp%d.PGAIN' %(detIOC, chan), 1.0))
+        return trueGain, float(setGain)
+
+    def getPkTime(self, detIOC, chan):
+        with self.lock:
+            pkTime = self.vals.get('%s:dxp%d:PeakingTime' %(detIOC, chan),
+                                   self.vals.get('%s:dxp%d.PKTIM' %(detIOC, chan), 1.0))
+        return max(float(pkTime), 0.01)
+
+    def getSpectrum(self, prefix, mcaNum):
+        key = (prefix, mcaNum)
+        with self.lock:
+            if key in self.spectra:
+                return self.spectra[key]
+            acqCount = self.acqCount
+            realTime = self.realTime
+
+        detIOC, chan = self.getDetChan(prefix, mcaNum)
+        trueGain, setGain = self.getGains(detIOC, chan)
+        pkTime = self.getPkTime(detIOC, chan)
+        rng = np.random.RandomState(abs(hash((self.seed, acqCount, prefix, mcaNum))) % (2 ** 32))
+
+        x = np.arange(self.nBins, dtype = float)
+        # A flat background with a low energy tail.
+        model = self.bgRate * realTime * (1.0 + 5.0 * np.exp(-x / 200.0))
+        for pkEnergy_keV in self.pkEnergies_keV:
+            # 10 eV per bin when the gain is matched.
+            cent = pkEnergy_keV * 100.0 * trueGain / setGain
+            # Electronic noise falls with the peaking time, plus the Fano term.
+            fwhm = np.sqrt(150.0 / pkTime + 1.5 * pkEnergy_keV * 100.0)
+            sig = fwhm / 2.3548
+            area = self.pkRate * realTime
+            model += area / (sig * np.sqrt(2.0 * np.pi)) * np.exp(-(x - cent) ** 2 / (2.0 * sig ** 2))
+        spec = rng.poisson(model)
+
+        with self.lock:
+            if acqCount == self.acqCount:
+                self.spectra[key] = spec
+        return spec
+
+if __name__ == '__main__':
+
+    """ Running the code below benchmarks the set up and acquisition
+        of the 100 element detector against the simulated IOCs.
+    """
+    import tempfile
+    import acquis_params as a_p
+
+    # Run the acquisitions 100 times faster than real time.
+    p_c.setBackend(SimIOC(timeScale = 0.01))
+
+    params = a_p.Params()
+    params.logPVs = True
+    params.saveData = False
+    params.verbose = False
+    params.detector = 'ele100'
+    params.dxpVer = '3_1'
+    params.detIOCList, params.scanIOC, params.mcaIOC, params.numChans = a_p.getIOCs(params.detector, params.verbose)
+    params.outBase = tempfile.mkdtemp()
+    params.countTime = float(10.0)
+    params.trigOnScaler = False
+    params.scanType = 'wait-for-mcas'
+    params.initDXPs = True
+    params.doInit = True
+
+    startTime = time.time()
+    params, pvLogFile = a_p.initialize(params)
+    print 'initialize took %f s ...' %(time.time() - startTime)
+
+    numAcquis = 5
+    startTime = time.time()
+    for count in np.arange(numAcquis):
+        a_p.acquire(params.scanType,
+                    params.scanIOC,
+                    params.countTime,
+                    params.detIOCList,
+                    params.detector,
+                    pvLogFile,
+                    params.logPVs,
+                    params.verbose,
+                    count,
+                    params.outBase,
+                    params.timeStamp)
+    print 'acquire took %f s per point ...' %((time.time() - startTime) / numAcquis)
+
+    a_p.finalize(params.logPVs, pvLogFile)
+    p_c.pvRegistry.printStats()
+    print "Done ..."
@@ -0,0 +1,136 @@
+"""
+    Copyright (C) 2013 Matthew Dimmock, Australian Synchrotron.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import numpy as np
+import checkpoint as ckp
+
+class SpecStore(object):
+    """ All of the spectra of a run in one append-only raw file, with an index
+        file that has one JSON line per spectrum giving the acquisition number,
+        time and PVs of the point.  Every record has the same dtype and shape,
+        i.e. (nBins,) for one channel or (numChans, nBins) for all of them, so the
+        whole file can be read back as one memory mapped array without copying.
+    """
+    def __init__(self, storeDir, storeName = 'spectra', mode = 'r'):
+        """ Open the store with mode 'r' to read it, which leaves the files
+            alone so a run can be read while it is written, or from a read
+            only share, or with mode 'a' to append to it, which first repairs
+            any damage from a crash.
+        """
+        assert (mode == 'r') ^ (mode == 'a')
+        self.mode = mode
+        self.binPath = os.path.join(storeDir, '%s.bin' %(storeName))
+        self.indexPath = os.path.join(storeDir, '%s_index.txt' %(storeName))
+        self.metaPath = os.path.join(storeDir, '%s.json' %(storeName))
+        self.dtype = None
+        self.recShape = None
+        self.index = []
+        if os.path.exists(self.metaPath):
+            with open(self.metaPath, 'r') as metaFile:
+                meta = json.load(metaFile)
+            self.dtype = np.dtype(str(meta['dtype']))
+            self.recShape = tuple(meta['shape'])
+        if os.path.exists(self.indexPath):
+            with open(self.indexPath, 'r') as indexFile:
+                for line in indexFile:
+                    try:
+                        self.index.append(json.loads(line))
+                    except ValueError:
+                        # The last line may have been cut short by a crash, or still be being written.
+                        print 'Ignoring incomplete index line %s ...' %(line.strip())
+        if self.recShape is not None:
+            # Only the spectra that have both their data and their index line are used.
+            binSize = os.path.getsize(self.binPath) if os.path.exists(self.binPath) else 0
+            self.index = self.index[:binSize // self.getRecBytes()]
+        if mode == 'a':
+            self.repair()
+
+    def repair(self):
+        """ Make the files match the spectra that were read, rewriting the
+            index without any incomplete line and dropping any spectrum that
+            was written without its index line.
+        """
+        self.rewriteIndex()
+        if os.path.exists(self.binPath) and self.recShape is not None:
+            binFile = open(self.binPath, 'r+b')
+            binFile.truncate(len(self.index) * self.getRecBytes())
+            binFile.close()
+
+    def getRecBytes(self):
+        return int(np.prod(self.recShape)) * self.dtype.itemsize
+
+    def rewriteIndex(self):
+        with open(self.indexPath, 'w') as indexFile:
+            for entry in self.index:
+                indexFile.write(json.dumps(entry) + '\n')
+
+    def append(self, acquisIdx, spec, pvValPairs = None):
+        """ Add a spectrum to the end of the store, then its index line.
+        """
+        self.appendMany([(acquisIdx, spec, pvValPairs)])
+
+    def appendMany(self, records):
+        """ Add a list of (acquisIdx, spec, pvValPairs) records to the end of
+            the store with one write to each file, all of the spectra then
+            their index lines.
+        """
+        assert self.mode == 'a', 'The store %s is open for reading ...' %(self.binPath)
+        if len(records) == 0:
+            return
+        specs = [np.asarray(spec) for acquisIdx, spec, pvValPairs in records]
+        if self.recShape is None:
+            # The first spectrum sets the dtype and shape of the store.
+            self.dtype = specs[0].dtype
+            self.recShape = specs[0].shape
+            with open(self.metaPath, 'w') as metaFile:
+                json.dump({'dtype' : self.dtype.str, 'shape' : list(self.recShape)}, metaFile)
+        for spec in specs:
+            assert spec.shape == self.recShape, 'Spectrum shape %s does not match the store shape %s ...' %(spec.shape, self.recShape)
+        with open(self.binPath, 'ab') as binFile:
+            binFile.write(''.join([np.ascontiguousarray(spec, dtype = self.dtype).tobytes() for spec in specs]))
+        entries = [{'acquisIdx' : int(acquisIdx),
+                    'time' : time.time(),
+                    'pvs' : [[pv2Set, ckp.getPlainVal(val2Write)] for pv2Set, val2Write in (pvValPairs or [])]}
+                   for acquisIdx, spec, pvValPairs in records]
+        with open(self.indexPath, 'a') as indexFile:
+            indexFile.write(''.join([json.dumps(entry) + '\n' for entry in entries]))
+        self.index.extend(entries)
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self):
+        """ Get all of the spectra as one (nAcq,) + record shape array that is
+            memory mapped from the file, and the index entry of each.
+        """
+        if len(self.index) == 0:
+            return np.zeros((0,)), []
+        spectra = np.memmap(self.binPath, dtype = self.dtype, mode = 'r', shape = (len(self.index),) + self.recShape)
+        return spectra, self.index
+
+    def getLatestRows(self):
+        """ Get the row of the latest spectrum for each acquisition number, in
+            order of acquisition number.  A point that was repeated on resuming
+            a sweep is in the store twice.
+        """
+        rows = {}
+        for row, entry in enumerate(self.index):
+            rows[entry['acquisIdx']] = row
+        return [(acquisIdx, rows[acquisIdx]) for acquisIdx in sorted(rows.keys())]
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+# The modules are run from src, so put it on the path for the tests.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pv_control as p_c
+import acquis_params as a_p
+import sim_ioc
+
+@pytest.fixture
+def simIOC():
+    """ A fast simulated IOC as the PV backend, for running sweeps.
+    """
+    ioc = sim_ioc.SimIOC(timeScale = 0.001, connLatency = 0.0, getLatency = 0.0, putLatency = 0.001, applyLatency = 0.0)
+    p_c.setBackend(ioc)
+    yield ioc
+    p_c.setBackend(None)
+
+@pytest.fixture
+def getParams():
+    """ Get a function that makes the params of a 36 element wait-for-mcas
+        sweep writing to outBase, resuming resumeTimeStamp if it is given.
+    """
+    def makeParams(outBase, resumeTimeStamp = None):
+        params = a_p.Params()
+        params.doInit = True
+        params.logPVs = True
+        params.saveData = False
+        params.verbose = False
+        params.detector = 'ele36'
+        params.dxpVer = '3_1'
+        params.detIOCList, params.scanIOC, params.mcaIOC, params.numChans = a_p.getIOCs(params.detector, params.verbose)
+        params.outBase = outBase
+        params.countTime = float(1.0)
+        params.trigOnScaler = False
+        params.scanType = 'wait-for-mcas'
+        params.initDXPs = False
+        params.resumeTimeStamp = resumeTimeStamp
+        return params
+    return makeParams
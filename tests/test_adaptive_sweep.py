@@ -0,0 +1,54 @@
+import acquis_params as a_p
+import scan_config as s_c
+import adaptive_sweep as a_s
+import param_sweep as p_s
+
+def test_adaptive_sweep_only_writes_changed_PVs(simIOC, getParams, tmpdir, monkeypatch):
+    params, pvLogFile = a_p.initialize(getParams(str(tmpdir)))
+    detIOC = params.detIOCList[0]
+    # The FWHM is smallest at a peaking time of 4 and gap time of 0.2, as set on the IOC.
+    def fit(spec, *args):
+        fwhm = abs(simIOC.read('%s:dxp1:PeakingTime' %(detIOC)) - 4) + abs(simIOC.read('%s:dxp1:GapTime' %(detIOC)) - 0.2)
+        return [400], [[(range(390, 410), None)]], [fwhm]
+    monkeypatch.setattr(a_s.pkf, 'fit', fit)
+    scanVarList = []
+    scanVarList = s_c.add2List('%s:dxp1:PeakingTime' %(detIOC), [1, 2, 4, 8], scanVarList)
+    scanVarList = s_c.add2List('%s:dxp1:GapTime' %(detIOC), [0.1, 0.2, 0.3], scanVarList)
+    sweepPoints = []
+    measure = a_s.AdaptiveSweep.measureDigits
+    def recordDigits(sweep, digits):
+        if tuple(digits) not in sweep.results and not sweep.isFull():
+            sweepPoints.append(sweep.getPoint(digits))
+        return measure(sweep, digits)
+    monkeypatch.setattr(a_s.AdaptiveSweep, 'measureDigits', recordDigits)
+    bestPoint, bestFWHM_keV = a_s.doAdaptiveScan(params, pvLogFile, scanVarList, 4.02, str(tmpdir.join('FitData.txt')),
+                                                 range(250, 300), 1, 360, 420, 5, numCoarse = 2)
+    a_p.finalize(params.logPVs, pvLogFile)
+    assert [val2Write for pv2Set, val2Write in bestPoint] == [4, 0.2]
+
+    # Every point logs both PVs, but only the ones that changed are written.
+    lines = [line.split(',') for line in open(params.pvLogStr) if ':dxp1:' in line]
+    written = [parts for parts in lines if len(parts) == 2]
+    skipped = [parts for parts in lines if len(parts) == 3 and parts[2].strip() == 'skipped']
+    assert len(written) + len(skipped) == len(lines)
+    numPoints = len(open(str(tmpdir.join('FitData.txt'))).read().split('#')[1:])
+    assert len(lines) == 2 * numPoints
+    assert len(written) < len(lines)
+    assert len(written) == 2 + sum([len(s_c.getChangedPVs(a, b)[0]) for a, b in zip(sweepPoints[1:], sweepPoints[:-1])])
+
+def test_adaptive_sweep_with_real_fit(simIOC, getParams, tmpdir):
+    params, pvLogFile = a_p.initialize(getParams(str(tmpdir)))
+    detIOC = params.detIOCList[0]
+    # The simulated noise falls with the peaking time, the gap time has no effect.
+    scanVarList = []
+    scanVarList = s_c.add2List('%s:dxp1:PeakingTime' %(detIOC), [0.25, 1, 4, 16], scanVarList)
+    scanVarList = s_c.add2List('%s:dxp1:GapTime' %(detIOC), [0.1, 0.2, 0.3], scanVarList)
+    fitDataFilePath = str(tmpdir.join('FitData.txt'))
+    bestPoint, bestFWHM_keV = a_s.doAdaptiveScan(params, pvLogFile, scanVarList, 4.02, fitDataFilePath,
+                                                 range(250, 300), 1, 300, 700, 5, numCoarse = 2)
+    a_p.finalize(params.logPVs, pvLogFile)
+    assert bestPoint[0][1] == 16
+    masterDict = p_s.readBackFitData(fitDataFilePath, True)
+    # Every point measured was fitted, and the sweep did not need all of them.
+    assert 0 < len(masterDict) < 4 * 3
+    assert bestFWHM_keV == min([fits[0]['fwhmNorm'] * 4.02 for fits in masterDict.values()])
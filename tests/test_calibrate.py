@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import pv_control as p_c
+import calibrate as cal
+import sim_ioc
+
+@pytest.fixture
+def simIOC():
+    ioc = sim_ioc.SimIOC(connLatency = 0.0, getLatency = 0.0, putLatency = 0.001, applyLatency = 0.0)
+    p_c.setBackend(ioc)
+    yield ioc
+    p_c.setBackend(None)
+
+def test_getSpectra_keeps_native_dtype(simIOC):
+    spectra = cal.getSpectra('TEST', 4, None, None)
+    assert spectra.shape == (4, 2048)
+    assert spectra.dtype == simIOC.read('TEST:mca1').dtype
+    assert np.array_equal(spectra[2], simIOC.read('TEST:mca3'))
+
+def test_getSpectra_reads_only_the_range(simIOC):
+    spectra = cal.getSpectra('TEST', 4, 300, 500, chans = [1, 3])
+    assert spectra.shape == (2, 200)
+    assert np.array_equal(spectra[1], simIOC.read('TEST:mca4')[300:500])
+
+class CalParams(object):
+    numChans = 100
+    mcaIOC = 'SR12ID01DET01'
+    detIOCList = ['SR12ID01IOC53', 'SR12ID01IOC54']
+    dxpVer = '3_1'
+    pkEnergies_keV = [4.02]
+    numPksInRange = 1
+    pkRangeMin = 360
+    pkRangeMax = 420
+    logPVs = False
+    verbose = False
+
+def test_runCalPipeline_writes_gains_while_reading(monkeypatch):
+    ioc = sim_ioc.SimIOC(connLatency = 0.0, getLatency = 0.005, putLatency = 0.001, applyLatency = 0.0, gainSpread = 0.01)
+    ioc.realTime = 1.0
+    p_c.setBackend(ioc)
+    events = []
+    getSpectra = cal.getSpectra
+    caputMany = p_c.caputMany
+    def recordGet(*args, **kws):
+        events.append('read')
+        return getSpectra(*args, **kws)
+    def recordPut(pvValPairs, *args, **kws):
+        events.append('write')
+        return caputMany(pvValPairs, *args, **kws)
+    monkeypatch.setattr(cal, 'getSpectra', recordGet)
+    monkeypatch.setattr(p_c, 'caputMany', recordPut)
+    try:
+        calPoints, fwhms, pkCounts = cal.runCalPipeline(CalParams(), None, range(250, 300), 5, False, blockSize = 5)
+        autoApply = [ioc.read('%s:AutoApply' %(detIOC)) for detIOC in CalParams.detIOCList]
+        gains = [ioc.read('SR12ID01IOC53:dxp%d:PreampGain' %(chan)) for chan in range(1, 53)]
+    finally:
+        p_c.setBackend(None)
+    # Each block of gains is written as it is done, so the writes start before the last read.
+    assert events.count('read') == 20
+    assert events.count('write') == 20
+    assert events.index('write') < len(events) - 1 - events[::-1].index('read')
+    assert all([len(points) == 1 for points in calPoints])
+    assert all([gain != 1.0 for gain in gains])
+    assert autoApply == [1, 1]
+
+def test_getNextCountTime_changes_by_at_most_a_factor_of_two():
+    # Far more counts than needed would drop straight to the minimum.
+    assert cal.getNextCountTime(60.0, [10.0], [1e9], 1.0, 1.0, 60.0) == 30.0
+    # Far too few counts would jump straight to the maximum.
+    assert cal.getNextCountTime(1.0, [10.0], [1.0], 1.0, 1.0, 60.0) == 2.0
+    # No peaks found.
+    assert cal.getNextCountTime(40.0, [], [], 1.0, 1.0, 60.0) == 60.0
+
+def test_getNextCountTime_counts_longer_for_channels_with_no_peak():
+    # The channel with a peak has enough counts, but the other has no peak.
+    assert cal.getNextCountTime(10.0, [10.0, None], [1e9, 0], 1.0, 1.0, 60.0) == 20.0
+    assert cal.getNextCountTime(10.0, [None], [0], 1.0, 1.0, 60.0) == 20.0
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import checkpoint as ckp
+
+point0 = [('det:dxp1:PeakingTime', np.float64(4.0)), ('det:dxp1:GapTime', 0.2)]
+point1 = [('det:dxp1:PeakingTime', 8), ('det:dxp1:GapTime', 0.2)]
+
+def test_journal_reopen(tmpdir):
+    journalPath = ckp.getJournalPath(str(tmpdir))
+    journal = ckp.SweepJournal(journalPath)
+    assert not journal.isDone(0)
+    journal.record(np.int64(0), point0, 'a.nc', 1.0, 2.0)
+    journal.record(1, point1, 'b.nc', 2.0, 3.0)
+    assert journal.isDone(0, point0)
+    journal.close()
+
+    journal = ckp.SweepJournal(journalPath)
+    assert journal.isDone(0, point0) and journal.isDone(1, point1)
+    assert not journal.isDone(2)
+    assert journal.points[1]['filePath'] == 'b.nc'
+    journal.close()
+
+def test_journal_ignores_cut_short_line(tmpdir):
+    journalPath = ckp.getJournalPath(str(tmpdir))
+    journal = ckp.SweepJournal(journalPath)
+    journal.record(0, point0, 'a.nc', 1.0, 2.0)
+    journal.close()
+    # A crash part way through writing point 1.
+    with open(journalPath, 'a') as journalFile:
+        journalFile.write('{"index": 1, "pvs": [["det:dxp1:Pea')
+
+    journal = ckp.SweepJournal(journalPath)
+    assert journal.isDone(0) and not journal.isDone(1)
+    journal.record(1, point1, 'b.nc', 2.0, 3.0)
+    journal.close()
+
+    # The point recorded after the cut short line is on a line of its own.
+    journal = ckp.SweepJournal(journalPath)
+    assert journal.isDone(0, point0) and journal.isDone(1, point1)
+    journal.close()
+
+def test_journal_rejects_another_sweep(tmpdir):
+    journal = ckp.SweepJournal(ckp.getJournalPath(str(tmpdir)))
+    journal.record(0, point0, 'a.nc', 1.0, 2.0)
+    with pytest.raises(AssertionError):
+        journal.isDone(0, point1)
+    journal.close()
+
+def test_PV_log_paths_in_order(tmpdir):
+    outDirStr = str(tmpdir)
+    assert ckp.getPVLogPaths(outDirStr) == [str(tmpdir.join('pvList.txt'))]
+    assert ckp.getResumePVLogPath(outDirStr) == str(tmpdir.join('pvList_resume1.txt'))
+    for resumeNum in [2, 10, 1]:
+        tmpdir.join('pvList_resume%d.txt' %(resumeNum)).write('')
+    assert ckp.getPVLogPaths(outDirStr) == [str(tmpdir.join(fileName)) for fileName in
+                                            ['pvList.txt', 'pvList_resume1.txt', 'pvList_resume2.txt', 'pvList_resume10.txt']]
+    assert ckp.getResumePVLogPath(outDirStr) == str(tmpdir.join('pvList_resume4.txt'))
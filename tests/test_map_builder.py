@@ -0,0 +1,11 @@
+import map_builder as m_b
+
+def test_ioc_chan_counts():
+    assert m_b.getIOCChanCounts(100, 2) == [52, 48]
+    assert m_b.getIOCChanCounts(32, 1) == [32]
+    assert m_b.getIOCChanCounts(10, 2) == [8, 2]
+
+def test_ioc_chan_offsets():
+    detIOCList = ['SR12ID01IOC53', 'SR12ID01IOC54']
+    assert m_b.getIOCChanOffsets(detIOCList, 100) == [0, 52]
+    assert m_b.getIOCChanOffsets(['SR12ID01IOC54'], 100, detIOCList) == [52]
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+import numpy as np
+import pytest
+import map_reader as m_r
+import xmap_files as x_f
+
+nBins = 64
+bufWords = 256 + 3 * (256 + 4 * nBins)
+
+def writeBuffers(filePath, numBuffers, numModules = 2, version = 1, numPixels = 3):
+    rng = np.random.RandomState(1)
+    buffers = [x_f.makeBuffer(numModules, bufWords, bufNum * 3, numPixels, nBins, bufNum, rng) for bufNum in range(numBuffers)]
+    headerSize, recSize = x_f.writeFile(filePath, buffers, bufWords, version)
+    return buffers, headerSize, recSize
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_header(tmpdir, version):
+    filePath = str(tmpdir.join('map.nc'))
+    buffers, headerSize, recSize = writeBuffers(filePath, 2, version = version)
+    ncFile = m_r.NCFile(filePath)
+    assert ncFile.version == version
+    assert ncFile.atts['comment'] == 'xmap test'
+    assert ncFile.vars['array_data']['shape'] == (2, bufWords)
+    assert ncFile.recSize == recSize
+    assert ncFile.getNumRecs() == 2
+    assert int(ncFile.getVar('uniqueId', 1)) == 2
+
+def test_buffers(tmpdir):
+    filePath = str(tmpdir.join('map.nc'))
+    buffers = writeBuffers(filePath, 2)[0]
+    mapBuffers = list(m_r.iterBuffers(filePath))
+    assert len(mapBuffers) == 2
+    for mapBuffer, (words, spectra, realTicks, liveTicks) in zip(mapBuffers, buffers):
+        assert mapBuffer.numModules == 2
+        assert mapBuffer.nBins == nBins
+        assert np.array_equal(mapBuffer.getSpectra(), spectra)
+        realTimes_s, liveTimes_s, triggers, outEvents = mapBuffer.getStats()
+        assert np.allclose(realTimes_s, realTicks * m_r.tickTime_s)
+        assert np.allclose(liveTimes_s, liveTicks * m_r.tickTime_s)
+    assert [int(pixNum) for mapBuffer in mapBuffers for pixNum in mapBuffer.getPixNums()] == range(6)
+
+def test_pixels_and_spectra(tmpdir):
+    filePath = str(tmpdir.join('map.nc'))
+    buffers = writeBuffers(filePath, 1)[0]
+    pixels = list(m_r.iterPixels(filePath))
+    assert [pixel[0] for pixel in pixels] == [0, 1, 2]
+    assert np.array_equal(pixels[1][1], buffers[0][1][1])
+    spectra = list(m_r.iterSpectra(filePath))
+    assert len(spectra) == 3 * 8
+    pixNum, detChan, spectrum = spectra[13]
+    assert (pixNum, detChan) == (1, 5)
+    assert np.array_equal(spectrum, buffers[0][1][1, 1, 1])
+
+def test_partial_record_is_not_read(tmpdir):
+    filePath = str(tmpdir.join('map.nc'))
+    buffers, headerSize, recSize = writeBuffers(filePath, 2)
+    data = open(filePath, 'rb').read()
+    # Cut the second record short, then tell the reader there is a full record by padding with zeros.
+    with open(filePath, 'wb') as ncFile:
+        ncFile.write(data[:headerSize + recSize + recSize // 2])
+    assert len(list(m_r.iterBuffers(filePath))) == 1
+    with open(filePath, 'ab') as ncFile:
+        ncFile.write('\x00' * (recSize - recSize // 2))
+    assert len(list(m_r.iterBuffers(filePath, follow = True, pollTime = 0.01, timeout = 0.05))) == 1
+
+def test_isBufComplete_needs_the_last_pixel_block():
+    rng = np.random.RandomState(0)
+    words = x_f.makeBuffer(1, bufWords, 0, 3, nBins, 0, rng)[0]
+    assert m_r.isBufComplete(words)
+    # The buffer says it has a fourth pixel that doesn't fit in the record.
+    words[:, 8] = 4
+    assert not m_r.isBufComplete(words)
+    # The block size of the pixels is not there yet.
+    words[:, 8] = 3
+    words[:, 256 + 6] = 0
+    assert not m_r.isBufComplete(words)
+
+def test_follow_times_out_from_the_last_progress(tmpdir):
+    filePath = str(tmpdir.join('map.nc'))
+    writeBuffers(filePath, 1)
+    data = open(filePath, 'rb').read()
+    os.remove(filePath)
+
+    def writer():
+        # The file appears late, then the record is written slowly.
+        for part in [data[:len(data) // 3], data[len(data) // 3:2 * len(data) // 3], data[2 * len(data) // 3:]]:
+            time.sleep(0.06)
+            with open(filePath, 'ab') as ncFile:
+                ncFile.write(part)
+
+    thread = threading.Thread(target = writer)
+    thread.start()
+    mapBuffers = list(m_r.iterBuffers(filePath, follow = True, pollTime = 0.005, timeout = 0.1, numBuffers = 1))
+    thread.join()
+    assert len(mapBuffers) == 1
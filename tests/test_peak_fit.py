@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import peak_fit as pkf
+
+fitArgs = (1, 300, 700, range(250, 300), 5)
+
+def getSpectra(numSpectra, seed = 0):
+    """ Make Poisson spectra of a Gaussian peak between bins 370 and 410 on a
+        falling background, returning them with the centres and FWHMs.
+    """
+    rng = np.random.RandomState(seed)
+    x = np.arange(2048.)
+    spectra, cents, fwhms = [], [], []
+    for specIdx in range(numSpectra):
+        cent, fwhm = rng.uniform(370, 410), rng.uniform(12, 30)
+        amp, bg = rng.uniform(2e4, 2e5), rng.uniform(5, 50)
+        sig = fwhm / 2.3548
+        model = bg * (1 + 5 * np.exp(-x / 200.)) + amp / (sig * np.sqrt(2 * np.pi)) * np.exp(-(x - cent)**2 / (2 * sig**2))
+        spectra.append(rng.poisson(model).astype(float))
+        cents.append(cent)
+        fwhms.append(fwhm)
+    return np.array(spectra), np.array(cents), np.array(fwhms)
+
+@pytest.mark.parametrize('refine', [False, True])
+def test_fitMany_matches_fit(refine):
+    spectra = getSpectra(20)[0]
+    # An empty and a very weak channel, as a dead MCA gives.
+    spectra[5] = 0
+    spectra[7] *= 0.001
+    manyCalPoints, manyFits, manyFWHMs = pkf.fitMany(spectra, *(fitArgs + (False, refine)))
+    assert len(manyCalPoints) == len(manyFits) == len(manyFWHMs) == len(spectra)
+    numFound = 0
+    for idx, spec in enumerate(spectra):
+        calPoints, fits, fwhms = pkf.fit(spec, '.', idx, *(fitArgs + (False, False, False, refine)))
+        numFound += len(calPoints)
+        assert len(manyCalPoints[idx]) == len(calPoints)
+        assert np.allclose(manyCalPoints[idx], calPoints, rtol = 1e-6)
+        assert np.allclose(manyFWHMs[idx], fwhms, rtol = 1e-6)
+        assert len(manyFits[idx]) == len(fits)
+        for (manyBins, manyVals), (bins, vals) in zip(manyFits[idx], fits):
+            assert np.array_equal(manyBins, bins)
+            assert np.allclose(manyVals, vals, rtol = 1e-6)
+    # The peak is found in every channel but the empty and weak ones.
+    assert numFound >= len(spectra) - 2
+
+def test_getPeak_index_slices():
+    histo = np.array([1., 5., 9., 9., 2.])
+    pkIndex, pkVal = pkf.getPeak(histo)
+    # The first of the maximum bins, as an index that can slice the histo.
+    assert pkIndex == 2 and pkVal == 9
+    assert list(histo[:pkIndex]) == [1., 5.]
+
+def test_refined_fit_is_closer():
+    spectra, cents, fwhms = getSpectra(40, seed = 1)
+    gridCalPoints, gridFits, gridFWHMs = pkf.fitMany(spectra, *(fitArgs + (False, False)))
+    calPoints, fits, refinedFWHMs = pkf.fitMany(spectra, *(fitArgs + (False, True)))
+    gridCents = np.array([calPoint[0] for calPoint in gridCalPoints])
+    refinedCents = np.array([calPoint[0] for calPoint in calPoints])
+    # The least-squares fit is not limited to the grid, so the centres are closer.
+    assert np.sqrt(np.mean((refinedCents - cents)**2)) < np.sqrt(np.mean((gridCents - cents)**2))
+    assert np.all(np.abs(refinedCents - cents) < 2)
+    assert np.all(np.abs(np.array([fwhm[0] for fwhm in refinedFWHMs]) - fwhms) < 0.25 * fwhms)
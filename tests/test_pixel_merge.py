@@ -0,0 +1,65 @@
+import numpy as np
+import spec_store as s_s
+import pixel_merge as p_m
+
+nBins = 16
+
+def makePixel(pixNum, numChans, streamIdx):
+    spectra = np.zeros((numChans // 4, 4, nBins), dtype = np.uint16)
+    spectra[...] = 100 * streamIdx + pixNum
+    times_s = np.ones(numChans) * (pixNum + 0.5)
+    return pixNum, spectra, times_s, times_s / 2.0
+
+def makeStream(pixNums, numChans, streamIdx):
+    return [makePixel(pixNum, numChans, streamIdx) for pixNum in pixNums]
+
+def merge(streamPixNums, maxPending = 4):
+    merger = p_m.PixelMerger([makeStream(pixNums, 8, streamIdx) for streamIdx, pixNums in enumerate(streamPixNums)],
+                             [8] * len(streamPixNums), maxPending = maxPending, nBins = nBins)
+    return list(merger), merger
+
+def test_in_order():
+    pixels, merger = merge([range(5), range(5)])
+    assert [pixel[0] for pixel in pixels] == range(5)
+    pixNum, spectra, realTimes_s, liveTimes_s, present = pixels[3]
+    assert spectra.shape == (16, nBins)
+    assert np.all(spectra[:8] == 3) and np.all(spectra[8:] == 103)
+    assert np.all(realTimes_s == 3.5) and np.all(liveTimes_s == 1.75)
+    assert present == [True, True]
+    assert merger.numMerged == 5
+
+def test_out_of_order_within_pending():
+    pixels, merger = merge([[1, 0, 3, 2, 4], range(5)])
+    assert [pixel[0] for pixel in pixels] == range(5)
+    assert merger.numMissing == [0, 0]
+
+def test_missing_pixel():
+    pixels, merger = merge([[0, 1, 3, 4], range(5)])
+    pixNum, spectra, realTimes_s, liveTimes_s, present = pixels[2]
+    assert present == [False, True]
+    assert np.all(spectra[:8] == 0) and np.all(np.isnan(realTimes_s[:8]))
+    assert merger.numMissing == [1, 0]
+
+def test_late_pixel_is_not_a_duplicate():
+    # Pixel 1 of stream 0 comes after maxPending later pixels, so it has been merged as missing.
+    pixels, merger = merge([[0, 2, 3, 4, 5, 1, 6, 6], range(7)], maxPending = 4)
+    assert [pixel[0] for pixel in pixels] == range(7)
+    assert pixels[1][4] == [False, True]
+    assert merger.numMissing == [1, 0]
+    assert merger.numLate == [1, 0]
+    assert merger.numDuplicates == [1, 0]
+
+def test_gap_in_every_stream():
+    pixels, merger = merge([[0, 1, 5, 6], [0, 1, 5, 6]])
+    assert [pixel[0] for pixel in pixels] == [0, 1, 5, 6]
+    assert merger.numMissing == [3, 3]
+
+def test_store_batches(tmpdir):
+    pixels, merger = merge([range(10), range(10)])
+    specStore = s_s.SpecStore(str(tmpdir), 'mapPixels', 'a')
+    specStore.appendMany([(pixNum, spectra, None) for pixNum, spectra, realTimes_s, liveTimes_s, present in pixels[:6]])
+    specStore.appendMany([(pixNum, spectra, None) for pixNum, spectra, realTimes_s, liveTimes_s, present in pixels[6:]])
+    specStore.appendMany([])
+    spectra, index = s_s.SpecStore(str(tmpdir), 'mapPixels').read()
+    assert [entry['acquisIdx'] for entry in index] == range(10)
+    assert np.array_equal(spectra, [pixel[1] for pixel in pixels])
@@ -0,0 +1,59 @@
+import time
+import pytest
+import pv_control as p_c
+import sim_ioc
+
+@pytest.fixture
+def simIOC():
+    ioc = sim_ioc.SimIOC(connLatency = 0.0, getLatency = 0.0, putLatency = 0.001, applyLatency = 0.0,
+                         deadPVs = ['TEST:dead'], stuckPVs = ['TEST:stuck'])
+    p_c.setBackend(ioc)
+    p_c.setWriteSuppression(True)
+    p_c.shadowCache.skipped = 0
+    yield ioc
+    p_c.setWriteSuppression(False)
+    p_c.setBackend(None)
+
+def waitForPut(pvName):
+    pv = p_c.pvRegistry.getPV(pvName)
+    startTime = time.time()
+    while not pv.put_complete and time.time() - startTime < 1.0:
+        time.sleep(0.001)
+
+def test_caputPV_skips_repeated_write(simIOC):
+    p_c.caputPV('TEST:val', 1.5, None, False, False)
+    waitForPut('TEST:val')
+    p_c.caputPV('TEST:val', 1.5, None, False, False)
+    assert p_c.shadowCache.skipped == 1
+
+def test_caputPV_does_not_cache_disconnected_PV(simIOC):
+    assert p_c.caputPV('TEST:dead', 1.0, None, False, False) is None
+    p_c.caputPV('TEST:dead', 1.0, None, False, False)
+    assert p_c.shadowCache.skipped == 0
+    assert 'TEST:dead' not in p_c.shadowCache.vals
+
+def test_caputPV_does_not_cache_incomplete_put(simIOC):
+    p_c.caputPV('TEST:stuck', 2.0, None, False, False)
+    time.sleep(0.01)
+    assert not p_c.shadowCache.isSame('TEST:stuck', 2.0)
+
+def test_ioc_owned_PVs_are_never_skipped(simIOC):
+    for pvName in ['TEST:netCDF1:FileNumber', 'TEST:saveData_scanNumber']:
+        p_c.caputPV(pvName, 3, None, False, False)
+        waitForPut(pvName)
+        p_c.cagetPV(pvName, False)
+        assert not p_c.shadowCache.isSame(pvName, 3)
+    assert p_c.shadowCache.skipped == 0
+
+def test_caputMany_logs_only_completed_puts(simIOC, tmpdir):
+    p_c.pvRegistry.putTimeout = 0.05
+    try:
+        pvLogFile = p_c.setFile(str(tmpdir.join('pvList.txt')))
+        pvVals = p_c.caputMany([('TEST:a', 1.0), ('TEST:dead', 2.0), ('TEST:stuck', 3.0), ('TEST:b', 4.0)], pvLogFile, True, False)
+        p_c.closeFile(pvLogFile)
+    finally:
+        p_c.pvRegistry.putTimeout = 30.0
+    assert pvVals == [1.0, None, None, 4.0]
+    assert tmpdir.join('pvList.txt').read().splitlines() == ['PV, Value ', 'TEST:a, 1.0 ', 'TEST:b, 4.0 ']
+    assert p_c.shadowCache.isSame('TEST:a', 1.0)
+    assert not p_c.shadowCache.isSame('TEST:stuck', 3.0)
@@ -0,0 +1,116 @@
+import itertools as it
+import pytest
+import scan_config as s_c
+
+def getLists():
+    scanVarList = []
+    scanVarList = s_c.add2List('IOC:dxp1:PeakingTime', [1, 2, 4], scanVarList)
+    scanVarList = s_c.add2List('IOC:dxp1:GapTime', [0.1, 0.2], scanVarList)
+    scanVarList = s_c.add2List('IOC:dxp1:BaselineFilterLength', [64, 128, 256, 512], scanVarList)
+    return scanVarList
+
+def getVals(point):
+    return tuple([val for pvName, val in point])
+
+def test_product_matches_itertools():
+    scanVarList = getLists()
+    assert [getVals(point) for point in s_c.product(scanVarList)] == [getVals(point) for point in it.product(*scanVarList)]
+
+def test_snake_changes_one_PV_per_point():
+    plan = s_c.product(getLists(), snake = True)
+    points = list(plan)
+    assert sorted([getVals(point) for point in points]) == sorted([getVals(point) for point in it.product(*getLists())])
+    for point, prevPoint in zip(points[1:], points[:-1]):
+        assert len(s_c.getChangedPVs(point, prevPoint)[0]) == 1
+    assert s_c.getNumChanges(plan) == 3 + len(points) - 1
+
+def test_snake_changes_expensive_PV_least():
+    points = list(s_c.product(getLists(), snake = True))
+    numChanges = [sum([1 for point, prevPoint in zip(points[1:], points[:-1]) if point[listIdx] != prevPoint[listIdx]]) for listIdx in range(3)]
+    # The baseline filter length is weighted so it changes the fewest times, then the list with the fewest values.
+    assert numChanges[2] == 3
+    assert numChanges[1] == 4
+    assert numChanges[0] == 16
+
+def test_snake_keeps_PV_order():
+    for point in s_c.product(getLists(), snake = True):
+        assert [pvName for pvName, val in point] == ['IOC:dxp1:PeakingTime', 'IOC:dxp1:GapTime', 'IOC:dxp1:BaselineFilterLength']
+
+def test_plan_indexing():
+    scanVarList = getLists()
+    points = list(it.product(*scanVarList))
+    plan = s_c.product(scanVarList)
+    assert len(plan) == 24
+    assert plan[0] == points[0]
+    assert plan[17] == points[17]
+    assert plan[-1] == points[-1]
+    with pytest.raises(IndexError):
+        plan[24]
+
+def test_plan_slicing():
+    scanVarList = getLists()
+    plan = s_c.product(scanVarList, snake = True)
+    points = list(plan)
+    assert list(plan[5:]) == points[5:]
+    assert list(plan[3:20:4]) == points[3:20:4]
+    assert list(plan[::-1]) == points[::-1]
+    assert list(plan[3:20:4][1:]) == points[3:20:4][1:]
+    assert len(plan[30:]) == 0
+
+def test_big_plan_is_lazy():
+    # 10 lists of 10 values is far too many points to hold in memory.
+    scanVarList = []
+    for listIdx in range(10):
+        scanVarList = s_c.add2List('IOC:pv%i' %(listIdx), range(10), scanVarList)
+    plan = s_c.product(scanVarList, snake = True)
+    assert len(plan) == 10 ** 10
+    assert len(s_c.getChangedPVs(plan[10 ** 10 - 1], plan[10 ** 10 - 2])[0]) == 1
+
+def test_getNumInRange():
+    for start, stop, step in it.product(range(-3, 8), range(-3, 8), [-3, -2, -1, 1, 2, 3]):
+        assert s_c.getNumInRange(start, stop, step) == len(range(start, stop, step))
+
+def test_getSliceIndices():
+    for start, stop, step in it.product([None, -12, -5, -1, 0, 3, 9, 12], [None, -12, -5, -1, 0, 3, 9, 12], [None, -3, -1, 1, 2]):
+        key = slice(start, stop, step)
+        assert s_c.getSliceIndices(key, 10) == key.indices(10)
+
+def test_plan_past_a_C_long():
+    # 70 lists of 2 values overflow xrange here as 2**31 points do on 32 bit Windows.
+    scanVarList = []
+    for listIdx in range(70):
+        scanVarList = s_c.add2List('IOC:pv%i' %(listIdx), [0, 1], scanVarList)
+    plan = s_c.product(scanVarList)
+    numPoints = 2 ** 70
+    tail = plan[numPoints - 3:]
+    assert len(tail) == 3
+    assert [getVals(point) for point in tail] == [tuple([1] * 68 + [0, 1]), tuple([1] * 69 + [0]), tuple([1] * 70)]
+    assert getVals(next(iter(plan))) == tuple([0] * 70)
+    assert len(plan[numPoints - 10::4]) == 3
+
+def test_getChangedPVs():
+    prevPoint = (['IOC:a', 1], ['IOC:b', 2.0], ['IOC:c', 'x'])
+    point = (['IOC:a', 1], ['IOC:b', 3.0], ['IOC:c', 'x'])
+    assert s_c.getChangedPVs(point, prevPoint) == ([['IOC:b', 3.0]], [['IOC:a', 1], ['IOC:c', 'x']])
+    assert s_c.getChangedPVs(point, None) == (list(point), [])
+    # A PV that was not in the previous point is changed.
+    assert s_c.getChangedPVs(point + (['IOC:d', 0],), prevPoint)[0] == [['IOC:b', 3.0], ['IOC:d', 0]]
+
+def test_sortByWriteOrder():
+    pvValPairs = [['IOC:dxp1:PeakingTime', 1],
+                  ['IOC:AutoPixelsPerBuffer', 0],
+                  ['IOC:GapTime', 0.1],
+                  ['IOC:PixelsPerBuffer', 10],
+                  ['IOC:PixelsPerRun', 100]]
+    assert [pvName for pvName, val in s_c.sortByWriteOrder(pvValPairs, s_c.xmapWriteOrder)] == ['IOC:PixelsPerRun',
+                                                                                                 'IOC:PixelsPerBuffer',
+                                                                                                 'IOC:AutoPixelsPerBuffer',
+                                                                                                 'IOC:dxp1:PeakingTime',
+                                                                                                 'IOC:GapTime']
+    assert s_c.sortByWriteOrder(pvValPairs, []) == pvValPairs
+
+def test_getNumChanges():
+    points = [(['IOC:a', 1], ['IOC:b', 1]),
+              (['IOC:a', 1], ['IOC:b', 2]),
+              (['IOC:a', 2], ['IOC:b', 3])]
+    assert s_c.getNumChanges(points) == 2 + 1 + 2
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import spec_store as s_s
+import param_sweep as p_s
+
+def makeStore(storeDir, numSpecs):
+    specStore = s_s.SpecStore(storeDir, mode = 'a')
+    specs = [np.arange(8, dtype = np.uint32) + 100 * acquisIdx for acquisIdx in range(numSpecs)]
+    for acquisIdx, spec in enumerate(specs):
+        specStore.append(acquisIdx, spec, [('IOC:dxp1:PeakingTime', np.float64(acquisIdx))])
+    return specs
+
+def crash(tmpdir):
+    # A spectrum written without its index line, and a cut short index line.
+    with open(str(tmpdir.join('spectra.bin')), 'ab') as binFile:
+        binFile.write(np.arange(3, dtype = np.uint32).tobytes())
+    with open(str(tmpdir.join('spectra_index.txt')), 'a') as indexFile:
+        indexFile.write('{"acquisIdx": 3, "ti')
+
+def test_read_back(tmpdir):
+    specs = makeStore(str(tmpdir), 3)
+    spectra, index = s_s.SpecStore(str(tmpdir)).read()
+    assert spectra.dtype == np.uint32
+    assert np.array_equal(spectra, specs)
+    assert [entry['pvs'] for entry in index] == [[['IOC:dxp1:PeakingTime', float(acquisIdx)]] for acquisIdx in range(3)]
+
+def test_read_mode_leaves_files_alone(tmpdir):
+    makeStore(str(tmpdir), 3)
+    crash(tmpdir)
+    before = [tmpdir.join(name).read('rb') for name in ['spectra.bin', 'spectra_index.txt']]
+    specStore = s_s.SpecStore(str(tmpdir))
+    assert len(specStore) == 3
+    assert [tmpdir.join(name).read('rb') for name in ['spectra.bin', 'spectra_index.txt']] == before
+    with pytest.raises(AssertionError):
+        specStore.append(3, np.zeros(8, dtype = np.uint32))
+
+def test_read_mode_uses_only_complete_spectra(tmpdir):
+    makeStore(str(tmpdir), 3)
+    # An index line whose spectrum is not all there yet.
+    with open(str(tmpdir.join('spectra_index.txt')), 'a') as indexFile:
+        indexFile.write('{"acquisIdx": 3, "time": 0, "pvs": []}\n')
+    assert len(s_s.SpecStore(str(tmpdir))) == 3
+
+def test_append_mode_repairs_and_resumes(tmpdir):
+    specs = makeStore(str(tmpdir), 3)
+    crash(tmpdir)
+    specStore = s_s.SpecStore(str(tmpdir), mode = 'a')
+    assert len(specStore) == 3
+    assert tmpdir.join('spectra.bin').size() == 3 * 8 * 4
+    # Point 2 is repeated on resuming, then the sweep carries on.
+    for acquisIdx in [2, 3]:
+        specStore.append(acquisIdx, specs[0] + 1000 * acquisIdx)
+    specStore = s_s.SpecStore(str(tmpdir))
+    spectra, index = specStore.read()
+    assert len(specStore) == 5
+    assert specStore.getLatestRows() == [(0, 0), (1, 1), (2, 3), (3, 4)]
+    assert np.array_equal(spectra[3], specs[0] + 2000)
+
+def test_fitStoreData_fits_latest_spectra(tmpdir):
+    # A Gaussian peak with a FWHM of 20 bins on a flat background.
+    x = np.arange(2048.)
+    cents = [380.0, 395.0, 405.0]
+    spectra = [np.round(10 + 5000 * np.exp(-(x - cent)**2 / (2 * (20 / 2.3548)**2))) for cent in cents]
+    specStore = s_s.SpecStore(str(tmpdir), mode = 'a')
+    # Point 1 was done again on resuming, only its second spectrum counts.
+    for acquisIdx, spec in [(0, spectra[0]), (1, np.zeros(2048)), (1, spectra[1]), (2, spectra[2])]:
+        specStore.append(acquisIdx, spec)
+    fitDataFilePath = str(tmpdir.join('FitData.txt'))
+    p_s.fitStoreData(str(tmpdir), fitDataFilePath, range(250, 300), 1, 300, 700, 5, False)
+    masterDict = p_s.readBackFitData(fitDataFilePath, True)
+    assert sorted(masterDict) == [0, 1, 2]
+    for acquisIdx in range(3):
+        assert abs(masterDict[acquisIdx][0]['fitPeakIndex'] - cents[acquisIdx]) < 2
@@ -0,0 +1,86 @@
+import os
+import importlib
+import pytest
+import acquis_params as a_p
+import scan_config as s_c
+import checkpoint as ckp
+import param_sweep as p_s
+
+# The script name has hyphens, so it can't be imported with an import statement.
+b_s = importlib.import_module('batch_scan_wait-for-mcas')
+
+def runSweep(params, scanVarList):
+    params, pvLogFile = a_p.initialize(params)
+    b_s.params = params
+    journal = ckp.SweepJournal(ckp.getJournalPath(params.outDirStr))
+    try:
+        b_s.doBatchScan(params.scanType, params.scanIOC, params.countTime, params.detIOCList, params.detector, pvLogFile,
+                        params.logPVs, params.verbose, scanVarList, params.outBase, params.timeStamp, journal)
+    finally:
+        # Close the files as a crashed run would leave them.
+        journal.close()
+        a_p.finalize(params.logPVs, pvLogFile)
+    return params
+
+def test_resumed_sweep_log_parses(simIOC, getParams, tmpdir):
+    detIOC = 'SR12ID01IOC56'
+    scanVarList = []
+    scanVarList = s_c.add2List('%s:dxp1:PeakingTime' %(detIOC), [1, 2, 4], scanVarList)
+    scanVarList = s_c.add2List('%s:dxp1:GapTime' %(detIOC), [0.1, 0.2], scanVarList)
+    scanVarList = s_c.product(scanVarList, snake = True)
+
+    # Stop after 2 of the 6 points, then resume.
+    params = runSweep(getParams(str(tmpdir)), scanVarList[:2])
+    runSweep(getParams(str(tmpdir), params.timeStamp), scanVarList)
+
+    pvLogPaths = ckp.getPVLogPaths(params.outDirStr)
+    assert [os.path.basename(pvLogPath) for pvLogPath in pvLogPaths] == ['pvList.txt', 'pvList_resume1.txt']
+    pvListOfLists = p_s.getWrittenPVChunks('%s:ClientWait' %(detIOC), pvLogPaths, '%s:scan1.EXSC' %(detIOC), detIOC)
+    assert len(pvListOfLists) == len(scanVarList)
+    for pvList, line in zip(pvListOfLists, scanVarList):
+        pvVals = dict(pvList)
+        for pv2Set, val2Write in line:
+            assert pvVals[pv2Set] == val2Write
+
+def test_setup_after_marker_is_skipped(tmpdir):
+    # A log from before resumes had their own file has the set up in the middle.
+    pvLogPath = tmpdir.join('pvList.txt')
+    pvLogPath.write('PV, Value \n'
+                    'IOC:ClientWait, Done \n'
+                    'IOC:dxp1:GapTime, 0.1 \n'
+                    'IOC:scan1.EXSC, 1 \n'
+                    'IOC:dxp1:GapTime, 0.2 \n'
+                    'IOC:StatusAll.SCAN, Passive \n'
+                    'IOC:ClientWait, Done \n'
+                    'IOC:dxp1:GapTime, 0.3 \n'
+                    'IOC:scan1.EXSC, 1 \n')
+    pvListOfLists = p_s.getWrittenPVChunks('IOC:ClientWait', str(pvLogPath), 'IOC:scan1.EXSC', 'IOC')
+    assert pvListOfLists == [[('IOC:dxp1:GapTime', 0.1)], [('IOC:dxp1:GapTime', 0.3)]]
+
+def test_sweep_resumed_after_crash_in_acquire(simIOC, getParams, tmpdir, monkeypatch):
+    detIOC = 'SR12ID01IOC56'
+    scanVarList = []
+    scanVarList = s_c.add2List('%s:dxp1:PeakingTime' %(detIOC), [1, 2, 4], scanVarList)
+    scanVarList = s_c.add2List('%s:dxp1:GapTime' %(detIOC), [0.1, 0.2], scanVarList)
+    scanVarList = s_c.product(scanVarList, snake = True)
+
+    # Crash while waiting for the third point, after its PVs and EXSC are logged.
+    checkScanStatus = a_p.checkScanStatus
+    numChecks = [0]
+    def crashingCheck(*args):
+        numChecks[0] += 1
+        if numChecks[0] == 3:
+            raise RuntimeError('IOC went away')
+        return checkScanStatus(*args)
+    monkeypatch.setattr(a_p, 'checkScanStatus', crashingCheck)
+    params = getParams(str(tmpdir))
+    with pytest.raises(RuntimeError):
+        runSweep(params, scanVarList)
+    monkeypatch.setattr(a_p, 'checkScanStatus', checkScanStatus)
+    runSweep(getParams(str(tmpdir), params.timeStamp), scanVarList)
+
+    # The logs have the crashed point twice, the journal only once.
+    pvLogPaths = ckp.getPVLogPaths(params.outDirStr)
+    assert len(p_s.getWrittenPVChunks('%s:ClientWait' %(detIOC), pvLogPaths, '%s:scan1.EXSC' %(detIOC), detIOC)) == len(scanVarList) + 1
+    pvListOfLists = p_s.getJournalPVChunks(ckp.getJournalPath(params.outDirStr))
+    assert pvListOfLists == [[(pv2Set, float(val2Write)) for pv2Set, val2Write in line] for line in scanVarList]
@@ -0,0 +1,85 @@
+import struct
+import numpy as np
+
+""" Write netCDF files of XMAP mapping mode buffers, as the areaDetector
+    netCDF plugin does, for the map_reader tests.
+"""
+
+def packName(name):
+    return struct.pack('>i', len(name)) + name + '\x00' * (-len(name) % 4)
+
+def packAtt(name, ncType, vals):
+    if ncType == 2:
+        buf = vals
+    else:
+        buf = np.asarray(vals, {3 : '>i2', 4 : '>i4', 6 : '>f8'}[ncType]).tobytes()
+    return packName(name) + struct.pack('>ii', ncType, len(vals)) + buf + '\x00' * (-len(buf) % 4)
+
+def getHeader(numModules, bufWords, numRecs, version = 1):
+    """ Get the header of a file with uniqueId, timeStamp and array_data record
+        variables, and the size of each record.
+    """
+    dims = [('numArrays', 0), ('dim0', numModules), ('dim1', bufWords)]
+    header = 'CDF' + chr(version) + struct.pack('>I', numRecs)
+    header += struct.pack('>ii', 10, len(dims)) + ''.join([packName(name) + struct.pack('>i', dimLen) for name, dimLen in dims])
+    header += struct.pack('>ii', 12, 2) + packAtt('dataType', 4, [3]) + packAtt('comment', 2, 'xmap test')
+    ncVars = [('uniqueId', [0], 4, 4, []),
+              ('timeStamp', [0], 6, 8, []),
+              ('array_data', [0, 1, 2], 3, numModules * bufWords * 2, [packAtt('units', 2, 'counts')])]
+
+    def packVars(begins):
+        buf = struct.pack('>ii', 11, len(ncVars))
+        for (name, dimIds, ncType, numBytes, atts), begin in zip(ncVars, begins):
+            buf += packName(name) + struct.pack('>i', len(dimIds)) + ''.join([struct.pack('>i', dimId) for dimId in dimIds])
+            buf += struct.pack('>ii', 12, len(atts)) + ''.join(atts) if atts else struct.pack('>ii', 0, 0)
+            buf += struct.pack('>iI', ncType, numBytes) + (struct.pack('>I', begin) if version == 1 else struct.pack('>q', begin))
+        return buf
+
+    headerSize = len(header) + len(packVars([0] * len(ncVars)))
+    begins = []
+    offset = headerSize
+    for name, dimIds, ncType, numBytes, atts in ncVars:
+        begins.append(offset)
+        offset += numBytes + (-numBytes % 4)
+    return header + packVars(begins), offset - headerSize
+
+def makeBuffer(numModules, bufWords, startPix, numPixels, nBins, bufNum, rng):
+    """ Make the words of the buffers of every module, and the spectra, real
+        time and live time ticks that are in them.
+    """
+    words = np.zeros((numModules, bufWords), np.uint16)
+    blockWords = 256 + 4 * nBins
+    spectra = rng.randint(0, 60000, size = (numPixels, numModules, 4, nBins)).astype(np.uint16)
+    realTicks = rng.randint(0, 2 ** 31, size = (numPixels, numModules * 4))
+    liveTicks = rng.randint(0, 2 ** 31, size = (numPixels, numModules * 4))
+    for mod in range(numModules):
+        modWords = words[mod]
+        modWords[0:4] = [0x55AA, 0xAA55, 256, 1]
+        modWords[4:12] = [7, bufNum & 0xffff, bufNum >> 16, bufNum % 2, numPixels, startPix & 0xffff, startPix >> 16, mod]
+        modWords[12:20:2] = [mod * 4 + chan for chan in range(4)]
+        modWords[20:24] = nBins
+        for pix in range(numPixels):
+            first = 256 + pix * blockWords
+            pixNum = startPix + pix
+            modWords[first:first + 8] = [0x33CC, 0xCC33, 256, 1, pixNum & 0xffff, pixNum >> 16, blockWords & 0xffff, blockWords >> 16]
+            modWords[first + 8:first + 12] = nBins
+            for chan in range(4):
+                stats = first + 32 + 8 * chan
+                realTick, liveTick = realTicks[pix, mod * 4 + chan], liveTicks[pix, mod * 4 + chan]
+                modWords[stats:stats + 4] = [realTick & 0xffff, realTick >> 16, liveTick & 0xffff, liveTick >> 16]
+            modWords[first + 256:first + 256 + 4 * nBins] = spectra[pix, mod].ravel()
+    return words, spectra, realTicks, liveTicks
+
+def packRecord(words, uniqueId):
+    buf = struct.pack('>i', uniqueId) + struct.pack('>d', 1.5 * uniqueId) + words.astype('>u2').tobytes()
+    return buf + '\x00' * (-len(buf) % 4)
+
+def writeFile(filePath, buffers, bufWords, version = 1):
+    """ Write a file with a record for each buffer from makeBuffer.
+    """
+    header, recSize = getHeader(buffers[0][0].shape[0], bufWords, len(buffers), version)
+    with open(filePath, 'wb') as ncFile:
+        ncFile.write(header)
+        for uniqueId, (words, spectra, realTicks, liveTicks) in enumerate(buffers):
+            ncFile.write(packRecord(words, uniqueId + 1))
+    return len(header), recSize